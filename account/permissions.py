@@ -1,12 +1,14 @@
 from rest_framework import permissions
 
+from .roles import is_owner
+
 class IsOwnerAdminOrApproved(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # 允许管理员查看所有内容
         if request.user.is_staff:
             return True
         # 允许作者查看自己的内容
-        if hasattr(obj, 'author') and obj.author == request.user:
+        if is_owner(request.user, obj):
             return True
         # 允许查看已审核通过的内容
         return obj.is_create_approved
@@ -16,9 +18,9 @@ class IsOwnerOrAdmin(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         if request.user.is_authenticated:
-            if request.user.is_admin():
+            if request.user.is_admin:
                 return True
-            return obj.author == request.user
+            return is_owner(request.user, obj)
         return False
     def has_permission(self, request, view):
         if request.method in permissions.SAFE_METHODS:
@@ -0,0 +1,47 @@
+"""
+用户角色解析
+用户所属的组在同一请求内记在 user 对象上；配置了共享缓存时跨请求存入缓存，
+组成员变化时由 account.signals 清除缓存。进程内缓存无法通知其他进程，只在请求内缓存
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from community.utils import cache_is_shared
+
+AUDITOR_GROUP = 'auditors'
+
+
+def _cache_key(user_id):
+    return f'account:roles:{user_id}'
+
+
+def get_roles(user):
+    """返回用户所属组名的集合"""
+    if not user or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_cached_roles', None)
+    if roles is None:
+        shared = cache_is_shared()
+        roles = cache.get(_cache_key(user.pk)) if shared else None
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            if shared:
+                cache.set(_cache_key(user.pk), roles, getattr(settings, 'ROLE_CACHE_TIMEOUT', 300))
+        user._cached_roles = roles
+    return roles
+
+
+def is_auditor(user):
+    """超级管理员或审核组成员"""
+    if not user or not user.is_authenticated:
+        return False
+    return user.is_superuser or AUDITOR_GROUP in get_roles(user)
+
+
+def is_owner(user, obj):
+    """按外键id比较，避免加载作者记录"""
+    return bool(user and user.is_authenticated) and getattr(obj, 'author_id', None) == user.pk
+
+
+def invalidate_roles(user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,30 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import User
+from .roles import invalidate_roles
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """用户与组的关系变化后清除角色缓存"""
+    if action == 'pre_clear' and reverse:
+        # 清空组成员时先记录受影响的用户
+        instance._cleared_user_ids = list(instance.user_set.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_roles([instance.pk])
+    elif action == 'post_clear':
+        invalidate_roles(getattr(instance, '_cleared_user_ids', []))
+    else:
+        invalidate_roles(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_roles_on_group_changed(sender, instance, **kwargs):
+    """组改名或删除后清除组成员的角色缓存"""
+    if instance.pk:
+        invalidate_roles(instance.user_set.values_list('pk', flat=True))
@@ -1,3 +1,72 @@
-from django.test import TestCase
+import shutil
+import tempfile
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from community.models import Post
+from community.permissions import IsAuditor, IsOwnerAuditorOrApproved
+from .models import User
+from .roles import get_roles, is_auditor
+
+
+class RoleResolutionTests(TestCase):
+    def setUp(self):
+        # 文件缓存由同一台机器上的各进程共享
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        self.enterContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }))
+        cache.clear()
+        self.auditors = Group.objects.create(name='auditors')
+        self.user = User.objects.create_user(username='auditor', password='pw')
+        self.user.groups.add(self.auditors)
+
+    def fresh_user(self):
+        return User.objects.get(pk=self.user.pk)
+
+    def test_roles_cached_across_requests(self):
+        self.assertTrue(is_auditor(self.fresh_user()))
+        with self.assertNumQueries(0):
+            # 模拟下一个请求中新加载的用户对象
+            self.assertTrue(is_auditor(User(pk=self.user.pk)))
+
+    def test_local_memory_cache_keeps_roles_per_request(self):
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=local):
+            user = self.fresh_user()
+            self.assertTrue(is_auditor(user))
+            with self.assertNumQueries(0):
+                self.assertTrue(is_auditor(user))
+            # 其他进程清除不了进程内缓存，下一个请求重新查询
+            with self.assertNumQueries(1):
+                self.assertTrue(is_auditor(User(pk=self.user.pk)))
+
+    def test_group_changes_invalidate_cache(self):
+        self.assertTrue(is_auditor(self.fresh_user()))
+        self.user.groups.remove(self.auditors)
+        self.assertFalse(is_auditor(self.fresh_user()))
+        self.auditors.user_set.add(self.user)
+        self.assertTrue(is_auditor(self.fresh_user()))
+        self.auditors.user_set.clear()
+        self.assertFalse(is_auditor(self.fresh_user()))
+
+    def test_group_rename_invalidates_cache(self):
+        self.assertIn('auditors', get_roles(self.fresh_user()))
+        self.auditors.name = 'reviewers'
+        self.auditors.save()
+        self.assertEqual(get_roles(self.fresh_user()), frozenset(['reviewers']))
+
+    def test_permission_checks_run_no_queries(self):
+        author = User.objects.create_user(username='author', password='pw')
+        post = Post.objects.create(title='t', content='c', author=author, is_create_approved=False)
+        post = Post.objects.get(pk=post.pk)
+        request = APIRequestFactory().get('/')
+        is_auditor(author)
+        request.user = User.objects.get(pk=author.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(IsOwnerAuditorOrApproved().has_object_permission(request, None, post))
+            self.assertFalse(IsAuditor().has_permission(request, None))
@@ -0,0 +1,140 @@
+"""
+按内容寻址的附件存储
+
+上传的文件按 SHA-256 保存在 blobs/ab/cd/<sha256>.<扩展名>，相同内容只保存一份，扩展名取第一次上传时的文件名。
+community 与 community_app 的附件都引用 Blob，Blob.ref_count 为引用数，
+附件删除后由各自的信号调用 release 递减，归零时删除文件。
+
+哈希在 Django 接收上传数据时逐块计算（见 FILE_UPLOAD_HANDLERS），不需要再读一遍文件。
+客户端可以只提交 sha256，服务端已有该内容且调用方已经能看到引用它的附件时直接引用，不必重复上传；
+只知道哈希不能取得内容，否则猜到私有附件哈希的人可以把它挂到自己的公开帖子上
+"""
+import hashlib
+import os
+import re
+from functools import partial
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import Blob, Post, PostAttachment
+
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+EXTENSION_PATTERN = re.compile(r'^\.[0-9a-z]{1,10}$')
+
+
+def blob_path(digest, name=''):
+    """
+    两级目录分散文件，避免单个目录下文件过多
+    保留原文件的扩展名，直接访问文件时浏览器能识别类型、下载时文件名有扩展名
+    """
+    extension = os.path.splitext(name or '')[1].lower()
+    if not EXTENSION_PATTERN.match(extension):
+        extension = ''
+    return f'blobs/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def is_digest(value):
+    return isinstance(value, str) and bool(DIGEST_PATTERN.match(value))
+
+
+class HashingUploadHandlerMixin:
+    """接收上传数据时计算 SHA-256，结果保存在上传文件的 sha256 属性"""
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def file_digest(file):
+    """返回文件的 SHA-256，上传处理器已计算时直接使用"""
+    digest = getattr(file, 'sha256', None)
+    if digest:
+        return digest
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def visible_blob(digest, user):
+    """
+    调用方能看到的附件引用的内容：可见帖子的附件，或自己上传的 community_app 附件；不增加引用计数
+    :return: Blob，没有或看不到时返回 None
+    """
+    visible_attachments = PostAttachment.objects.filter(post__in=Post.objects.visible_to(user))
+    return Blob.objects.filter(
+        Q(post_attachments__in=visible_attachments) | Q(app_attachments__uploader_id=user.pk), sha256=digest,
+    ).distinct().first()
+
+
+def acquire(digest):
+    """
+    已有该内容时增加引用计数并返回 Blob，否则返回 None
+    """
+    if not Blob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1):
+        return None
+    return Blob.objects.get(sha256=digest)
+
+
+def store(file):
+    """
+    保存文件内容并增加引用计数，内容已存在时不再写入
+    :return: Blob
+    """
+    digest = file_digest(file)
+    blob = acquire(digest)
+    if blob is not None:
+        return blob
+    path = blob_path(digest, file.name)
+    # 之前回滚的请求可能留下了同名文件，内容相同可以直接使用
+    if not default_storage.exists(path):
+        path = default_storage.save(path, file)
+    blob, created = Blob.objects.get_or_create(sha256=digest, defaults={'size': file.size, 'file': path})
+    if created:
+        return blob
+    # 并发上传同样的内容时由先创建的请求保存，删除这里写入的文件，只增加引用
+    if path != blob.file.name:
+        default_storage.delete(path)
+    return acquire(digest)
+
+
+def release(blob_id):
+    """
+    减少引用计数，没有附件引用时删除 Blob 和文件
+    """
+    if blob_id is None:
+        return
+    Blob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    for blob in Blob.objects.filter(pk=blob_id, ref_count=0):
+        # 缩略图与预览随 Blob 级联删除
+        names = [blob.file.name, *blob.derivatives.exclude(file='').values_list('file', flat=True)]
+        blob.delete()
+        transaction.on_commit(partial(_delete_files, blob.sha256, names))
+
+
+def _delete_files(digest, names):
+    # 提交前可能已有新的上传重新引用了这个文件
+    if not Blob.objects.filter(sha256=digest).exists():
+        for name in names:
+            default_storage.delete(name)
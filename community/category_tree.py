@@ -0,0 +1,148 @@
+"""
+分类树的闭包表
+
+闭包表为每对（祖先, 后代）保存一行，包括分类自身（depth 为0）。
+某个分类的整棵子树是 ancestor 为它的所有行，一次走索引的查询即可取得，不需要逐层递归。
+
+community 与 demand 的分类各有一张闭包表，共用这里的函数，由各自的信号在分类保存、删除时维护。
+整棵树另在进程内缓存（CachedTree），分类或子树计数变化时递增共享缓存中的版本号，各进程下次读取时重建；
+默认缓存为进程内缓存时版本号无法通知其他进程，每次读取都重建
+"""
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.core.cache import cache
+
+from .utils import cache_is_shared
+
+
+def insert_node(closure, node_id, parent_id):
+    """新建分类后写入它与自身、与全部祖先的关系"""
+    rows = [closure(ancestor_id=node_id, descendant_id=node_id, depth=0)]
+    if parent_id is not None:
+        rows += [
+            closure(ancestor_id=ancestor_id, descendant_id=node_id, depth=depth + 1)
+            for ancestor_id, depth in closure.objects.filter(descendant_id=parent_id).values_list('ancestor_id', 'depth')
+        ]
+    closure.objects.bulk_create(rows)
+
+
+def descendant_ids(closure, node_id):
+    """分类自身及全部后代的id"""
+    return list(closure.objects.filter(ancestor_id=node_id).values_list('descendant_id', flat=True))
+
+
+def ancestor_ids(closure, node_ids):
+    """分类自身及全部祖先的id"""
+    return set(closure.objects.filter(descendant_id__in=node_ids).values_list('ancestor_id', flat=True))
+
+
+def check_move(closure, node_id, parent_id):
+    """
+    :raises ValueError: 新的上级分类是它自身或它的后代
+    """
+    if parent_id is not None and closure.objects.filter(ancestor_id=node_id, descendant_id=parent_id).exists():
+        raise ValueError('不能把分类移动到它自身或它的下级分类下')
+
+
+def move_node(closure, node_id, parent_id):
+    """
+    分类的上级变化后，把它的整棵子树从原来的祖先下移到新的上级下
+    """
+    subtree = list(closure.objects.filter(ancestor_id=node_id).values_list('descendant_id', 'depth'))
+    subtree_ids = [pk for pk, depth in subtree]
+    closure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+    if parent_id is None:
+        return
+    ancestors = list(closure.objects.filter(descendant_id=parent_id).values_list('ancestor_id', 'depth'))
+    closure.objects.bulk_create([
+        closure(ancestor_id=ancestor_id, descendant_id=pk, depth=ancestor_depth + depth + 1)
+        for ancestor_id, ancestor_depth in ancestors
+        for pk, depth in subtree
+    ])
+
+
+def detach_children(closure, category_model, node_id):
+    """
+    删除分类前调用，下级分类的上级会被置空（SET_NULL，不触发保存信号），它们的子树成为独立的树
+    """
+    for child_id in category_model.objects.filter(parent_id=node_id).values_list('pk', flat=True):
+        move_node(closure, child_id, None)
+
+
+def rebuild(closure, category_model):
+    """按上级关系重建整张闭包表，用于迁移与修复"""
+    parents = dict(category_model.objects.values_list('pk', 'parent_id'))
+    rows = []
+    for pk in parents:
+        ancestor, depth, seen = pk, 0, set()
+        # 已有的环按断开处理
+        while ancestor is not None and ancestor not in seen:
+            seen.add(ancestor)
+            rows.append(closure(ancestor_id=ancestor, descendant_id=pk, depth=depth))
+            ancestor, depth = parents.get(ancestor), depth + 1
+    closure.objects.all().delete()
+    closure.objects.bulk_create(rows, batch_size=500)
+    return len(parents)
+
+
+class CachedTree:
+    """
+    进程内缓存的分类树
+    - model_label: 分类模型
+    - fields: 每个节点保存的字段
+    """
+
+    def __init__(self, model_label, fields):
+        self.model_label = model_label
+        self.fields = tuple(fields)
+        self.version_key = f'category_tree:{model_label}:version'
+        self._cached = (None, None)
+
+    def version(self):
+        # 版本号以当前时间为初值，缓存被清空后不会与旧版本号重复
+        cache.add(self.version_key, int(time.time() * 1000), None)
+        return cache.get(self.version_key)
+
+    def invalidate(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            self.version()
+
+    def get(self):
+        """
+        :return: (nodes, children)，nodes 为 id 到节点字段的映射，children 为上级id到下级id列表的映射，顶级分类的上级为 None
+        """
+        if not cache_is_shared():
+            return self.build()
+        version = self.version()
+        cached_version, tree = self._cached
+        if tree is None or cached_version != version:
+            tree = self.build()
+            self._cached = (version, tree)
+        return tree
+
+    def build(self):
+        model = apps.get_model(self.model_label)
+        nodes = {row['id']: row for row in model.objects.order_by('pk').values('id', 'parent_id', *self.fields)}
+        children = defaultdict(list)
+        for row in nodes.values():
+            parent_id = row['parent_id'] if row['parent_id'] in nodes else None
+            children[parent_id].append(row['id'])
+        return nodes, dict(children)
+
+    def nested(self, node_id=None, render=None):
+        """
+        返回 node_id 的下级分类组成的嵌套结构，node_id 为 None 时返回整棵树
+        :param render: 把节点字段转换为输出的函数，默认原样输出
+        """
+        nodes, children = self.get()
+        render = render or dict
+
+        def build(pk):
+            item = render(nodes[pk])
+            item['children'] = [build(child) for child in children.get(pk, [])]
+            return item
+        return [build(pk) for pk in children.get(node_id, [])]
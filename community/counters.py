@@ -0,0 +1,91 @@
+from django.db.models import Count, Max, Q
+
+from .category_tree import CachedTree, ancestor_ids
+from .models import Category, CategoryClosure, Comment, Post
+
+# 进程内缓存的分类树，分类或帖子数变化后失效
+category_cache = CachedTree('community.Category', (
+    'name', 'description', 'post_count', 'public_post_count', 'subtree_post_count', 'subtree_public_post_count',
+))
+
+
+def refresh_comment_counters(post_ids):
+    """
+    重新统计帖子的回复数、最后回复时间与管理员回复状态
+    :param post_ids: 需要刷新的帖子id
+    """
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    stats = {
+        row['post_id']: row
+        for row in Comment.objects.filter(post_id__in=post_ids).order_by().values('post_id').annotate(
+            total=Count('id'),
+            public=Count('id', filter=Q(is_create_approved=True, visibility='public')),
+            last=Max('created_at'),
+            last_staff=Max('created_at', filter=Q(author__is_staff=True)),
+        )
+    }
+    for post_id in post_ids:
+        row = stats.get(post_id, {})
+        # 已删除的帖子也刷新，恢复后计数仍然准确
+        Post.all_objects.filter(pk=post_id).update(
+            public_comment_count=row.get('public', 0),
+            total_comment_count=row.get('total', 0),
+            last_comment_at=row.get('last'),
+            last_staff_reply_at=row.get('last_staff'),
+            awaiting_reply=row.get('last_staff') is None,
+        )
+
+
+def refresh_category_counters(category_ids):
+    """
+    重新统计分类下的帖子数与分类及其全部祖先的子树帖子数，只统计未禁用的帖子
+    :param category_ids: 需要刷新的分类id
+    """
+    category_ids = {pk for pk in category_ids if pk is not None}
+    if not category_ids:
+        return
+    stats = {
+        row['category_id']: row
+        for row in Post.categories.through.objects.filter(
+            category_id__in=category_ids, post__is_able=True
+        ).order_by().values('category_id').annotate(
+            total=Count('post_id'),
+            public=Count('post_id', filter=Q(post__is_create_approved=True, post__visibility='public')),
+        )
+    }
+    for category_id in category_ids:
+        row = stats.get(category_id, {})
+        Category.objects.filter(pk=category_id).update(
+            post_count=row.get('total', 0),
+            public_post_count=row.get('public', 0),
+        )
+    refresh_subtree_counters(ancestor_ids(CategoryClosure, category_ids))
+
+
+def refresh_subtree_counters(category_ids):
+    """
+    重新统计分类子树（自身及全部下级分类）的帖子数，同一帖子属于子树中多个分类时只计一次
+    :param category_ids: 需要刷新的分类id，调用方负责包含受影响分类的全部祖先
+    """
+    category_ids = set(category_ids)
+    if category_ids:
+        stats = {
+            row['ancestor_id']: row
+            for row in CategoryClosure.objects.filter(
+                ancestor_id__in=category_ids, descendant__posts__is_able=True
+            ).order_by().values('ancestor_id').annotate(
+                total=Count('descendant__posts', distinct=True),
+                public=Count('descendant__posts', distinct=True, filter=Q(
+                    descendant__posts__is_create_approved=True, descendant__posts__visibility='public',
+                )),
+            )
+        }
+        for category_id in category_ids:
+            row = stats.get(category_id, {})
+            Category.objects.filter(pk=category_id).update(
+                subtree_post_count=row.get('total', 0),
+                subtree_public_post_count=row.get('public', 0),
+            )
+    category_cache.invalidate()
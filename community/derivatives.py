@@ -0,0 +1,186 @@
+"""
+附件的缩略图与首页预览
+
+附件创建后按文件类型登记生成任务（Derivative），由 process_derivatives 命令启动的
+线程池在后台生成。任务保存在数据库中，worker 退出后超时未完成的任务会被重新领取。
+缩略图按文件内容生成，相同内容的附件共用一份。
+
+Pillow 为可选依赖，PDF 预览另外需要 poppler 的 pdftoppm，缺少时任务标记为无法生成
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import response_cache
+from .models import Derivative, Post
+
+try:
+    from PIL import Image, features
+except ImportError:  # pragma: no cover
+    Image = features = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp'}
+DOCUMENT_EXTENSIONS = {'pdf'}
+
+
+class SkipDerivative(Exception):
+    """缺少依赖等无法生成的情况，不再重试"""
+
+
+def kinds_for(name):
+    """按文件名返回需要生成的类型，只处理 ALLOWED_FILE_EXTENSIONS 中的类型"""
+    extension = os.path.splitext(name)[1][1:].lower()
+    if extension not in settings.ALLOWED_FILE_EXTENSIONS:
+        return []
+    if extension in IMAGE_EXTENSIONS:
+        return ['thumbnail']
+    if extension in DOCUMENT_EXTENSIONS:
+        return ['preview']
+    return []
+
+
+def enqueue(blob, name):
+    """登记附件需要的生成任务，相同内容已登记过的不再登记"""
+    for kind in kinds_for(name):
+        Derivative.objects.get_or_create(blob=blob, kind=kind)
+
+
+def derivative_path(blob, kind, extension):
+    return f'derivatives/{blob.sha256[:2]}/{blob.sha256[2:4]}/{blob.sha256}-{kind}.{extension}'
+
+
+def render(image):
+    """
+    缩放到 THUMBNAIL_SIZE 以内，优先输出 WebP，Pillow 不支持时输出 JPEG
+    :return: (内容, 扩展名)
+    """
+    image.thumbnail(getattr(settings, 'THUMBNAIL_SIZE', (320, 320)))
+    if features.check('webp'):
+        image_format, extension = 'WEBP', 'webp'
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+    else:
+        image_format, extension = 'JPEG', 'jpg'
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=80)
+    return buffer.getvalue(), extension
+
+
+def make_thumbnail(derivative):
+    if Image is None:
+        raise SkipDerivative('未安装Pillow')
+    with derivative.blob.file.open('rb') as file, Image.open(file) as image:
+        return render(image)
+
+
+def make_preview(derivative):
+    pdftoppm = shutil.which('pdftoppm')
+    if Image is None or pdftoppm is None:
+        raise SkipDerivative('未安装Pillow或pdftoppm')
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.pdf')
+        with derivative.blob.file.open('rb') as file, open(source, 'wb') as output:
+            for chunk in file.chunks():
+                output.write(chunk)
+        # 只渲染第一页
+        subprocess.run(
+            [pdftoppm, '-png', '-singlefile', '-f', '1', '-l', '1', source, os.path.join(directory, 'page')],
+            check=True, capture_output=True, timeout=60,
+        )
+        with Image.open(os.path.join(directory, 'page.png')) as image:
+            return render(image)
+
+
+GENERATORS = {'thumbnail': make_thumbnail, 'preview': make_preview}
+
+
+def claim(limit):
+    """
+    领取待生成的任务，超过 DERIVATIVE_LOCK_TIMEOUT 秒仍在生成中的任务视为 worker 已退出，重新领取
+    用带原状态条件的 UPDATE 领取，多个进程同时运行时每个任务只会被一个进程领取
+    """
+    stale = timezone.now() - timedelta(seconds=getattr(settings, 'DERIVATIVE_LOCK_TIMEOUT', 300))
+    candidates = Derivative.objects.filter(
+        Q(status='pending') | Q(status='running', locked_at__lt=stale)
+    ).order_by('created_at').values_list('pk', 'status', 'locked_at')[:limit]
+    claimed = [
+        pk for pk, status, locked_at in candidates
+        if Derivative.objects.filter(pk=pk, status=status, locked_at=locked_at).update(
+            status='running', locked_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+    ]
+    return list(Derivative.objects.filter(pk__in=claimed).select_related('blob'))
+
+
+def process(derivative):
+    """
+    生成一个任务，失败未超过 DERIVATIVE_MAX_ATTEMPTS 次时重新排队
+    :return: 任务的最终状态
+    """
+    name = ''
+    try:
+        content, extension = GENERATORS[derivative.kind](derivative)
+        path = derivative_path(derivative.blob, derivative.kind, extension)
+        default_storage.delete(path)
+        name = default_storage.save(path, ContentFile(content))
+        status, error = 'done', ''
+    except SkipDerivative as e:
+        status, error = 'skipped', str(e)
+    except Exception as e:
+        logger.exception('生成 %s 失败: %s', derivative.kind, derivative.blob.sha256)
+        status = 'failed' if derivative.attempts >= getattr(settings, 'DERIVATIVE_MAX_ATTEMPTS', 3) else 'pending'
+        error = str(e)
+    updated = Derivative.objects.filter(pk=derivative.pk).update(
+        status=status, error=error, file=name, locked_at=None, updated_at=timezone.now(),
+    )
+    if not updated:
+        # 生成期间附件已全部删除
+        if name:
+            default_storage.delete(name)
+    elif status == 'done':
+        # 使帖子的条件请求校验值与匿名响应缓存失效，客户端取得缩略图地址
+        Post.objects.filter(attachments__blob=derivative.blob_id).update(updated_at=timezone.now())
+        response_cache.bump_version()
+    return status
+
+
+def _process_in_worker(derivative):
+    try:
+        return process(derivative)
+    finally:
+        connection.close()
+
+
+def run_pending(workers=None):
+    """
+    处理当前全部可领取的任务，只有一个 worker 时在当前线程处理
+    :return: 处理的任务数
+    """
+    workers = workers or getattr(settings, 'DERIVATIVE_WORKERS', 2)
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            derivatives = claim(workers * 4)
+            if not derivatives:
+                return total
+            if workers == 1:
+                for derivative in derivatives:
+                    process(derivative)
+            else:
+                list(pool.map(_process_in_worker, derivatives))
+            total += len(derivatives)
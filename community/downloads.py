@@ -0,0 +1,125 @@
+"""
+附件下载
+
+- ETag 与 Last-Modified，条件请求返回 304
+- 单个范围的 Range 请求返回 206，范围无效时返回 416；If-Range 不匹配或多个范围时返回整个文件
+- 按内容寻址的地址（blobs/<sha256>/）内容不会变化，返回一年的 immutable 缓存头；
+  帖子下的附件地址需要检查权限，帖子改为私有或被删除后不能继续被缓存，只缓存 ATTACHMENT_CACHE_MAX_AGE 秒并要求重新验证
+- ATTACHMENT_SENDFILE 为 'nginx' 或 'xsendfile' 时只返回响应头，由前端代理发送文件并处理 Range：
+  nginx 使用 X-Accel-Redirect，路径为 ATTACHMENT_SENDFILE_PREFIX 加文件名，需配置为 MEDIA_ROOT 的 internal location；
+  xsendfile（Apache、lighttpd）使用 X-Sendfile，值为文件的绝对路径
+"""
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """
+    解析 Range 请求头
+    :return: (start, end)，end 包含在内；没有或不支持的 Range 返回 None
+    :raises ValueError: 范围无法满足
+    """
+    match = RANGE_PATTERN.match(header.replace(' ', '')) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    start, end = match.groups()
+    if start == '':
+        # bytes=-N 为最后 N 个字节
+        if int(end) == 0:
+            raise ValueError(header)
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _stream(name, start, length):
+    with default_storage.open(name, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(STREAM_CHUNK_SIZE, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+
+
+def file_response(request, name, *, filename, size, etag, last_modified, public=False, max_age=0, immutable=False):
+    """
+    返回存储中文件的下载响应
+    :param name: 文件在 default_storage 中的名称
+    :param filename: 下载时的文件名
+    :param public: 是否允许共享缓存（CDN、代理）保存
+    :param max_age: 过期前可以直接使用缓存的秒数，过期后要求重新验证
+    :param immutable: 地址对应的内容是否永不变化，为真时忽略 max_age
+    """
+    timestamp = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = _content_response(request, name, size, etag, timestamp)
+    if response.status_code in (200, 206):
+        response['Content-Type'] = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        response['X-Content-Type-Options'] = 'nosniff'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    response['Accept-Ranges'] = 'bytes'
+    if immutable:
+        max_age = IMMUTABLE_MAX_AGE
+    response['Cache-Control'] = f'{"public" if public else "private"}, max-age={max_age}' + (
+        ', immutable' if immutable else ', must-revalidate'
+    )
+    if not public:
+        response['Vary'] = 'Authorization, Cookie'
+    return response
+
+
+def _content_response(request, name, size, etag, timestamp):
+    backend = getattr(settings, 'ATTACHMENT_SENDFILE', None)
+    if backend == 'nginx':
+        response = HttpResponse()
+        prefix = getattr(settings, 'ATTACHMENT_SENDFILE_PREFIX', '/protected/')
+        response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + name)
+        return response
+    if backend == 'xsendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = default_storage.path(name)
+        return response
+
+    byte_range = None
+    if _if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, timestamp):
+        try:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    start, end = byte_range or (0, size - 1)
+    response = StreamingHttpResponse(_stream(name, start, end - start + 1), status=206 if byte_range else 200)
+    response['Content-Length'] = str(end - start + 1)
+    if byte_range:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
+
+
+def _if_range_matches(if_range, etag, timestamp):
+    """没有 If-Range 或与当前文件一致时才处理 Range"""
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # If-Range 要求强比较
+        return if_range == etag
+    return parse_http_date_safe(if_range) == timestamp
@@ -0,0 +1,40 @@
+from django.db.models import Case, IntegerField, When
+from django_filters import rest_framework as django_filters
+from rest_framework import filters
+
+from . import search
+from .models import CategoryClosure, Post
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """
+    使用全文索引检索帖子，结果按相关度排序
+    全文索引不可用时回退到 SearchFilter 的 LIKE 查询
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query or not search.is_available():
+            return super().filter_queryset(request, queryset, view)
+        post_ids = search.search_post_ids(query)
+        if not post_ids:
+            return queryset.none()
+        rank = Case(*[When(pk=pk, then=i) for i, pk in enumerate(post_ids)], output_field=IntegerField())
+        return queryset.filter(pk__in=post_ids).order_by(rank)
+
+
+
+class PostFilter(django_filters.FilterSet):
+    category_tree = django_filters.NumberFilter(method='filter_category_tree', help_text='分类id，包括其全部下级分类')
+
+    class Meta:
+        model = Post
+        fields = ['categories']
+
+    def filter_category_tree(self, queryset, name, value):
+        """
+        分类子树由闭包表取得，与帖子分类关联表组成一个子查询，帖子属于子树中多个分类时不会重复
+        """
+        subtree = CategoryClosure.objects.filter(ancestor_id=value).values('descendant_id')
+        post_ids = Post.categories.through.objects.filter(category_id__in=subtree).values('post_id')
+        return queryset.filter(pk__in=post_ids)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from community.uploads import clear_stale_sessions
+
+
+class Command(BaseCommand):
+    help = '清理过期的分片上传会话及其分片'
+
+    def handle(self, *args, **options):
+        count = clear_stale_sessions()
+        self.stdout.write(self.style.SUCCESS(f'已清理 {count} 个过期的上传会话'))
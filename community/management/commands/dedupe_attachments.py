@@ -0,0 +1,34 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from community import blobs
+
+# 引用 Blob 的附件模型
+ATTACHMENT_MODELS = ('community.PostAttachment', 'community_app.Attachment')
+
+
+class Command(BaseCommand):
+    help = '把旧附件的文件按内容去重后迁移到 blobs 目录'
+
+    def handle(self, *args, **options):
+        models = [apps.get_model(label) for label in ATTACHMENT_MODELS if apps.is_installed(label.split('.')[0])]
+        migrated = removed = 0
+        for model in models:
+            # 基础管理器包括已删除的附件，帖子恢复后附件仍可用
+            for attachment in model._base_manager.filter(blob__isnull=True).exclude(file=''):
+                old_name = attachment.file.name
+                storage = attachment.file.storage
+                if not storage.exists(old_name):
+                    continue
+                with attachment.file.open('rb') as file:
+                    blob = blobs.store(file)
+                attachment.blob = blob
+                attachment.name = attachment.name or old_name.rsplit('/', 1)[-1]
+                attachment.file.name = blob.file.name
+                attachment.save(update_fields=['blob', 'name', 'file'])
+                migrated += 1
+                # 旧文件不再被任何附件引用时删除
+                if not any(other._base_manager.filter(file=old_name).exists() for other in models):
+                    storage.delete(old_name)
+                    removed += 1
+        self.stdout.write(self.style.SUCCESS(f'已迁移 {migrated} 个附件，删除 {removed} 个重复文件'))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from community.derivatives import run_pending
+
+
+class Command(BaseCommand):
+    help = '生成附件的缩略图与首页预览'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='线程数，默认 DERIVATIVE_WORKERS')
+        parser.add_argument('--loop', action='store_true', help='持续运行，定期领取新任务')
+        parser.add_argument('--interval', type=float, default=5, help='持续运行时没有任务的等待秒数')
+
+    def handle(self, *args, **options):
+        while True:
+            count = run_pending(options['workers'])
+            if count:
+                self.stdout.write(self.style.SUCCESS(f'已处理 {count} 个任务'))
+            if not options['loop']:
+                return
+            if not count:
+                time.sleep(options['interval'])
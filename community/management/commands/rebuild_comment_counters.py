@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from community.counters import refresh_comment_counters
+from community.models import Post
+
+
+class Command(BaseCommand):
+    help = '重建帖子的回复计数与最后回复时间'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批处理的帖子数')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        post_ids = list(Post.all_objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(post_ids), batch_size):
+            refresh_comment_counters(post_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'已重建 {len(post_ids)} 个帖子的回复计数'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from community.related import rebuild_related_posts
+
+
+class Command(BaseCommand):
+    help = '重建全部帖子的相关推荐'
+
+    def handle(self, *args, **options):
+        count = rebuild_related_posts()
+        self.stdout.write(self.style.SUCCESS(f'已重建 {count} 个帖子的相关推荐'))
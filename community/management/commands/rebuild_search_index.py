@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from community import search
+
+
+class Command(BaseCommand):
+    help = '重建帖子与回复的全文索引'
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            self.stdout.write(self.style.WARNING('当前数据库没有全文索引表'))
+            return
+        posts, comments = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'已索引 {posts} 个帖子、{comments} 条回复'))
@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-19 04:06
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def backfill_comment_counters(apps, schema_editor):
+    Post = apps.get_model('community', 'Post')
+    Comment = apps.get_model('community', 'Comment')
+    stats = Comment.objects.filter(is_able=True).order_by().values('post_id').annotate(
+        total=Count('id'),
+        public=Count('id', filter=Q(is_create_approved=True, visibility='public')),
+        last=Max('created_at'),
+    )
+    for row in stats:
+        Post.objects.filter(pk=row['post_id']).update(
+            public_comment_count=row['public'],
+            total_comment_count=row['total'],
+            last_comment_at=row['last'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0005_remove_post_category_post_categories_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最后回复时间'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='public_comment_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='公开回复数'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='total_comment_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='回复总数'),
+        ),
+        migrations.RunPython(backfill_comment_counters, migrations.RunPython.noop),
+    ]
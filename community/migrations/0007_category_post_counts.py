@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-19 04:07
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_category_counters(apps, schema_editor):
+    Category = apps.get_model('community', 'Category')
+    Post = apps.get_model('community', 'Post')
+    stats = Post.categories.through.objects.filter(post__is_able=True).order_by().values('category_id').annotate(
+        total=Count('post_id'),
+        public=Count('post_id', filter=Q(post__is_create_approved=True, post__visibility='public')),
+    )
+    for row in stats:
+        Category.objects.filter(pk=row['category_id']).update(post_count=row['total'], public_post_count=row['public'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0006_post_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='帖子数'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='public_post_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='公开帖子数'),
+        ),
+        migrations.RunPython(backfill_category_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+import re
+
+from django.db import migrations
+
+# 迁移使用当时的分词方式与表名，之后修改 community.search 不会改变这里的行为
+FTS_TABLE = 'community_search_index'
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[^\W{_CJK}]+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+
+def tokenize(text):
+    """英文与数字按词切分并转小写，连续的中日韩文字切成重叠的双字组"""
+    tokens = []
+    for term in _TOKEN_RE.findall((text or '').lower()):
+        if not _CJK_RE.match(term) or len(term) == 1:
+            tokens.append(term)
+        else:
+            tokens.extend(term[i:i + 2] for i in range(len(term) - 1))
+    return ' '.join(tokens)
+
+
+def create_search_index(apps, schema_editor):
+    # 全文索引只在 SQLite 上启用，其他数据库回退到 SearchFilter
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('community', 'Post')
+    Comment = apps.get_model('community', 'Comment')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            f'doc_type UNINDEXED, doc_id UNINDEXED, post_id UNINDEXED, title, body, author, '
+            f"tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        public = {'is_able': True, 'is_create_approved': True, 'visibility': 'public'}
+        for post in Post.objects.filter(**public).select_related('author').iterator():
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (doc_type, doc_id, post_id, title, body, author) VALUES (%s, %s, %s, %s, %s, %s)',
+                ['post', post.pk, post.pk, tokenize(post.title), tokenize(post.content),
+                 tokenize(post.author.username if post.author else '')],
+            )
+        for comment in Comment.objects.filter(**public).select_related('author').iterator():
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (doc_type, doc_id, post_id, title, body, author) VALUES (%s, %s, %s, %s, %s, %s)',
+                ['comment', comment.pk, comment.post_id, '', tokenize(comment.content),
+                 tokenize(comment.author.username if comment.author else '')],
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0007_category_post_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
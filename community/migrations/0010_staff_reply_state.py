@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-19 04:14
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_staff_reply_state(apps, schema_editor):
+    Post = apps.get_model('community', 'Post')
+    Comment = apps.get_model('community', 'Comment')
+    stats = Comment.objects.filter(is_able=True, author__is_staff=True).order_by().values('post_id').annotate(
+        last=Max('created_at'),
+    )
+    for row in stats:
+        Post.objects.filter(pk=row['post_id']).update(last_staff_reply_at=row['last'], awaiting_reply=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0009_related_post'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='awaiting_reply',
+            field=models.BooleanField(default=True, verbose_name='是否等待管理员回复'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='last_staff_reply_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='管理员最后回复时间'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['awaiting_reply', '-created_at'], name='post_awaiting_reply_idx'),
+        ),
+        migrations.RunPython(backfill_staff_reply_state, migrations.RunPython.noop),
+    ]
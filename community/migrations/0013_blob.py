@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-19 04:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0012_comment_thread_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('size', models.PositiveBigIntegerField(verbose_name='大小')),
+                ('file', models.FileField(max_length=255, upload_to='', verbose_name='文件')),
+                ('ref_count', models.PositiveIntegerField(default=1, verbose_name='引用数')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+            ],
+            options={
+                'verbose_name': '文件内容',
+                'verbose_name_plural': '文件内容',
+            },
+        ),
+        migrations.AddField(
+            model_name='postattachment',
+            name='name',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='文件名'),
+        ),
+        migrations.AddField(
+            model_name='postattachment',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='post_attachments', to='community.blob', verbose_name='文件内容'),
+        ),
+    ]
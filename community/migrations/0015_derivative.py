@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-19 04:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0014_upload_session'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Derivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('thumbnail', '缩略图'), ('preview', '首页预览')], max_length=20, verbose_name='类型')),
+                ('status', models.CharField(choices=[('pending', '等待生成'), ('running', '生成中'), ('done', '已生成'), ('failed', '生成失败'), ('skipped', '无法生成')], default='pending', max_length=20, verbose_name='状态')),
+                ('file', models.FileField(blank=True, max_length=255, upload_to='', verbose_name='文件')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='尝试次数')),
+                ('error', models.TextField(blank=True, default='', verbose_name='错误信息')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='开始生成时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='community.blob', verbose_name='文件内容')),
+            ],
+            options={
+                'verbose_name': '缩略图与预览',
+                'verbose_name_plural': '缩略图与预览',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='derivative',
+            index=models.Index(fields=['status', 'created_at'], name='derivative_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='derivative',
+            constraint=models.UniqueConstraint(fields=('blob', 'kind'), name='derivative_blob_kind_unique'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2 on 2026-10-19 04:45
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def build_closure(apps, schema_editor):
+    Category = apps.get_model('community', 'Category')
+    CategoryClosure = apps.get_model('community', 'CategoryClosure')
+    parents = dict(Category.objects.values_list('pk', 'parent_id'))
+    rows = []
+    for pk in parents:
+        ancestor, depth, seen = pk, 0, set()
+        while ancestor is not None and ancestor not in seen:
+            seen.add(ancestor)
+            rows.append(CategoryClosure(ancestor_id=ancestor, descendant_id=pk, depth=depth))
+            ancestor, depth = parents.get(ancestor), depth + 1
+    CategoryClosure.objects.bulk_create(rows, batch_size=500)
+    stats = CategoryClosure.objects.filter(descendant__posts__is_able=True).order_by().values('ancestor_id').annotate(
+        total=Count('descendant__posts', distinct=True),
+        public=Count('descendant__posts', distinct=True, filter=Q(
+            descendant__posts__is_create_approved=True, descendant__posts__visibility='public',
+        )),
+    )
+    for row in stats:
+        Category.objects.filter(pk=row['ancestor_id']).update(
+            subtree_post_count=row['total'], subtree_public_post_count=row['public'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0015_derivative'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='subtree_post_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='子树帖子数'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='subtree_public_post_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='子树公开帖子数'),
+        ),
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(verbose_name='层级差')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='community.category', verbose_name='祖先')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='community.category', verbose_name='后代')),
+            ],
+            options={
+                'verbose_name': '分类闭包',
+                'verbose_name_plural': '分类闭包',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='categoryclosure',
+            index=models.Index(fields=['descendant', 'ancestor'], name='category_closure_desc_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='categoryclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='category_closure_unique'),
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-19 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0016_category_closure'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='post_awaiting_reply_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['-created_at'], name='comment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_able', True)), fields=['author', '-created_at'], name='comment_author_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_able', True), ('is_create_approved', True), ('visibility', 'public')), fields=['-created_at'], name='comment_public_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('is_able', True)), fields=['-is_pinned', '-created_at'], name='post_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('is_able', True), ('is_create_approved', True), ('visibility', 'public')), fields=['-is_pinned', '-created_at'], name='post_public_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('is_able', True)), fields=['author', '-is_pinned', '-created_at'], name='post_author_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('awaiting_reply', True), ('is_able', True), ('is_create_approved', True)), fields=['-is_pinned', '-created_at'], name='post_awaiting_reply_idx'),
+        ),
+    ]
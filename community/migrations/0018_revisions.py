@@ -0,0 +1,108 @@
+# Generated by Django 4.2 on 2026-10-19 05:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _replace(base, text):
+    """把 base 整体替换为 text 的差异，text 为 None 时保持不变，见 community.revisions.encode_diff"""
+    if text is None:
+        return [len(base)] if base else []
+    ops = [-len(base)] if base else []
+    return ops + [text] if text else ops
+
+
+def move_edits_to_revisions(apps, schema_editor):
+    """把行内保存的待审核编辑转为编辑记录：原内容的快照与一条待审核的编辑"""
+    Revision = apps.get_model('community', 'Revision')
+    for model_name, target in (('Post', 'post'), ('Comment', 'comment')):
+        model = apps.get_model('community', model_name)
+        has_title = model_name == 'Post'
+        edited = model.objects.filter(edited_content__isnull=False)
+        if has_title:
+            edited = model.objects.filter(models.Q(edited_content__isnull=False) | models.Q(edited_title__isnull=False))
+        for obj in edited.iterator():
+            base = Revision.objects.create(
+                **{target: obj}, author_id=obj.author_id, status='approved', reviewed_at=obj.created_at,
+                title_diff=_replace('', obj.title) if has_title else None, content_diff=_replace('', obj.content),
+            )
+            pending = Revision.objects.create(
+                **{target: obj}, base=base, author_id=obj.author_id,
+                title_diff=_replace(obj.title, obj.edited_title or None) if has_title else None,
+                content_diff=_replace(obj.content, obj.edited_content or None),
+            )
+            model.objects.filter(pk=obj.pk).update(approved_revision=base, pending_revision=pending, is_edit_approved=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('community', '0017_visibility_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Revision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title_diff', models.JSONField(blank=True, null=True, verbose_name='标题差异')),
+                ('content_diff', models.JSONField(verbose_name='内容差异')),
+                ('status', models.CharField(choices=[('pending', '待审核'), ('approved', '已通过'), ('rejected', '已驳回'), ('superseded', '已被新的编辑取代')], default='pending', max_length=20, verbose_name='状态')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('reviewed_at', models.DateTimeField(blank=True, null=True, verbose_name='审核时间')),
+                ('author', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='revisions', to=settings.AUTH_USER_MODEL, verbose_name='编辑人')),
+                ('base', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='community.revision', verbose_name='基准版本')),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='community.comment', verbose_name='回复')),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='community.post', verbose_name='帖子')),
+                ('reviewer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reviewed_revisions', to=settings.AUTH_USER_MODEL, verbose_name='审核人')),
+            ],
+            options={
+                'verbose_name': '编辑记录',
+                'verbose_name_plural': '编辑记录',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='approved_revision',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='community.revision', verbose_name='当前通过的编辑'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='pending_revision',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='community.revision', verbose_name='待审核的编辑'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='approved_revision',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='community.revision', verbose_name='当前通过的编辑'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='pending_revision',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='community.revision', verbose_name='待审核的编辑'),
+        ),
+        migrations.AddIndex(
+            model_name='revision',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['created_at'], name='revision_pending_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='revision',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('comment__isnull', True), ('post__isnull', False)), models.Q(('comment__isnull', False), ('post__isnull', True)), _connector='OR'), name='revision_single_target'),
+        ),
+        migrations.RunPython(move_edits_to_revisions, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='comment',
+            name='edited_content',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='edited_content',
+        ),
+        migrations.RemoveField(
+            model_name='post',
+            name='edited_title',
+        ),
+    ]
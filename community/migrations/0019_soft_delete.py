@@ -0,0 +1,22 @@
+# Generated by Django 4.2 on 2026-10-19 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0018_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postattachment',
+            name='is_able',
+            field=models.BooleanField(default=True, verbose_name='是否禁用'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_able', True)), fields=['post', '-created_at'], name='comment_live_post_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+import re
+
+from django.db import migrations
+
+# 迁移使用当时的分词方式与表名，之后修改 community.search 不会改变这里的行为
+FTS_TABLE = 'community_search_index'
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[^\W{_CJK}]+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+
+def tokenize(text):
+    """在双字组之后再收录每段中日韩文字的最后一个字"""
+    tokens = []
+    for term in _TOKEN_RE.findall((text or '').lower()):
+        if not _CJK_RE.match(term) or len(term) == 1:
+            tokens.append(term)
+        else:
+            tokens.extend(term[i:i + 2] for i in range(len(term) - 1))
+            tokens.append(term[-1])
+    return ' '.join(tokens)
+
+
+def retokenize_search_index(apps, schema_editor):
+    """索引词加入每段中日韩文字的最后一个字，按新的分词方式重建全部索引"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Post = apps.get_model('community', 'Post')
+    Comment = apps.get_model('community', 'Comment')
+    public = {'is_able': True, 'is_create_approved': True, 'visibility': 'public'}
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        for post in Post.objects.filter(**public).select_related('author').iterator():
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (doc_type, doc_id, post_id, title, body, author) VALUES (%s, %s, %s, %s, %s, %s)',
+                ['post', post.pk, post.pk, tokenize(post.title), tokenize(post.content),
+                 tokenize(post.author.username if post.author else '')],
+            )
+        for comment in Comment.objects.filter(**public).select_related('author').iterator():
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (doc_type, doc_id, post_id, title, body, author) VALUES (%s, %s, %s, %s, %s, %s)',
+                ['comment', comment.pk, comment.post_id, '', tokenize(comment.content),
+                 tokenize(comment.author.username if comment.author else '')],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('community', '0019_soft_delete'),
+    ]
+
+    operations = [
+        migrations.RunPython(retokenize_search_index, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,74 @@
+import operator
+import uuid
+from functools import reduce
+
 from django.db import models
+from django.db.models import Q
 
 from account.models import User
+from .soft_delete import SoftDeleteManager
 # Create your models here.
 
 VISIBILITY_CHOICES = [('private', '仅作者和管理员'), ('public', '公开'),]
 
 
+class BranchedQuerySet(models.QuerySet):
+    """
+    记录由几个 OR 分支组成的过滤条件，分页时按分支分别查询再归并，见 community.pagination.slice_queryset
+    OR 条件本身仍然加在查询上，不经过分页的用法结果不变
+    """
+    branches = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone.branches = self.branches
+        return clone
+
+    def filter_any(self, *conditions):
+        """按 conditions 的并集过滤，每个条件应能单独使用索引"""
+        clone = self.filter(reduce(operator.or_, conditions))
+        clone.branches = conditions
+        return clone
+
+
+class PostQuerySet(BranchedQuerySet):
+    def visible_to(self, user):
+        """按用户的可见性级别过滤帖子"""
+        # 未认证用户只能看到已审核的公开内容
+        if not user or not user.is_authenticated:
+            return self.filter(is_create_approved=True, visibility='public')
+        # 普通认证用户可以看到自己的内容和已审核的公开内容，两个分支分别使用公开帖子与作者的部分索引
+        if not user.is_staff:
+            return self.filter_any(Q(is_create_approved=True, visibility='public'), Q(author=user))
+        return self
+
+
+class CommentQuerySet(BranchedQuerySet):
+    def visible_to(self, user):
+        """按用户的可见性级别过滤回复"""
+        # 未认证用户只能看到已审核的公开回复
+        # 已删除的回复由默认管理器排除
+        if not user or not user.is_authenticated:
+            return self.filter(is_create_approved=True, visibility='public')
+        # 认证非管理员用户可以看到已审核公开回复和自己的回复
+        if not user.is_staff:
+            return self.filter_any(Q(is_create_approved=True, visibility='public'), Q(author=user))
+        # 管理员可以看到所有内容
+        return self
+
+
 class Category(models.Model):
     name = models.CharField(max_length=20, unique=True, verbose_name='类名')
     description = models.TextField(blank=True, verbose_name='描述')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     parent_id = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, related_name='children', verbose_name='父类别id')
+    # 帖子计数由 community.signals 维护
+    post_count = models.PositiveIntegerField(default=0, verbose_name='帖子数')
+    public_post_count = models.PositiveIntegerField(default=0, verbose_name='公开帖子数')
+    # 包括全部下级分类、按帖子去重的计数
+    subtree_post_count = models.PositiveIntegerField(default=0, verbose_name='子树帖子数')
+    subtree_public_post_count = models.PositiveIntegerField(default=0, verbose_name='子树公开帖子数')
 
     class Meta:
         verbose_name = "分类"
@@ -19,9 +77,26 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+class CategoryClosure(models.Model):
+    """
+    分类树的闭包表，由 community.signals 维护，见 community.category_tree
+    """
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendant_links', verbose_name='祖先')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestor_links', verbose_name='后代')
+    depth = models.PositiveSmallIntegerField(verbose_name='层级差')
+
+    class Meta:
+        verbose_name = '分类闭包'
+        verbose_name_plural = '分类闭包'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='category_closure_unique'),
+        ]
+        indexes = [models.Index(fields=['descendant', 'ancestor'], name='category_closure_desc_idx')]
+
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True, verbose_name='标签名')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
     def __str__(self):
         return self.name
@@ -34,9 +109,7 @@ class Post(models.Model):
     categories = models.ManyToManyField(Category, related_name='posts', verbose_name='分类')
     # category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='posts', verbose_name='分类')
     title = models.CharField(max_length=100, null=False, blank=False, verbose_name='标题')
-    edited_title = models.CharField(max_length=100, null=True, blank=True, verbose_name='编辑标题')
     content = models.TextField(blank=True, default='', verbose_name='内容')
-    edited_content = models.TextField(blank=True, null=True, verbose_name='编辑内容')
     author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='posts', verbose_name='作者')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
@@ -47,66 +120,229 @@ class Post(models.Model):
     is_create_approved = models.BooleanField(default=False, verbose_name='创建帖子审核是否通过')
     is_edit_approved = models.BooleanField(default=True, verbose_name='编辑帖子审核是否通过')
     last_edited_at = models.DateTimeField(null=True, blank=True, verbose_name='最后更新时间')
+    # 标题与内容始终为已通过的版本，编辑记录见 Revision，由 community.revisions 维护
+    approved_revision = models.ForeignKey('Revision', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='当前通过的编辑')
+    pending_revision = models.ForeignKey('Revision', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='待审核的编辑')
     is_able = models.BooleanField(default=True, verbose_name='是否禁用')
     fake_author = models.CharField(max_length=100, null=True, blank=True, verbose_name='伪作者')
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='created_posts', default=None, verbose_name='创建人')
+    # 回复计数由 community.signals 维护
+    public_comment_count = models.PositiveIntegerField(default=0, verbose_name='公开回复数')
+    total_comment_count = models.PositiveIntegerField(default=0, verbose_name='回复总数')
+    last_comment_at = models.DateTimeField(null=True, blank=True, verbose_name='最后回复时间')
+    last_staff_reply_at = models.DateTimeField(null=True, blank=True, verbose_name='管理员最后回复时间')
+    awaiting_reply = models.BooleanField(default=True, verbose_name='是否等待管理员回复')
+
+    # 默认管理器不返回已删除的帖子，见 community.soft_delete
+    objects = SoftDeleteManager.from_queryset(PostQuerySet)()
+    all_objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-is_pinned', '-created_at']
         verbose_name = "帖子"
         verbose_name_plural = "帖子"
+        # 布尔条件在 SQLite 上生成为 WHERE "is_able"，普通索引无法用于这类条件，
+        # 因此按列表的过滤条件建立部分索引，索引列与排序一致，分页时不需要额外排序
+        indexes = [
+            models.Index(fields=['-is_pinned', '-created_at'], condition=Q(is_able=True), name='post_feed_idx'),
+            models.Index(
+                fields=['-is_pinned', '-created_at'], name='post_public_feed_idx',
+                condition=Q(is_able=True, is_create_approved=True, visibility='public'),
+            ),
+            models.Index(fields=['author', '-is_pinned', '-created_at'], condition=Q(is_able=True), name='post_author_feed_idx'),
+            models.Index(
+                fields=['-is_pinned', '-created_at'], name='post_awaiting_reply_idx',
+                condition=Q(awaiting_reply=True, is_able=True, is_create_approved=True),
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
-    @property
-    def display_content(self):
-        """根据用户权限返回应显示的内容"""
-        if self.is_edit_approved or self._user_has_permission():
-            return self.edited_content if self.edited_content else self.content
-        return self.content
-
+    # 标题与内容即已通过的版本，待审核的编辑只对作者与管理员单独返回，见 community.revisions.pending_text
     @property
     def display_title(self):
-        """根据用户权限返回应显示的内容"""
-        if self.is_edit_approved or self._user_has_permission():
-            return self.edited_title if self.edited_title else self.title
         return self.title
 
-    def _user_has_permission(self, user=None):
-        """检查用户是否有权限查看未审核编辑"""
-        user = user or getattr(self, '_request_user', None)
-        return user and (user.is_staff or user == self.author)
+    @property
+    def display_content(self):
+        return self.content
+
+    def comment_count_for(self, user):
+        """管理员看到全部可用回复数，其他用户看到公开回复数"""
+        if user and user.is_authenticated and user.is_staff:
+            return self.total_comment_count
+        return self.public_comment_count
 
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments', verbose_name='帖子')
     author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='comments', verbose_name='作者')
     content = models.TextField(verbose_name='内容')
-    edited_content = models.TextField(null=True, blank=True, verbose_name='编辑内容')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     parent_comment = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies', verbose_name='父回复')
+    # 物化路径与层级，新建后由 community.threads 写入
+    path = models.CharField(max_length=255, blank=True, default='', verbose_name='路径')
+    depth = models.PositiveSmallIntegerField(default=0, verbose_name='层级')
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='private', verbose_name='可视度')
     is_create_approved = models.BooleanField(default=False, verbose_name='创建回复是否通过')
     is_edit_approved = models.BooleanField(default=True, verbose_name='编辑回复是否通过')
     last_edited_at = models.DateTimeField(null=True, blank=True, verbose_name='最后编辑时间')
     is_able = models.BooleanField(default=True, verbose_name='是否禁用')
+    # 内容始终为已通过的版本，编辑记录见 Revision
+    approved_revision = models.ForeignKey('Revision', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='当前通过的编辑')
+    pending_revision = models.ForeignKey('Revision', on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='待审核的编辑')
+
+    objects = SoftDeleteManager.from_queryset(CommentQuerySet)()
+    all_objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_thread_path_idx'),
+            models.Index(fields=['-created_at'], name='comment_created_idx'),
+            # 帖子下的回复列表与详情内嵌的最新回复
+            models.Index(fields=['post', '-created_at'], condition=Q(is_able=True), name='comment_live_post_idx'),
+            models.Index(fields=['author', '-created_at'], condition=Q(is_able=True), name='comment_author_idx'),
+            models.Index(
+                fields=['-created_at'], name='comment_public_idx',
+                condition=Q(is_able=True, is_create_approved=True, visibility='public'),
+            ),
+        ]
 
     @property
     def display_content(self):
-        if self.is_edit_approved or self._user_has_permission():
-            return self.edited_content if self.edited_content else self.content
         return self.content
 
-    def _user_has_permission(self, user=None):
-        """检查用户是否有权限查看未审核编辑"""
-        user = user or getattr(self, '_request_user', None)
-        return user and (user.is_staff or user == self.author)
+class Revision(models.Model):
+    """
+    帖子与回复的编辑记录，只追加，由 community.revisions 维护
+    标题与内容保存为相对 base（提交编辑时已通过的版本）的差异，见 community.revisions.encode_diff
+    """
+    STATUS_CHOICES = [
+        ('pending', '待审核'), ('approved', '已通过'), ('rejected', '已驳回'), ('superseded', '已被新的编辑取代'),
+    ]
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='revisions', verbose_name='帖子')
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True, related_name='revisions', verbose_name='回复')
+    base = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='+', verbose_name='基准版本')
+    author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='revisions', verbose_name='编辑人')
+    # 回复没有标题，为 None
+    title_diff = models.JSONField(null=True, blank=True, verbose_name='标题差异')
+    content_diff = models.JSONField(verbose_name='内容差异')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    reviewer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reviewed_revisions', verbose_name='审核人')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    reviewed_at = models.DateTimeField(null=True, blank=True, verbose_name='审核时间')
+
+    class Meta:
+        verbose_name = '编辑记录'
+        verbose_name_plural = '编辑记录'
+        ordering = ['-created_at']
+        constraints = [
+            models.CheckConstraint(
+                check=Q(post__isnull=False, comment__isnull=True) | Q(post__isnull=True, comment__isnull=False),
+                name='revision_single_target',
+            ),
+        ]
+        indexes = [
+            # 待审核队列
+            models.Index(fields=['created_at'], condition=Q(status='pending'), name='revision_pending_idx'),
+        ]
+
+    @property
+    def target(self):
+        return self.post if self.post_id else self.comment
+
+class RelatedPost(models.Model):
+    """
+    帖子的相关推荐，按共享标签数预先计算，由 community.signals 维护
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_posts', verbose_name='帖子')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_by', verbose_name='相关帖子')
+    common_tags = models.PositiveIntegerField(default=0, verbose_name='共享标签数')
+
+    class Meta:
+        verbose_name = "相关帖子"
+        verbose_name_plural = "相关帖子"
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'related'], name='unique_related_post'),
+        ]
+        indexes = [
+            models.Index(fields=['post', '-common_tags'], name='related_post_rank_idx'),
+        ]
+
+class Blob(models.Model):
+    """
+    附件的文件内容，相同内容只保存一份，由 community.blobs 维护
+    ref_count 为引用它的附件数（包括 community_app 的附件）
+    """
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='SHA-256')
+    size = models.PositiveBigIntegerField(verbose_name='大小')
+    file = models.FileField(max_length=255, verbose_name='文件')
+    ref_count = models.PositiveIntegerField(default=1, verbose_name='引用数')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+
+    class Meta:
+        verbose_name = '文件内容'
+        verbose_name_plural = '文件内容'
+
+    def __str__(self):
+        return self.sha256
+
+class Derivative(models.Model):
+    """
+    文件内容的缩略图与预览，也是后台生成任务的任务表，由 community.derivatives 维护
+    """
+    KIND_CHOICES = [('thumbnail', '缩略图'), ('preview', '首页预览')]
+    STATUS_CHOICES = [
+        ('pending', '等待生成'), ('running', '生成中'), ('done', '已生成'), ('failed', '生成失败'), ('skipped', '无法生成'),
+    ]
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name='derivatives', verbose_name='文件内容')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='类型')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='状态')
+    file = models.FileField(max_length=255, blank=True, verbose_name='文件')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='尝试次数')
+    error = models.TextField(blank=True, default='', verbose_name='错误信息')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='开始生成时间')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '缩略图与预览'
+        verbose_name_plural = '缩略图与预览'
+        constraints = [models.UniqueConstraint(fields=['blob', 'kind'], name='derivative_blob_kind_unique')]
+        indexes = [models.Index(fields=['status', 'created_at'], name='derivative_status_idx')]
 
 class PostAttachment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='attachments', verbose_name='帖子')
     file = models.FileField(upload_to='post_attachments', verbose_name='文件')
+    # 旧附件为 None，文件直接保存在 post_attachments 下
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='post_attachments', verbose_name='文件内容')
+    name = models.CharField(max_length=255, blank=True, default='', verbose_name='文件名')
     upload_at = models.DateTimeField(auto_now_add=True, verbose_name='上传时间')
+    # 随帖子一起删除，文件内容的引用保留到附件记录真正删除时
+    is_able = models.BooleanField(default=True, verbose_name='是否禁用')
 
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
+
+class UploadSession(models.Model):
+    """
+    分片上传会话，分片保存在 uploads/<id>/ 下，全部接收后合并为帖子附件，由 community.uploads 维护
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name='上传者')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='upload_sessions', verbose_name='帖子')
+    name = models.CharField(max_length=255, verbose_name='文件名')
+    size = models.PositiveBigIntegerField(verbose_name='文件大小')
+    sha256 = models.CharField(max_length=64, blank=True, default='', verbose_name='SHA-256')
+    offset = models.PositiveBigIntegerField(default=0, verbose_name='已接收字节数')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        verbose_name = '上传会话'
+        verbose_name_plural = '上传会话'
+        indexes = [models.Index(fields=['updated_at'], name='upload_session_updated_idx')]
@@ -0,0 +1,115 @@
+"""
+帖子与回复的批量审核与删除
+审核状态在一个事务内用 bulk_update 批量写入。bulk_update 不触发信号，
+回复计数、分类帖子数、相关推荐与全文索引在这里显式刷新
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import response_cache, revisions, search, soft_delete
+from .counters import refresh_category_counters, refresh_comment_counters
+from .models import Post
+from .related import refresh_related_posts
+from .signals import VISIBILITY_FIELDS
+
+
+def _create_approve(obj):
+    obj.is_create_approved = True
+    obj.visibility = 'public'
+    return ['is_create_approved', 'visibility']
+
+
+def _create_reject(obj):
+    obj.is_create_approved = False
+    obj.visibility = 'private'
+    return ['is_create_approved', 'visibility']
+
+
+TRANSITIONS = {
+    'create_approve': _create_approve,
+    'create_reject': _create_reject,
+    'edit_approve': revisions.apply_approval,
+    'edit_reject': revisions.apply_rejection,
+}
+
+
+def max_items():
+    return getattr(settings, 'BULK_MODERATION_MAX_ITEMS', 5000)
+
+
+def bulk_moderate(queryset, ids, operation, reviewer=None):
+    """
+    对 ids 指定的对象执行审核操作，返回每一项的结果
+    :param queryset: 可被审核的对象范围
+    :param ids: 对象id列表
+    :param operation: TRANSITIONS 中的操作名
+    :param reviewer: 审核人，记录在编辑记录上
+    """
+    transition = TRANSITIONS[operation]
+    results = []
+    changed = []
+    fields = set()
+    with transaction.atomic():
+        objects = queryset.select_for_update().select_related('author', 'pending_revision').in_bulk(ids)
+        for pk in ids:
+            obj = objects.get(pk)
+            if obj is None:
+                results.append({'id': pk, 'success': False, 'error': '对象不存在或不可审核'})
+                continue
+            try:
+                fields.update(transition(obj))
+            except ValueError as e:
+                results.append({'id': pk, 'success': False, 'error': str(e)})
+                continue
+            changed.append(obj)
+            results.append({'id': pk, 'success': True})
+        if changed:
+            # bulk_update 不会自动更新 auto_now 字段
+            now = timezone.now()
+            for obj in changed:
+                obj.updated_at = now
+            fields.add('updated_at')
+            queryset.model.objects.bulk_update(changed, fields, batch_size=500)
+            revisions.mark_reviewed(changed, reviewer)
+            if queryset.model is Post:
+                refresh_post_dependents(changed)
+            else:
+                refresh_comment_dependents(changed)
+            response_cache.bump_version()
+    return results
+
+
+def refresh_post_dependents(posts):
+    """刷新批量审核后的帖子所影响的派生数据"""
+    visibility_changed = []
+    for post in posts:
+        state = tuple(getattr(post, field) for field in VISIBILITY_FIELDS)
+        if state != post._visibility_state:
+            visibility_changed.append(post)
+        post._visibility_state = state
+    if visibility_changed:
+        refresh_category_counters(
+            Post.categories.through.objects.filter(
+                post_id__in=[post.pk for post in visibility_changed]
+            ).values_list('category_id', flat=True)
+        )
+        for post in visibility_changed:
+            refresh_related_posts(post)
+    for post in posts:
+        search.index_post(post)
+
+
+def refresh_comment_dependents(comments):
+    """刷新批量审核后的回复所影响的派生数据"""
+    refresh_comment_counters(comment.post_id for comment in comments)
+    for comment in comments:
+        search.index_comment(comment)
+
+
+def disable_post(post):
+    """删除帖子，它的回复与附件一并批量删除"""
+    comment_ids, _ = soft_delete.disable(post, post.comments.all(), post.attachments.all())
+    refresh_comment_counters([post.pk])
+    for pk in comment_ids:
+        search.remove_document('comment', pk)
@@ -0,0 +1,285 @@
+import base64
+import hashlib
+import heapq
+import json
+from collections import OrderedDict
+from functools import cmp_to_key
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def cached_count(queryset):
+    """
+    统计查询集总数，结果按 SQL 缓存 PAGINATION_COUNT_CACHE_TIMEOUT 秒
+    """
+    if not isinstance(queryset, QuerySet):
+        return len(queryset)
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    key = 'pagination:count:' + hashlib.md5(f'{sql}{params!r}'.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 30))
+    return count
+
+
+def slice_queryset(queryset, start, stop):
+    """
+    返回 queryset[start:stop]
+    查询集由几个 OR 分支组成（见 community.models.BranchedQuerySet）时，OR 条件只能按一个索引扫描并逐行判断，
+    这里让每个分支按排序各自使用索引取前 stop 行的排序键，归并去重后按 id 读取当前页，
+    扫描的行数只与页的位置有关，与另一个分支的数据分布无关。
+    排序包含表达式（如搜索的相关度）时按原样切片
+    """
+    branches = getattr(queryset, 'branches', None)
+    ordering = _plain_ordering(queryset) if branches else None
+    if ordering is None:
+        return queryset[start:stop]
+    if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+        ordering = (*ordering, 'pk')
+    names = [field.lstrip('-') for field in ordering]
+    runs = []
+    for condition in branches:
+        branch = queryset.filter(condition).order_by(*ordering).values_list(*names, 'pk')
+        branch.branches = None
+        runs.append(list(branch[:stop]))
+    key = cmp_to_key(_ordering_comparator(ordering, connections[queryset.db].features.nulls_order_largest))
+    seen, pks = set(), []
+    for row in heapq.merge(*runs, key=lambda row: key(row[:-1])):
+        if row[-1] not in seen:
+            seen.add(row[-1])
+            pks.append(row[-1])
+    page = queryset.filter(pk__in=pks[start:stop]).order_by(*ordering)
+    page.branches = None
+    return page
+
+
+def _plain_ordering(queryset):
+    """查询集的排序字段名，包含表达式或随机排序时返回 None"""
+    query = queryset.query
+    if query.is_sliced or query.combinator or query.distinct_fields or query.extra_order_by:
+        return None
+    ordering = query.order_by or (queryset.model._meta.ordering if query.default_ordering else ())
+    if not all(isinstance(field, str) and field != '?' for field in ordering):
+        return None
+    return tuple(ordering)
+
+
+def _ordering_comparator(ordering, nulls_largest):
+    descending = [field.startswith('-') for field in ordering]
+
+    def compare(left, right):
+        for x, y, desc in zip(left, right, descending):
+            if x == y:
+                continue
+            if x is None or y is None:
+                result = 1 if (x is None) == nulls_largest else -1
+            else:
+                result = -1 if x < y else 1
+            return -result if desc else result
+        return 0
+    return compare
+
+
+def cursor_for(obj, ordering):
+    """
+    生成从 obj 之后开始的游标，用于在分页接口之外给出下一页地址
+    """
+    paginator = KeysetPagination()
+    paginator.ordering = tuple(ordering)
+    return paginator.encode_cursor(obj)
+
+
+class KeysetPagination(BasePagination):
+    """
+    游标分页，按视图的 keyset_ordering 字段组合定位下一页，不使用 OFFSET
+    - cursor: 上一页返回的游标，首页传空值
+    - with_count: 为真时返回（缓存的）总数
+    """
+    page_size = 10  # 每页显示的记录数
+    page_size_query_param = 'page_size'  # 允许客户端通过该参数指定每页显示的记录数
+    max_page_size = 100  # 每页最大显示的记录数
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    ordering = ('-created_at', 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count = None
+        if self.with_count(request):
+            self.count = cached_count(queryset)
+        results = list(self.get_page_queryset(queryset, request, view))
+        self.has_next = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        return self.page
+
+    def with_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true')
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        返回当前页的查询集（未执行），多取一条用于判断是否有下一页
+        """
+        self.ordering = tuple(getattr(view, 'keyset_ordering', None) or self.ordering)
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+        return slice_queryset(queryset, 0, self.page_size + 1)
+
+    def get_page_window(self, queryset, request, view=None):
+        """返回 (当前页的查询集, 响应中的总数)"""
+        count = cached_count(queryset) if self.with_count(request) else None
+        return self.get_page_queryset(queryset, request, view), count
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_position_filter(self, position):
+        """
+        生成排序在游标位置之后的过滤条件
+        (a, b, c) > (x, y, z) 展开为 a > x or (a = x and b > y) or (a = x and b = y and c > z)
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, obj):
+        # 快速序列化的列表页为 .values() 的字典
+        get = obj.get if isinstance(obj, dict) else lambda name: getattr(obj, name)
+        position = [get(field.lstrip('-')) for field in self.ordering]
+        # 时间保留到微秒，DjangoJSONEncoder 会截断到毫秒
+        position = [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+        data = json.dumps(position).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            fields = [model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+            if len(position) != len(fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(fields, position)]
+        except Exception:
+            raise NotFound('无效的游标')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        content = OrderedDict([('next', self.get_next_link()), ('results', data)])
+        if self.count is not None:
+            content['count'] = self.count
+        return Response(content)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+
+class CountedPaginator(Paginator):
+    """
+    总数已在本次请求中统计过时不再执行 COUNT
+    """
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            self.__dict__['count'] = count
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        return self._get_page(slice_queryset(self.object_list, bottom, top), number, self)
+
+
+class CustomPageNumberPagination(PageNumberPagination):
+    """
+    页码分页，请求带 cursor 参数时改用游标分页
+    """
+    page_size = 10  # 每页显示的记录数
+    page_size_query_param = 'page_size'  # 允许客户端通过该参数指定每页显示的记录数
+    max_page_size = 100  # 每页最大显示的记录数
+    keyset_pagination_class = KeysetPagination
+    known_count = None
+
+    def django_paginator_class(self, queryset, page_size):
+        count, self.known_count = self.known_count, None
+        return CountedPaginator(queryset, page_size, count=count)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_page_window(self, queryset, request, view=None):
+        """
+        返回 (当前页的查询集, 响应中的总数)，用于计算条件请求的校验值
+        不分页时当前页为整个查询集
+        """
+        if self.keyset_pagination_class.cursor_query_param in request.query_params:
+            return self.keyset_pagination_class().get_page_window(queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return queryset, None
+        try:
+            page_number = max(1, int(request.query_params.get(self.page_query_param, 1)))
+        except ValueError:
+            # page=last 等无法直接定位的页按整个查询集计算
+            return queryset, queryset.count()
+        offset = (page_number - 1) * page_size
+        # 总数留给随后的分页复用
+        self.known_count = queryset.count()
+        return slice_queryset(queryset, offset, offset + page_size), self.known_count
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class OptionalPagination(CustomPageNumberPagination):
+    """
+    默认不分页，请求带 page_size 或 cursor 参数时分页
+    """
+    page_size = None
@@ -0,0 +1,43 @@
+"""
+查询计划检查
+
+用 SQLite 的 EXPLAIN QUERY PLAN 找出全表扫描，测试中用来确认列表等常用查询都能使用索引。
+"SCAN 表名" 为全表扫描，"SCAN 表名 USING INDEX ..." 为按索引顺序读取，后者在分页时读到足够的行即停止
+"""
+import re
+
+from django.db import connection
+
+FULL_SCAN_PATTERN = re.compile(r'^SCAN (\w+)$')
+# Django 子查询中的表别名，如 "community_post" U0
+ALIAS_PATTERN = re.compile(r'"(\w+)" (U\d+)\b')
+
+
+def is_supported():
+    return connection.vendor == 'sqlite'
+
+
+def explain(sql):
+    """返回查询计划每个步骤的说明"""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def full_table_scans(queries, tables):
+    """
+    :param queries: CaptureQueriesContext 记录的查询
+    :param tables: 不允许全表扫描的表
+    :return: [(sql, 全表扫描的步骤), ...]
+    """
+    scans = []
+    for query in queries:
+        sql = query['sql']
+        if not sql.startswith('SELECT'):
+            continue
+        aliases = dict((alias, table) for table, alias in ALIAS_PATTERN.findall(sql))
+        for detail in explain(sql):
+            match = FULL_SCAN_PATTERN.match(detail)
+            if match and aliases.get(match.group(1), match.group(1)) in tables:
+                scans.append((sql, detail))
+    return scans
@@ -0,0 +1,143 @@
+"""
+列表接口的只读快速序列化
+
+列表请求不需要模型实例，直接用 .values() 读取所需的列，按字段映射表生成输出，
+省去逐行构造模型对象和序列化器字段的开销。映射表在请求开始时按当前用户编译一次，
+输出的字段、顺序与取值和对应的序列化器一致（由各应用 tests.py 中的对照测试保证）。
+
+请求了 ?fields=、?expand= 等需要动态字段的参数时，视图回退到序列化器
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from .models import Post
+from .serializers import EXCERPT_LENGTH
+from .utils import format_created_at
+
+# 与序列化器的 DateTimeField 输出格式一致
+_datetime = serializers.DateTimeField()
+
+
+def datetime_value(value):
+    return _datetime.to_representation(value)
+
+
+def column(name):
+    return lambda row: row[name]
+
+
+def datetime_column(name):
+    return lambda row: datetime_value(row[name])
+
+
+def formatted_created_at(row):
+    return format_created_at(row['created_at'])
+
+
+class ValuesReader:
+    """
+    快速序列化的基类
+    - columns: .values() 读取的列
+    - get_mappers(): 输出字段名到取值函数的有序映射，取值函数的参数为一行数据
+    """
+    columns = ()
+
+    def __init__(self, request):
+        self.request = request
+        self.user = getattr(request, 'user', None)
+        self.mappers = list(self.get_mappers().items())
+
+    def get_mappers(self):
+        raise NotImplementedError
+
+    def values(self, queryset):
+        # 序列化器需要的预取在这里用不到
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def prepare(self, rows):
+        """批量读取当前页需要的关联数据"""
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        self.prepare(rows)
+        mappers = self.mappers
+        return [{name: mapper(row) for name, mapper in mappers} for row in rows]
+
+
+class PostListReader(ValuesReader):
+    """与 PostListSerializer 的默认字段一致"""
+    columns = (
+        'id', 'title', 'content', 'author__username', 'fake_author', 'public_comment_count', 'total_comment_count',
+        'view_count', 'is_pinned', 'created_at', 'last_comment_at',
+    )
+
+    def get_mappers(self):
+        # 与 Post.comment_count_for 一致
+        staff = self.user and self.user.is_authenticated and self.user.is_staff
+        return {
+            'id': column('id'),
+            'title': column('title'),
+            'excerpt': lambda row: row['content'][:EXCERPT_LENGTH],
+            'author_name': column('author__username'),
+            'fake_author': column('fake_author'),
+            'comments_count': column('total_comment_count' if staff else 'public_comment_count'),
+            'view_count': column('view_count'),
+            'is_pinned': column('is_pinned'),
+            'tag_ids': lambda row: self.tag_ids.get(row['id'], []),
+            'created_at': datetime_column('created_at'),
+            'formatted_created_at': formatted_created_at,
+            'last_comment_at': datetime_column('last_comment_at'),
+        }
+
+    def prepare(self, rows):
+        self.tag_ids = defaultdict(list)
+        relations = Post.tags.through.objects.filter(post_id__in=[row['id'] for row in rows])
+        for post_id, tag_id in relations.order_by('pk').values_list('post_id', 'tag_id'):
+            self.tag_ids[post_id].append(tag_id)
+
+
+class CommentListReader(ValuesReader):
+    """与 CommentSerializer 一致"""
+    columns = ('id', 'author_id', 'post_id', 'content', 'created_at', 'parent_comment_id', 'author__username',
+               'author__role')
+
+    def get_mappers(self):
+        return {
+            'id': column('id'),
+            'author': column('author_id'),
+            'post': column('post_id'),
+            'content': column('content'),
+            'created_at': datetime_column('created_at'),
+            'formatted_created_at': formatted_created_at,
+            'parent_comment': column('parent_comment_id'),
+            'author_name': column('author__username'),
+            'author_role': column('author__role'),
+        }
+
+
+class FastListMixin:
+    """
+    list 使用 list_reader_class 快速序列化
+    请求带 fast_list_blocking_params 中的参数时回退到序列化器；
+    FAST_LIST_SERIALIZATION 设为 False 可整体关闭
+    """
+    list_reader_class = None
+    fast_list_blocking_params = ('fields', 'expand')
+
+    def use_fast_list(self, request):
+        if self.list_reader_class is None or not getattr(settings, 'FAST_LIST_SERIALIZATION', True):
+            return False
+        return not any(request.query_params.get(name) for name in self.fast_list_blocking_params)
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_list(request):
+            return super().list(request, *args, **kwargs)
+        reader = self.list_reader_class(request)
+        queryset = reader.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.to_representation(page))
+        return Response(reader.to_representation(queryset))
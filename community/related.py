@@ -0,0 +1,104 @@
+"""
+相关帖子推荐
+每个帖子保存共享标签最多的前 RELATED_POSTS_STORED 个公开帖子，读取时不做聚合
+标签变化或帖子审核、禁用时，只重建列表可能变化的帖子：帖子自身、列表中有它的帖子（可能需要补位），
+以及它能排进前 K 个的帖子；重建用一条带窗口函数的聚合查询直接算出每个帖子的前 K 个
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import RowNumber
+
+from .models import Post, RelatedPost
+
+PUBLIC_POST_FILTER = {'post__is_able': True, 'post__is_create_approved': True, 'post__visibility': 'public'}
+# 每条聚合查询重建的帖子数，避免 IN 列表超出数据库的参数上限
+REBUILD_BATCH_SIZE = 500
+
+
+def stored_limit():
+    return getattr(settings, 'RELATED_POSTS_STORED', 20)
+
+
+def _is_public(post):
+    return post.is_able and post.is_create_approved and post.visibility == 'public'
+
+
+def _shared_tag_counts(post_id, tag_ids):
+    """统计共享 tag_ids 中标签的公开帖子及共享数"""
+    return Post.tags.through.objects.filter(
+        tag_id__in=tag_ids, **PUBLIC_POST_FILTER
+    ).exclude(post_id=post_id).values('post_id').annotate(common=Count('tag_id'))
+
+
+def _top_neighbors(post_ids):
+    """一条聚合查询算出 post_ids 中每个帖子共享标签最多的前 K 个公开帖子"""
+    return Post.tags.through.objects.filter(
+        post_id__in=post_ids, tag__posts__is_able=True, tag__posts__is_create_approved=True,
+        tag__posts__visibility='public',
+    ).annotate(related_id=F('tag__posts'), related_created_at=F('tag__posts__created_at')).exclude(
+        related_id=F('post_id')
+    ).values('post_id', 'related_id', 'related_created_at').annotate(common=Count('tag_id')).annotate(
+        rank=Window(RowNumber(), partition_by=F('post_id'), order_by=[F('common').desc(), F('related_created_at').desc()])
+    ).filter(rank__lte=stored_limit())
+
+
+def _rebuild(post_ids):
+    """按当前标签与可见性重建 post_ids 的相关列表"""
+    post_ids = sorted(set(post_ids))
+    for start in range(0, len(post_ids), REBUILD_BATCH_SIZE):
+        batch = post_ids[start:start + REBUILD_BATCH_SIZE]
+        rows = [
+            RelatedPost(post_id=row['post_id'], related_id=row['related_id'], common_tags=row['common'])
+            for row in _top_neighbors(batch)
+        ]
+        RelatedPost.objects.filter(post_id__in=batch).delete()
+        RelatedPost.objects.bulk_create(rows)
+
+
+def _ranked_into(post, tag_ids):
+    """共享标签的帖子中，post 能排进其前 K 个的帖子"""
+    # 各帖子当前列表中的第 K 个，不足 K 个时为空
+    kth = RelatedPost.objects.filter(post_id=OuterRef('post_id')).order_by(
+        '-common_tags', '-related__created_at'
+    )[stored_limit() - 1:stored_limit()]
+    return _shared_tag_counts(post.pk, tag_ids).annotate(
+        kth_common=Subquery(kth.values('common_tags')),
+        kth_created_at=Subquery(kth.values('related__created_at')),
+    ).filter(
+        Q(kth_common__isnull=True) | Q(common__gt=F('kth_common'))
+        | Q(common=F('kth_common'), kth_created_at__lt=post.created_at)
+    ).values_list('post_id', flat=True)
+
+
+@transaction.atomic
+def refresh_related_posts(post):
+    """
+    重建受帖子变化影响的相关列表
+    :param post: 标签或可见性发生变化的帖子
+    """
+    tag_ids = set(post.tags.values_list('pk', flat=True))
+    # 列表中有它的帖子按当前标签重建，不再相关时由后面的帖子补位
+    affected = {post.pk, *RelatedPost.objects.filter(related=post).values_list('post_id', flat=True)}
+    if _is_public(post) and tag_ids:
+        affected.update(_ranked_into(post, tag_ids))
+    _rebuild(affected)
+
+
+def related_posts_for(post, queryset=None, limit=None):
+    """按共享标签数返回可见的相关帖子"""
+    queryset = Post.objects.all() if queryset is None else queryset
+    limit = limit or getattr(settings, 'RELATED_POSTS_RETURNED', 5)
+    return queryset.filter(
+        related_by__post=post, is_create_approved=True, visibility='public'
+    ).order_by('-related_by__common_tags', '-created_at')[:limit]
+
+
+def rebuild_related_posts():
+    """重建全部帖子的相关列表，返回处理的帖子数"""
+    RelatedPost.objects.all().delete()
+    post_ids = list(Post.objects.filter(tags__isnull=False).values_list('pk', flat=True).distinct())
+    for start in range(0, len(post_ids), REBUILD_BATCH_SIZE):
+        with transaction.atomic():
+            _rebuild(post_ids[start:start + REBUILD_BATCH_SIZE])
+    return len(post_ids)
@@ -0,0 +1,31 @@
+"""
+基于 orjson 的 JSON 渲染器
+orjson 为可选依赖，未安装或请求了缩进输出时回退到 DRF 的 JSONRenderer
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    输出与 JSONRenderer 的紧凑、非 ASCII 转义格式一致
+    orjson 不能直接编码的类型交给 DRF 的 JSONEncoder 处理
+    """
+    _encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self._encoder.default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # 与 JSONRenderer 一样转义 U+2028/U+2029，保证输出可作为 JavaScript 字面量
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
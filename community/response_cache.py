@@ -0,0 +1,109 @@
+"""
+匿名用户的帖子列表与详情响应缓存
+
+匿名用户只能看到已审核的公开帖子，同样的查询参数得到同样的响应。
+缓存键包含一个全局版本号，审核、编辑审核、置顶、禁用、回复审核等操作
+只需递增版本号，旧缓存自然失效，不需要扫描删除。
+
+版本号变化后第一个请求负责重建缓存，同时到达的其他请求先返回上一个版本的响应；
+重建时数据库出错也返回上一个版本的响应
+
+版本号必须保存在各进程共享的缓存中，否则一个进程中的审核、禁用不会让其他进程的缓存失效，
+因此默认缓存为进程内缓存时不启用（见 settings.CACHES）
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+
+from .utils import cache_is_shared
+
+VERSION_KEY = 'community:posts:version'
+
+
+def get_version():
+    # 版本号以当前时间为初值，缓存被清空后不会与旧版本号重复
+    cache.add(VERSION_KEY, int(time.time() * 1000), None)
+    return cache.get(VERSION_KEY)
+
+
+def bump_version():
+    """使所有匿名响应缓存失效"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_version()
+
+
+def _timeout(name, default):
+    return getattr(settings, name, default)
+
+
+class AnonymousResponseCacheMixin:
+    """
+    缓存匿名用户 list 与 retrieve 的响应
+    - RESPONSE_CACHE_TIMEOUT: 当前版本响应的缓存时间
+    - RESPONSE_CACHE_STALE_TIMEOUT: 上一个版本的响应可继续使用的时间
+    - RESPONSE_CACHE_LOCK_TIMEOUT: 重建缓存的锁的最长持有时间
+    """
+    cached_actions = ('list', 'retrieve')
+
+    def get_response_cache_key(self, request):
+        params = sorted((key, request.query_params.getlist(key)) for key in request.query_params)
+        raw = repr((self.action, self.kwargs.get(self.lookup_url_kwarg or self.lookup_field), params))
+        return 'community:posts:response:' + hashlib.md5(raw.encode()).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated or self.action not in self.cached_actions or not cache_is_shared():
+            return handler(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        version = get_version()
+        cached = cache.get_many([key, f'{key}:fresh'])
+        entry = cached.get(key)
+        if entry is None or entry['version'] != version or cached.get(f'{key}:fresh') != version:
+            if entry is None:
+                return self.store_response(key, version, handler(request, *args, **kwargs))
+            # 只有一个请求负责重建，其他请求先使用上一个版本的响应
+            if cache.add(f'{key}:lock', True, _timeout('RESPONSE_CACHE_LOCK_TIMEOUT', 10)):
+                try:
+                    return self.store_response(key, version, handler(request, *args, **kwargs))
+                except DatabaseError:
+                    # 数据库出错时返回上一个版本的响应
+                    pass
+                finally:
+                    cache.delete(f'{key}:lock')
+        self.on_cached_response(entry)
+        response = get_conditional_response(request, etag=entry['etag'])
+        if response is None:
+            response = Response(entry['data'])
+        for header in ('ETag', 'Last-Modified', 'Vary'):
+            if entry.get(header.lower()):
+                response[header] = entry[header.lower()]
+        return response
+
+    def store_response(self, key, version, response):
+        if response.status_code == 200:
+            entry = {
+                'version': version,
+                'data': response.data,
+                'etag': response.get('ETag'),
+                'last-modified': response.get('Last-Modified'),
+                'vary': response.get('Vary'),
+            }
+            # 当前版本的缓存过期后，条目仍保留一段时间供重建时使用
+            cache.set(key, entry, _timeout('RESPONSE_CACHE_STALE_TIMEOUT', 600))
+            cache.set(f'{key}:fresh', version, _timeout('RESPONSE_CACHE_TIMEOUT', 60))
+        return response
+
+    def on_cached_response(self, entry):
+        """返回缓存的响应时的回调"""
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,172 @@
+"""
+帖子与回复的编辑记录
+
+帖子与回复的 title / content 始终是已通过的版本，列表与详情直接读取，不需要按用户判断显示哪个版本。
+每次编辑追加一条 Revision，只保存相对基准版本（提交时已通过的编辑）的差异；
+对象上的 approved_revision / pending_revision 指向当前通过与待审核的编辑，
+审核时不需要查找最新记录。第一次编辑时为原始内容保存一条完整快照，历史可以从快照依次还原
+
+差异是操作列表：正整数为复制基准中的 n 个字符，负整数为跳过 n 个字符，字符串为插入的文本
+"""
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Post, Revision
+
+
+def encode_diff(base, text):
+    """按行比较，返回把 base 变为 text 的操作列表"""
+    base_lines = base.splitlines(keepends=True)
+    text_lines = text.splitlines(keepends=True)
+    ops = []
+
+    def push(op):
+        # 合并相邻的同类操作
+        if ops and type(ops[-1]) is type(op) and (isinstance(op, str) or (ops[-1] > 0) == (op > 0)):
+            ops[-1] += op
+        else:
+            ops.append(op)
+
+    matcher = SequenceMatcher(None, base_lines, text_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            push(sum(len(line) for line in base_lines[i1:i2]))
+            continue
+        if i2 > i1:
+            push(-sum(len(line) for line in base_lines[i1:i2]))
+        if j2 > j1:
+            push(''.join(text_lines[j1:j2]))
+    return ops
+
+
+def apply_diff(base, ops):
+    """
+    :raises ValueError: 差异与 base 不匹配
+    """
+    parts = []
+    position = 0
+    for op in ops:
+        if isinstance(op, str):
+            parts.append(op)
+        elif op > 0:
+            parts.append(base[position:position + op])
+            position += op
+        else:
+            position -= op
+        if position > len(base):
+            raise ValueError('编辑记录与当前内容不匹配')
+    if position != len(base):
+        raise ValueError('编辑记录与当前内容不匹配')
+    return ''.join(parts)
+
+
+def _target(obj):
+    return {'post': obj} if isinstance(obj, Post) else {'comment': obj}
+
+
+def _snapshot(obj):
+    """为还没有编辑记录的对象保存原始内容"""
+    revision = Revision.objects.create(
+        **_target(obj), author_id=obj.author_id, status='approved', reviewed_at=timezone.now(),
+        title_diff=encode_diff('', obj.title) if isinstance(obj, Post) else None,
+        content_diff=encode_diff('', obj.content),
+    )
+    obj.approved_revision = revision
+    return revision
+
+
+def submit(obj, author, title=None, content=None):
+    """
+    提交编辑，等待审核。title / content 为 None 时保持不变，之前待审核的编辑被取代
+    """
+    with transaction.atomic():
+        base = obj.approved_revision or _snapshot(obj)
+        if obj.pending_revision_id:
+            Revision.objects.filter(pk=obj.pending_revision_id).update(status='superseded')
+        title_diff = None
+        if isinstance(obj, Post):
+            title_diff = encode_diff(obj.title, obj.title if title is None else title)
+        revision = Revision.objects.create(
+            **_target(obj), base=base, author=author, title_diff=title_diff,
+            content_diff=encode_diff(obj.content, obj.content if content is None else content),
+        )
+        obj.pending_revision = revision
+        obj.is_edit_approved = False
+        obj.last_edited_at = timezone.now()
+        obj.save(update_fields=['approved_revision', 'pending_revision', 'is_edit_approved', 'last_edited_at', 'updated_at'])
+    return revision
+
+
+def pending_text(obj):
+    """待审核编辑的标题与内容，没有待审核的编辑时为 None"""
+    revision = obj.pending_revision
+    if revision is None:
+        return None
+    text = {'content': apply_diff(obj.content, revision.content_diff)}
+    if revision.title_diff is not None:
+        text['title'] = apply_diff(obj.title, revision.title_diff)
+    return text
+
+
+def apply_approval(obj):
+    """
+    把待审核的编辑写入对象（不保存），返回变化的字段
+    :raises ValueError: 没有待审核的编辑，或编辑所基于的版本已不是当前版本
+    """
+    revision = obj.pending_revision
+    if revision is None:
+        raise ValueError('没有待审核的编辑')
+    if revision.base_id != obj.approved_revision_id:
+        raise ValueError('编辑所基于的版本已变化')
+    text = pending_text(obj)
+    fields = ['content', 'approved_revision', 'pending_revision', 'is_edit_approved']
+    obj.content = text['content']
+    if 'title' in text:
+        obj.title = text['title']
+        fields.append('title')
+    obj._reviewed_revision = revision
+    obj.approved_revision = revision
+    obj.pending_revision = None
+    obj.is_edit_approved = True
+    return fields
+
+
+def apply_rejection(obj):
+    """
+    驳回待审核的编辑（不保存），返回变化的字段
+    :raises ValueError: 没有待审核的编辑
+    """
+    revision = obj.pending_revision
+    if revision is None:
+        raise ValueError('没有待审核的编辑')
+    obj._reviewed_revision = revision
+    obj.pending_revision = None
+    obj.is_edit_approved = False
+    return ['pending_revision', 'is_edit_approved']
+
+
+def mark_reviewed(objects, reviewer):
+    """记录 apply_approval / apply_rejection 处理过的编辑的审核结果，每种结果一条 UPDATE"""
+    by_status = {}
+    for obj in objects:
+        revision = getattr(obj, '_reviewed_revision', None)
+        if revision is not None:
+            status = 'approved' if obj.approved_revision_id == revision.pk else 'rejected'
+            by_status.setdefault(status, []).append(revision.pk)
+            del obj._reviewed_revision
+    now = timezone.now()
+    for status, ids in by_status.items():
+        Revision.objects.filter(pk__in=ids).update(status=status, reviewer=reviewer, reviewed_at=now)
+
+
+def review(obj, approved, reviewer):
+    """
+    审核单个对象的待审核编辑
+    :raises ValueError: 同 apply_approval / apply_rejection
+    """
+    with transaction.atomic():
+        (apply_approval if approved else apply_rejection)(obj)
+        obj.save()
+        mark_reviewed([obj], reviewer)
@@ -0,0 +1,172 @@
+"""
+基于 SQLite FTS5 的帖子与回复全文检索
+
+FTS5 自带的分词器不能切分中文，写入索引前先在 Python 中分词：
+英文与数字按词切分并转小写，连续的中日韩文字切成重叠的双字组，最后一个字另作为单字收录，
+每个字都是某个索引词的开头。查询时用同样的方式分词并组成短语查询，保证双字组相邻；
+单个汉字按前缀匹配
+"""
+import html
+import re
+
+from django.conf import settings
+from django.db import connection
+
+FTS_TABLE = 'community_search_index'
+# 列顺序：doc_type, doc_id, post_id, title, body, author
+BM25_WEIGHTS = (0.0, 0.0, 0.0, 10.0, 1.0, 2.0)
+
+_CJK = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_TOKEN_RE = re.compile(rf'[{_CJK}]+|[^\W{_CJK}]+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+_available = {}
+
+
+def split_terms(text):
+    """切分出连续的中日韩文字串与英文单词"""
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+def bigrams(term):
+    if not _CJK_RE.match(term) or len(term) == 1:
+        return [term]
+    return [term[i:i + 2] for i in range(len(term) - 1)]
+
+
+def index_tokens(term):
+    """索引词：双字组之后再收录最后一个字，单字查询按前缀匹配时能命中每个字"""
+    tokens = bigrams(term)
+    if len(term) > 1 and _CJK_RE.match(term):
+        tokens.append(term[-1])
+    return tokens
+
+
+def tokenize(text):
+    """把文本转成以空格分隔的索引词"""
+    return ' '.join(token for term in split_terms(text) for token in index_tokens(term))
+
+
+def build_match_query(query):
+    """
+    把用户输入转成 FTS5 MATCH 表达式，各词之间为 AND 关系
+    最后一个英文词按前缀匹配，便于边输入边搜索；单个汉字按前缀匹配以它开头的双字组与单字
+    """
+    terms = split_terms(query)
+    phrases = []
+    for term in terms:
+        phrase = '"%s"' % ' '.join(bigrams(term))
+        if len(term) == 1 and _CJK_RE.match(term):
+            phrase += '*'
+        phrases.append(phrase)
+    if terms and not _CJK_RE.match(terms[-1]):
+        phrases[-1] += '*'
+    return ' '.join(phrases)
+
+
+def is_available():
+    """当前数据库是否存在全文索引表"""
+    name = connection.settings_dict['NAME']
+    if name not in _available:
+        _available[name] = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _available[name]
+
+
+def _replace(doc_type, doc_id, post_id=None, title='', body='', author=''):
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE doc_type = %s AND doc_id = %s', [doc_type, doc_id])
+        if post_id is not None:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (doc_type, doc_id, post_id, title, body, author) '
+                f'VALUES (%s, %s, %s, %s, %s, %s)',
+                [doc_type, doc_id, post_id, tokenize(title), tokenize(body), tokenize(author)],
+            )
+
+
+def _is_public(obj):
+    return obj.is_able and obj.is_create_approved and obj.visibility == 'public'
+
+
+def index_post(post):
+    """同步帖子的索引，只收录已审核的公开内容"""
+    if not is_available():
+        return
+    if _is_public(post):
+        author = post.author.username if post.author_id else ''
+        _replace('post', post.pk, post.pk, post.title, post.content, author)
+    else:
+        _replace('post', post.pk)
+
+
+def index_comment(comment):
+    """同步回复的索引，只收录已审核的公开内容"""
+    if not is_available():
+        return
+    if _is_public(comment):
+        author = comment.author.username if comment.author_id else ''
+        _replace('comment', comment.pk, comment.post_id, body=comment.content, author=author)
+    else:
+        _replace('comment', comment.pk)
+
+
+def remove_document(doc_type, doc_id):
+    if is_available():
+        _replace(doc_type, doc_id)
+
+
+def search_post_ids(query, limit=None):
+    """
+    按 BM25 相关度返回匹配的帖子id，帖子本身或其回复命中均计入
+    """
+    match = build_match_query(query)
+    if not match:
+        return []
+    limit = limit or getattr(settings, 'SEARCH_MAX_RESULTS', 1000)
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    post_ids = {}
+    with connection.cursor() as cursor:
+        # bm25 不能用于聚合，按相关度顺序读取命中文档后在此去重
+        cursor.execute(
+            f'SELECT post_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY bm25({FTS_TABLE}, {weights})',
+            [match],
+        )
+        while len(post_ids) < limit:
+            rows = cursor.fetchmany(limit)
+            if not rows:
+                break
+            post_ids.update((row[0], None) for row in rows)
+    return list(post_ids)[:limit]
+
+
+def make_snippet(text, query, length=80):
+    """
+    截取包含第一个命中词的片段，命中词用 <mark> 标出
+    """
+    text = text or ''
+    terms = sorted(set(split_terms(query)), key=len, reverse=True)
+    if not terms:
+        return html.escape(text[:length])
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    match = pattern.search(text)
+    start = max(0, match.start() - length // 4) if match else 0
+    fragment = text[start:start + length]
+    marked = pattern.sub(lambda m: '\0%s\1' % m.group(0), fragment)
+    marked = html.escape(marked).replace('\0', '<mark>').replace('\1', '</mark>')
+    return ('…' if start else '') + marked + ('…' if start + length < len(text) else '')
+
+
+def rebuild_index():
+    """重建全部索引，返回收录的帖子数与回复数"""
+    from .models import Comment, Post
+
+    if not is_available():
+        return 0, 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    posts = Post.objects.filter(is_create_approved=True, visibility='public').select_related('author')
+    comments = Comment.objects.filter(is_create_approved=True, visibility='public').select_related('author')
+    for post in posts.iterator():
+        index_post(post)
+    for comment in comments.iterator():
+        index_comment(comment)
+    return posts.count(), comments.count()
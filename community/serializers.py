@@ -1,27 +1,144 @@
-from django.db.models import Q
+from django.conf import settings
 from rest_framework import serializers
-from .models import Category, Post, Comment, PostAttachment, Tag
+from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
+
+from . import blobs, category_tree, revisions, uploads
+from .models import Category, CategoryClosure, Post, Comment, PostAttachment, Revision, Tag, UploadSession
+from .pagination import cursor_for
+from .search import make_snippet
 from .utils import format_created_at
 from account.serializers import UserSerializer
 
-class CategorySerializer(serializers.ModelSerializer):
+EXCERPT_LENGTH = 100  # 列表摘要长度
+COMMENT_KEYSET_ORDERING = ('-created_at', 'id')  # 回复的游标分页排序键
+
+
+def embedded_comment_limit():
+    """帖子详情内嵌的回复数，其余回复通过 /posts/{id}/comments/ 分页读取"""
+    return getattr(settings, 'POST_EMBEDDED_COMMENTS', 20)
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    支持稀疏字段集的序列化器基类
+    - fields: 只返回指定的字段
+    - expand: 额外返回 expandable_fields 中声明的字段
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+        expand = [name for name in (expand or []) if name in self.expandable_fields]
+        for name in expand:
+            field_class, field_kwargs = self.expandable_fields[name]
+            self.fields[name] = field_class(**field_kwargs)
+        if fields:
+            allowed = set(fields) | set(expand)
+            for name in set(self.fields) - allowed:
+                self.fields.pop(name)
+
+
+class CategorySerializer(DynamicFieldsModelSerializer):
     count = serializers.SerializerMethodField(help_text='分类下帖子数')
+    subtree_count = serializers.SerializerMethodField(help_text='分类及其全部下级分类下的帖子数，同一帖子只计一次')
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'count', 'parent_id']
+        fields = ['id', 'name', 'description', 'count', 'subtree_count', 'parent_id']
         ref_name = 'CommunityCategorySerializer'
 
-    @staticmethod
-    def get_count(obj):
-        return len(obj.posts.all())
+    def is_staff(self):
+        request = self.context.get('request')
+        return bool(request and request.user.is_staff)
+
+    def get_count(self, obj):
+        # 管理员看到全部帖子数，其他用户看到公开帖子数
+        return obj.post_count if self.is_staff() else obj.public_post_count
+
+    def get_subtree_count(self, obj):
+        return obj.subtree_post_count if self.is_staff() else obj.subtree_public_post_count
+
+    def validate_parent_id(self, value):
+        if self.instance is not None and value is not None:
+            try:
+                category_tree.check_move(CategoryClosure, self.instance.pk, value.pk)
+            except ValueError as e:
+                raise serializers.ValidationError(str(e))
+        return value
+
+class PostAttachmentSerializer(DynamicFieldsModelSerializer):
+    download_url = serializers.SerializerMethodField(help_text='下载地址，支持断点续传与缓存')
+    content_url = serializers.SerializerMethodField(help_text='按内容寻址的下载地址，可以长期缓存，只有公开帖子中按内容保存的附件提供')
+    thumbnail = serializers.SerializerMethodField(help_text='缩略图地址，未生成时为空')
+    preview = serializers.SerializerMethodField(help_text='首页预览地址，未生成时为空')
 
-class PostAttachmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = PostAttachment
-        fields = ['id', 'file', 'upload_at']
+        fields = ['id', 'file', 'name', 'download_url', 'content_url', 'thumbnail', 'preview', 'upload_at']
         read_only_fields = ('upload_at',)
 
-class CommentSerializer(serializers.ModelSerializer):
+    def derivative_url(self, obj, kind):
+        if obj.blob_id is None:
+            return None
+        for derivative in obj.blob.derivatives.all():
+            if derivative.kind == kind and derivative.status == 'done':
+                request = self.context.get('request')
+                url = derivative.file.url
+                return request.build_absolute_uri(url) if request else url
+        return None
+
+    def get_download_url(self, obj):
+        return reverse(
+            'post-download-attachment', kwargs={'pk': obj.post_id, 'attachment_id': obj.pk},
+            request=self.context.get('request'),
+        )
+
+    def get_content_url(self, obj):
+        # 预取附件时 obj.post 已指向所属帖子
+        post = obj.post
+        if obj.blob_id is None or not (post.is_able and post.is_create_approved and post.visibility == 'public'):
+            return None
+        url = reverse('blob-detail', kwargs={'sha256': obj.blob.sha256}, request=self.context.get('request'))
+        return replace_query_param(url, 'name', obj.name) if obj.name else url
+
+    def get_thumbnail(self, obj):
+        return self.derivative_url(obj, 'thumbnail')
+
+    def get_preview(self, obj):
+        return self.derivative_url(obj, 'preview')
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.SerializerMethodField(help_text='单个分片的最大字节数')
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'post', 'name', 'size', 'sha256', 'offset', 'chunk_size', 'created_at', 'updated_at']
+        read_only_fields = ('offset', 'created_at', 'updated_at')
+
+    @staticmethod
+    def get_chunk_size(obj) -> int:
+        return uploads.chunk_size()
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('文件不能为空')
+        return value
+
+    def validate_sha256(self, value):
+        if value and not blobs.is_digest(value):
+            raise serializers.ValidationError('无效的sha256')
+        return value
+
+    def validate(self, attrs):
+        try:
+            uploads.check_file(attrs['name'], attrs['size'])
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return attrs
+
+class CommentSerializer(DynamicFieldsModelSerializer):
     formatted_created_at = serializers.SerializerMethodField(help_text='格式化创建时间')
     author_name = serializers.SerializerMethodField()
     author_role = serializers.SerializerMethodField()
@@ -32,9 +149,16 @@ class CommentSerializer(serializers.ModelSerializer):
                     'id', 'author', 'post', 'content', 'created_at', 'formatted_created_at', 'parent_comment',
                     'author_name', 'author_role'
                   ]
-        read_only_fields = ('created_at', 'parent_comment',)
+        read_only_fields = ('created_at',)
         ref_name = 'CommunityCommentSerializer'
 
+    def validate(self, attrs):
+        parent = attrs.get('parent_comment')
+        post = attrs.get('post', getattr(self.instance, 'post', None))
+        if parent is not None and parent.post_id != getattr(post, 'pk', None):
+            raise serializers.ValidationError({'parent_comment': '上级回复不属于该帖子'})
+        return attrs
+
     @staticmethod
     def get_formatted_created_at(obj) -> str:
         return format_created_at(obj.created_at)
@@ -47,17 +171,101 @@ class CommentSerializer(serializers.ModelSerializer):
     def get_author_role(obj):
         return obj.author.role
 
-class TagSerializer(serializers.ModelSerializer):
+class CommentTreeSerializer(CommentSerializer):
+    """
+    嵌套的回复线程，replies 为直接下级回复（由 community.threads.build_tree 设置）
+    """
+    replies = serializers.SerializerMethodField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['depth', 'replies']
+        ref_name = 'CommunityCommentTreeSerializer'
+
+    def get_replies(self, obj):
+        return CommentTreeSerializer(getattr(obj, 'children', []), many=True, context=self.context).data
+
+class RevisionSerializer(serializers.ModelSerializer):
+    """待审核的编辑，current 为当前通过的版本，proposed 为编辑后的版本"""
+    author_name = serializers.SerializerMethodField()
+    current = serializers.SerializerMethodField(help_text='当前通过的标题与内容')
+    proposed = serializers.SerializerMethodField(help_text='编辑后的标题与内容')
+
+    class Meta:
+        model = Revision
+        fields = [
+            'id', 'post', 'comment', 'author', 'author_name', 'status', 'title_diff', 'content_diff',
+            'current', 'proposed', 'created_at',
+        ]
+        read_only_fields = fields
+
+    @staticmethod
+    def get_author_name(obj):
+        return obj.author.username if obj.author else None
+
+    @staticmethod
+    def get_current(obj) -> dict:
+        target = obj.target
+        return {'title': target.title, 'content': target.content} if obj.post_id else {'content': target.content}
+
+    @staticmethod
+    def get_proposed(obj) -> dict:
+        target = obj.target
+        if target.pending_revision_id != obj.pk:
+            return None
+        target.pending_revision = obj
+        return revisions.pending_text(target)
+
+class TagSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Tag
         fields = ['id', 'name']
 
-class PostDetailSerializer(serializers.ModelSerializer):
+class PostDisplayMixin:
+    """帖子详情与列表共用的字段取值方法"""
+
+    @staticmethod
+    def get_formatted_created_at(obj) -> str:
+        return format_created_at(obj.created_at)
+
+    def embedded_comments(self, obj):
+        """
+        返回最新的 embedded_comment_limit() + 1 条可见回复，多出的一条用于判断是否还有更多
+        """
+        # 视图已按可见性预取回复时直接使用，避免每个帖子单独查询
+        comments = getattr(obj, 'visible_comments', None)
+        if comments is None:
+            request = self.context.get('request')
+            comments = obj.comments.visible_to(request.user if request else None).select_related('author')
+            obj.visible_comments = comments = list(
+                comments.order_by(*COMMENT_KEYSET_ORDERING)[:embedded_comment_limit() + 1]
+            )
+        return comments
+
+    def get_comments(self, obj):
+        comments = self.embedded_comments(obj)[:embedded_comment_limit()]
+        return CommentSerializer(comments, many=True, context=self.context).data
+
+    def get_comments_next(self, obj):
+        """其余回复的游标分页地址，没有更多回复时为 None"""
+        comments = self.embedded_comments(obj)
+        if len(comments) <= embedded_comment_limit():
+            return None
+        url = reverse('post-comments', kwargs={'pk': obj.pk}, request=self.context.get('request'))
+        return replace_query_param(url, 'cursor', cursor_for(comments[embedded_comment_limit() - 1], COMMENT_KEYSET_ORDERING))
+
+    def get_title(self, obj):
+        return obj.display_title
+
+    def get_content(self, obj):
+        return obj.display_content
+
+class PostDetailSerializer(PostDisplayMixin, DynamicFieldsModelSerializer):
     author = UserSerializer(read_only=True)
     categories = CategorySerializer(many=True, read_only=True)
     attachments = PostAttachmentSerializer(read_only=True, many=True)
     formatted_created_at = serializers.SerializerMethodField(help_text='格式化创建时间')
-    comments = serializers.SerializerMethodField()
+    comments = serializers.SerializerMethodField(help_text='最新的回复')
+    comments_next = serializers.SerializerMethodField(help_text='其余回复的分页地址')
     tag_ids = serializers.PrimaryKeyRelatedField(
         many=True,
         source='tags',
@@ -66,43 +274,69 @@ class PostDetailSerializer(serializers.ModelSerializer):
     title = serializers.SerializerMethodField()
     content = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField(help_text='回复数')
+    pending_edit = serializers.SerializerMethodField(help_text='待审核的编辑，仅作者与管理员可见')
     class Meta:
         model = Post
         fields = [
-            'id', 'title', 'content', 'author', 'categories', 'comments', 'tag_ids', 'created_at',
+            'id', 'title', 'content', 'author', 'categories', 'comments', 'comments_next', 'tag_ids', 'created_at',
             'updated_at',  'view_count', 'is_pinned', 'attachments', 'formatted_created_at', 'comments_count',
-            'is_able', 'fake_author',
+            'is_able', 'fake_author', 'pending_edit',
         ]
         read_only_fields = ('created_at', 'updated_at', 'author', 'view_count', 'is_able', 'comments_count', )
 
-    @staticmethod
-    def get_formatted_created_at(obj) -> str:
-        return format_created_at(obj.created_at)
+    def get_comments_count(self, obj):
+        return obj.comment_count_for(self.context['request'].user)
 
-    def get_comments(self, obj):
-        request = self.context.get('request')
-        comments = obj.comments.all()
-        # 未认证用户只能看到已审核的公开回复
-        if not request or not request.user.is_authenticated:
-            comments = comments.filter(is_create_approved=True, visibility='public').exclude(is_able=False)
-        # 认证非管理员用户可以看到已审核公开评论和自己的回复
-        elif not request.user.is_staff:
-            comments = comments.filter(
-                Q(is_create_approved=True, visibility='public') | Q(author=request.user)
-            ).exclude(is_able=False)
-        return CommentSerializer(comments, many=True, context=self.context).data
+    def get_pending_edit(self, obj) -> dict:
+        user = self.context['request'].user
+        if not obj.pending_revision_id or not (user.is_staff or user.pk == obj.author_id):
+            return None
+        return revisions.pending_text(obj)
+
+class PostListSerializer(PostDisplayMixin, DynamicFieldsModelSerializer):
+    """
+    帖子列表的轻量表示，回复、附件、分类等需通过 ?expand= 显式请求
+    """
+    title = serializers.SerializerMethodField()
+    excerpt = serializers.SerializerMethodField(help_text='内容摘要')
+    author_name = serializers.SerializerMethodField(help_text='作者名')
+    comments_count = serializers.SerializerMethodField(help_text='回复数')
+    formatted_created_at = serializers.SerializerMethodField(help_text='格式化创建时间')
+    tag_ids = serializers.PrimaryKeyRelatedField(
+        many=True,
+        source='tags',
+        read_only=True,
+    )
+    expandable_fields = {
+        'content': (serializers.SerializerMethodField, {}),
+        'author': (UserSerializer, {'read_only': True}),
+        'categories': (CategorySerializer, {'many': True, 'read_only': True}),
+        'attachments': (PostAttachmentSerializer, {'many': True, 'read_only': True}),
+        'comments': (serializers.SerializerMethodField, {}),
+        'snippet': (serializers.SerializerMethodField, {'help_text': '搜索命中片段'}),
+    }
+
+    class Meta:
+        model = Post
+        fields = [
+            'id', 'title', 'excerpt', 'author_name', 'fake_author', 'comments_count', 'view_count',
+            'is_pinned', 'tag_ids', 'created_at', 'formatted_created_at', 'last_comment_at',
+        ]
+        read_only_fields = fields
 
     def get_comments_count(self, obj):
-        return len(self.get_comments(obj))
+        return obj.comment_count_for(self.context['request'].user)
 
-    def get_title(self, obj):
-        obj._request_user = self.context['request'].user
-        return obj.display_title
+    def get_excerpt(self, obj):
+        return self.get_content(obj)[:EXCERPT_LENGTH]
 
-    def get_content(self, obj):
-        # 将请求用户传递给模型
-        obj._request_user = self.context['request'].user
-        return obj.display_content
+    @staticmethod
+    def get_author_name(obj):
+        return obj.author.username if obj.author else None
+
+    def get_snippet(self, obj):
+        query = self.context['request'].query_params.get('search', '')
+        return make_snippet(self.get_content(obj), query)
 
 class PostCreateOrEditSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
@@ -0,0 +1,235 @@
+from django.db.models.signals import post_save, post_delete, post_init, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import blobs, category_tree, derivatives, response_cache, search
+from .counters import category_cache, refresh_comment_counters, refresh_category_counters, refresh_subtree_counters
+from account.models import User
+
+from .models import Category, CategoryClosure, Comment, Post, PostAttachment, Tag
+from .related import refresh_related_posts
+from .threads import assign_path
+
+# 决定帖子是否公开可见的字段
+VISIBILITY_FIELDS = ('is_able', 'is_create_approved', 'visibility')
+
+
+@receiver(post_save, sender=Comment)
+def assign_comment_path(sender, instance, created, **kwargs):
+    """新建回复后写入线程路径"""
+    if created:
+        assign_path(instance)
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_counters(sender, instance, **kwargs):
+    """回复创建、审核、驳回、禁用后刷新所属帖子的回复计数"""
+    refresh_comment_counters([instance.post_id])
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_counters_on_delete(sender, instance, **kwargs):
+    refresh_comment_counters([instance.post_id])
+
+
+@receiver(post_init, sender=User)
+def remember_staff_state(sender, instance, **kwargs):
+    # 延迟加载的字段不读取，避免额外查询
+    instance._reply_counted_is_staff = instance.__dict__.get('is_staff')
+
+
+@receiver(post_save, sender=User)
+def update_comment_counters_on_staff_change(sender, instance, created, **kwargs):
+    """用户成为或不再是管理员后，刷新其回复过的帖子的管理员回复状态；queryset.update() 修改时不会触发"""
+    if not created and instance._reply_counted_is_staff is not None \
+            and instance.is_staff != instance._reply_counted_is_staff:
+        refresh_comment_counters(Comment.objects.filter(author=instance).values_list('post_id', flat=True))
+    instance._reply_counted_is_staff = instance.is_staff
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_search_index(sender, instance, **kwargs):
+    search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def remove_comment_search_index(sender, instance, **kwargs):
+    search.remove_document('comment', instance.pk)
+
+
+@receiver(post_init, sender=Category)
+def remember_category_parent(sender, instance, **kwargs):
+    instance._tree_parent_id = instance.__dict__.get('parent_id_id')
+
+
+@receiver(pre_save, sender=Category)
+def check_category_parent(sender, instance, **kwargs):
+    """不允许形成环"""
+    if instance.pk and instance.parent_id_id != instance._tree_parent_id:
+        category_tree.check_move(CategoryClosure, instance.pk, instance.parent_id_id)
+
+
+@receiver(post_save, sender=Category)
+def update_category_closure(sender, instance, created, **kwargs):
+    """分类新建或上级变化后维护闭包表，并刷新新旧祖先的子树帖子数"""
+    old_parent_id = instance._tree_parent_id
+    if created:
+        category_tree.insert_node(CategoryClosure, instance.pk, instance.parent_id_id)
+    elif instance.parent_id_id != old_parent_id:
+        old_ancestors = category_tree.ancestor_ids(CategoryClosure, [old_parent_id])
+        category_tree.move_node(CategoryClosure, instance.pk, instance.parent_id_id)
+        refresh_subtree_counters(old_ancestors | category_tree.ancestor_ids(CategoryClosure, [instance.pk]))
+    instance._tree_parent_id = instance.parent_id_id
+    category_cache.invalidate()
+
+
+@receiver(pre_delete, sender=Category)
+def detach_category_children(sender, instance, **kwargs):
+    """下级分类成为顶级分类，记录祖先以便删除后刷新子树帖子数"""
+    instance._tree_ancestor_ids = category_tree.ancestor_ids(CategoryClosure, [instance.pk]) - {instance.pk}
+    category_tree.detach_children(CategoryClosure, Category, instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+def update_subtree_counters_on_category_delete(sender, instance, **kwargs):
+    refresh_subtree_counters(getattr(instance, '_tree_ancestor_ids', set()))
+
+
+@receiver(post_save, sender=Post)
+def update_post_search_index(sender, instance, **kwargs):
+    """帖子审核、编辑审核通过、禁用后同步全文索引"""
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_search_index(sender, instance, **kwargs):
+    search.remove_document('post', instance.pk)
+
+
+def _visibility_state(instance):
+    # 延迟加载的字段不读取，避免额外查询
+    return tuple(instance.__dict__.get(field) for field in VISIBILITY_FIELDS)
+
+
+@receiver(post_init, sender=Post)
+def remember_visibility_state(sender, instance, **kwargs):
+    instance._visibility_state = _visibility_state(instance)
+
+
+@receiver(post_save, sender=Post)
+def update_visibility_dependents(sender, instance, created, **kwargs):
+    """帖子审核、可见性或禁用状态变化后刷新分类帖子数与相关推荐"""
+    state = _visibility_state(instance)
+    if not created and state != instance._visibility_state:
+        refresh_category_counters(instance.categories.values_list('pk', flat=True))
+        refresh_related_posts(instance)
+    instance._visibility_state = state
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_categories(sender, instance, **kwargs):
+    instance._deleted_category_ids = list(instance.categories.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def update_category_counters_on_delete(sender, instance, **kwargs):
+    refresh_category_counters(getattr(instance, '_deleted_category_ids', []))
+
+
+@receiver(m2m_changed, sender=Post.categories.through)
+def update_category_counters_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    """帖子与分类关联变化后刷新受影响分类的帖子数"""
+    if action == 'pre_clear':
+        # clear 不提供 pk_set，先记录被清除的关联
+        if reverse:
+            instance._cleared_category_ids = [instance.pk]
+        else:
+            instance._cleared_category_ids = list(instance.categories.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        refresh_category_counters(getattr(instance, '_cleared_category_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        refresh_category_counters([instance.pk] if reverse else pk_set)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_related_posts_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    """帖子标签变化后增量更新相关推荐"""
+    if action == 'pre_clear' and reverse:
+        # 清空标签下的帖子时先记录受影响的帖子
+        instance._cleared_post_ids = list(instance.posts.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_related_posts(instance)
+        return
+    post_ids = getattr(instance, '_cleared_post_ids', []) if action == 'post_clear' else pk_set
+    for post in Post.objects.filter(pk__in=post_ids):
+        refresh_related_posts(post)
+
+
+def touch_posts(post_ids):
+    """更新帖子的 updated_at，使条件请求的校验值失效"""
+    post_ids = set(post_ids)
+    if post_ids:
+        Post.objects.filter(pk__in=post_ids).update(updated_at=timezone.now())
+        response_cache.bump_version()
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+@receiver(m2m_changed, sender=Post.categories.through)
+def touch_posts_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    """帖子的标签、分类变化后更新帖子的修改时间"""
+    if action == 'pre_clear' and reverse:
+        # 从标签或分类一侧清空时先记录受影响的帖子
+        lookup = {instance._meta.model_name: instance.pk}
+        instance._touched_post_ids = list(sender.objects.filter(**lookup).values_list('post_id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_posts([instance.pk])
+    elif action == 'post_clear':
+        touch_posts(getattr(instance, '_touched_post_ids', []))
+    else:
+        touch_posts(pk_set)
+
+
+@receiver(post_save, sender=PostAttachment)
+@receiver(post_delete, sender=PostAttachment)
+def touch_post_on_attachment_changed(sender, instance, **kwargs):
+    touch_posts([instance.post_id])
+
+
+@receiver(post_save, sender=PostAttachment)
+def enqueue_attachment_derivatives(sender, instance, created, **kwargs):
+    """新附件登记缩略图或预览的生成任务"""
+    if created and instance.blob_id:
+        derivatives.enqueue(instance.blob, instance.name)
+
+
+@receiver(post_delete, sender=PostAttachment)
+def release_attachment_blob(sender, instance, **kwargs):
+    """附件删除后减少文件内容的引用计数"""
+    blobs.release(instance.blob_id)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_response_cache_version(sender, instance, **kwargs):
+    """帖子审核、编辑审核、置顶、禁用及分类、标签变化后使匿名响应缓存失效"""
+    response_cache.bump_version()
+
+
+@receiver(post_save, sender=Comment)
+def bump_response_cache_version_on_comment(sender, instance, created, **kwargs):
+    # 新建的未审核回复匿名用户看不到
+    if not created or (instance.is_create_approved and instance.visibility == 'public'):
+        response_cache.bump_version()
+
+
+@receiver(post_delete, sender=Comment)
+def bump_response_cache_version_on_comment_delete(sender, instance, **kwargs):
+    response_cache.bump_version()
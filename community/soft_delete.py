@@ -0,0 +1,39 @@
+"""
+软删除
+
+帖子、回复、附件与需求以 is_able 为假表示已删除。模型的默认管理器 objects 只返回未删除的行，
+已删除的行只能通过 all_objects 读取；外键访问与 refresh_from_db 使用基础管理器，不受影响。
+未删除的行上建有部分索引，默认管理器的查询都带 is_able 条件，可以使用这些索引
+"""
+from django.db import models, transaction
+from django.utils import timezone
+
+
+class SoftDeleteManager(models.Manager):
+    """只返回未删除的行，用 SoftDeleteManager.from_queryset(QuerySet)() 保留自定义查询集的方法"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(is_able=True)
+
+
+def disable(instance, *related):
+    """
+    删除 instance 并批量删除 related 中的关联行
+    instance 通过 save() 保存，信号照常刷新派生数据；关联行用一条 UPDATE 删除，不触发信号，
+    调用方根据返回的id自行刷新
+    :param related: 关联行的查询集，如 post.comments.all()
+    :return: 每个查询集中被删除的行id列表
+    """
+    with transaction.atomic():
+        instance.is_able = False
+        instance.save()
+        disabled = []
+        for queryset in related:
+            ids = list(queryset.values_list('pk', flat=True))
+            fields = {'is_able': False}
+            if any(field.name == 'updated_at' for field in queryset.model._meta.concrete_fields):
+                # update() 不会自动更新 auto_now 字段
+                fields['updated_at'] = timezone.now()
+            queryset.model.all_objects.filter(pk__in=ids).update(**fields)
+            disabled.append(ids)
+    return disabled
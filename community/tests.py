@@ -1,3 +1,1377 @@
-from django.test import TestCase
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import addModuleCleanup, mock, skipIf, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from account.models import User
+from . import blobs, derivatives, query_plans, revisions, uploads
+from .models import (
+    Blob, Category, CategoryClosure, Comment, Derivative, Post, PostAttachment, Revision, Tag, UploadSession,
+)
+from .counters import category_cache
+from .pagination import slice_queryset
+from .related import rebuild_related_posts
+from .renderers import ORJSONRenderer
+from .view_counter import post_view_counter
+from .views import ChunkParser, PostViewSet
+
+
+def setUpModule():
+    # 浏览量只在用例中显式写回，定时线程不会在其他用例运行时访问测试数据库
+    long_interval = override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600)
+    long_interval.enable()
+    addModuleCleanup(long_interval.disable)
+
+
+def discard_pending_views():
+    """丢弃浏览量计数器中待写回的增量并取消定时写回"""
+    with post_view_counter._lock:
+        if post_view_counter._timer is not None:
+            post_view_counter._timer.cancel()
+            post_view_counter._timer = None
+        post_view_counter._pending = {}
+        post_view_counter._last_flush = time.monotonic()
+
+
+def use_shared_cache(test):
+    """在用例中使用文件缓存，它由同一台机器上的各进程共享"""
+    location = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, location, ignore_errors=True)
+    test.enterContext(override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+    }))
+
+
+def tearDownModule():
+    # 丢弃测试中累积的浏览量，进程退出时不会写回开发数据库
+    discard_pending_views()
+
+
+class PostListQueryCountTests(TestCase):
+    """帖子列表的查询数不随分页大小变化"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.reader = User.objects.create_user(username='reader', password='pwd')
+        categories = [Category.objects.create(name=f'分类{i}') for i in range(3)]
+        tags = [Tag.objects.create(name=f'标签{i}') for i in range(3)]
+        for i in range(12):
+            post = Post.objects.create(
+                title=f'帖子{i}', content='内容', author=cls.author,
+                is_create_approved=True, visibility='public',
+            )
+            post.categories.set(categories)
+            post.tags.set(tags)
+            PostAttachment.objects.create(post=post, file=f'post_attachments/{i}.txt')
+            for j in range(3):
+                Comment.objects.create(
+                    post=post, author=cls.reader, content=f'回复{j}',
+                    is_create_approved=True, visibility='public',
+                )
+
+    def setUp(self):
+        cache.clear()
+
+    def _count_list_queries(self, client, page_size, **params):
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get('/api/community/posts/', {'page_size': page_size, **params})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(ctx.captured_queries)
+
+    def test_anonymous_list_query_count_is_constant(self):
+        client = APIClient()
+        self.assertEqual(self._count_list_queries(client, 2), self._count_list_queries(client, 12))
+
+    def test_authenticated_list_query_count_is_constant(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        self.assertEqual(self._count_list_queries(client, 2), self._count_list_queries(client, 12))
+
+    def test_expanded_list_query_count_is_constant(self):
+        client = APIClient()
+        expand = {'expand': 'comments,attachments,categories'}
+        self.assertEqual(
+            self._count_list_queries(client, 2, **expand), self._count_list_queries(client, 12, **expand)
+        )
+
+    def test_list_runs_fixed_number_of_queries(self):
+        # 条件请求校验值 + count + 帖子(含作者、回复数) + 标签
+        with self.assertNumQueries(4):
+            APIClient().get('/api/community/posts/', {'page_size': 12})
+        # 展开后额外预取分类、附件、回复(含作者)
+        cache.clear()
+        with self.assertNumQueries(7):
+            APIClient().get('/api/community/posts/', {'page_size': 12, 'expand': 'comments,attachments,categories'})
+
+
+class PostListSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(
+            title='标题', content='内容' * 100, author=cls.author,
+            is_create_approved=True, visibility='public',
+        )
+        Comment.objects.create(post=cls.post, author=cls.author, content='回复', is_create_approved=True, visibility='public')
+        Comment.objects.create(post=cls.post, author=cls.author, content='待审核')
+
+    def test_list_returns_light_representation(self):
+        item = APIClient().get('/api/community/posts/').data['results'][0]
+        self.assertEqual(item['author_name'], 'author')
+        self.assertEqual(item['comments_count'], 1)
+        self.assertEqual(len(item['excerpt']), 100)
+        self.assertNotIn('comments', item)
+        self.assertNotIn('attachments', item)
+
+    def test_fields_and_expand(self):
+        item = APIClient().get('/api/community/posts/', {'fields': 'id,title', 'expand': 'comments'}).data['results'][0]
+        self.assertEqual(set(item), {'id', 'title', 'comments'})
+        self.assertEqual(len(item['comments']), 1)
+
+
+class CommentCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='标题', author=cls.author)
+
+    def test_counters_follow_comment_lifecycle(self):
+        comment = Comment.objects.create(post=self.post, author=self.author, content='回复')
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.public_comment_count, self.post.total_comment_count), (0, 1))
+        self.assertEqual(self.post.last_comment_at, comment.created_at)
+
+        comment.is_create_approved, comment.visibility = True, 'public'
+        comment.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.public_comment_count, self.post.total_comment_count), (1, 1))
+
+        comment.is_able = False
+        comment.save()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.public_comment_count, self.post.total_comment_count), (0, 0))
+        self.assertIsNone(self.post.last_comment_at)
+
+    def test_rebuild_command(self):
+        Comment.objects.create(post=self.post, author=self.author, content='回复', is_create_approved=True, visibility='public')
+        Post.objects.update(public_comment_count=0, total_comment_count=0)
+        call_command('rebuild_comment_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.public_comment_count, self.post.total_comment_count), (1, 1))
+
+
+class CategoryCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.category = Category.objects.create(name='分类')
+
+    def _counts(self):
+        self.category.refresh_from_db()
+        return self.category.public_post_count, self.category.post_count
+
+    def test_counters_follow_m2m_and_approval(self):
+        post = Post.objects.create(title='标题', author=self.author)
+        post.categories.add(self.category)
+        self.assertEqual(self._counts(), (0, 1))
+
+        post.is_create_approved, post.visibility = True, 'public'
+        post.save()
+        self.assertEqual(self._counts(), (1, 1))
+
+        post.is_able = False
+        post.save()
+        self.assertEqual(self._counts(), (0, 0))
+
+        post.is_able = True
+        post.save()
+        post.categories.clear()
+        self.assertEqual(self._counts(), (0, 0))
+
+    def test_reverse_add_and_delete(self):
+        post = Post.objects.create(title='标题', author=self.author, is_create_approved=True, visibility='public')
+        self.category.posts.add(post)
+        self.assertEqual(self._counts(), (1, 1))
+        post.delete()
+        self.assertEqual(self._counts(), (0, 0))
+
+
+class CategoryTreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.root = Category.objects.create(name='根')
+        cls.child = Category.objects.create(name='子', parent_id=cls.root)
+        cls.leaf = Category.objects.create(name='叶', parent_id=cls.child)
+        cls.other = Category.objects.create(name='其他')
+        cls.post = Post.objects.create(title='两个分类', author=cls.author, is_create_approved=True, visibility='public')
+        cls.post.categories.add(cls.child, cls.leaf)
+        cls.private = Post.objects.create(title='私有', author=cls.author)
+        cls.private.categories.add(cls.leaf)
+        cls.outside = Post.objects.create(title='其他分类', author=cls.author, is_create_approved=True, visibility='public')
+        cls.outside.categories.add(cls.other)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def _ancestors(self, category):
+        return dict(CategoryClosure.objects.filter(descendant=category).values_list('ancestor_id', 'depth'))
+
+    def _subtree_counts(self, category):
+        category.refresh_from_db()
+        return category.subtree_public_post_count, category.subtree_post_count
+
+    def test_closure_follows_create_move_and_delete(self):
+        self.assertEqual(self._ancestors(self.leaf), {self.leaf.pk: 0, self.child.pk: 1, self.root.pk: 2})
+        self.assertEqual(self._subtree_counts(self.root), (1, 2))
+
+        self.child.parent_id = self.other
+        self.child.save()
+        self.assertEqual(self._ancestors(self.leaf), {self.leaf.pk: 0, self.child.pk: 1, self.other.pk: 2})
+        self.assertEqual(self._subtree_counts(self.root), (0, 0))
+        self.assertEqual(self._subtree_counts(self.other), (2, 3))
+
+        self.child.delete()
+        self.assertEqual(self._ancestors(self.leaf), {self.leaf.pk: 0})
+        self.assertEqual(self._subtree_counts(self.other), (1, 1))
+
+    def test_filter_includes_descendants_once(self):
+        response = self.client.get('/api/community/posts/', {'category_tree': self.root.pk})
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(sorted(ids), sorted([self.post.pk, self.private.pk]))
+        response = self.client.get('/api/community/posts/', {'category_tree': self.leaf.pk})
+        self.assertEqual(response.data['count'], 2)
+
+    def test_tree_endpoint(self):
+        response = self.client.get('/api/community/categories/tree/')
+        self.assertEqual([node['name'] for node in response.data], ['根', '其他'])
+        child = response.data[0]['children'][0]
+        self.assertEqual((child['name'], child['subtree_count'], child['count']), ('子', 2, 1))
+        self.assertEqual(child['children'][0]['children'], [])
+
+        # 分类变化后缓存的树失效
+        Category.objects.create(name='新', parent_id=self.leaf)
+        response = self.client.get('/api/community/categories/tree/')
+        self.assertEqual(response.data[0]['children'][0]['children'][0]['children'][0]['name'], '新')
+
+    def test_tree_cache_requires_shared_cache(self):
+        category_cache.get()
+        # 进程内缓存的版本号通知不到其他进程，每次读取都重建
+        with self.assertNumQueries(1):
+            category_cache.get()
+        use_shared_cache(self)
+        category_cache.get()
+        with self.assertNumQueries(0):
+            category_cache.get()
+        Category.objects.create(name='新')
+        self.assertIn('新', [node['name'] for node in category_cache.get()[0].values()])
+
+    def test_counts_hide_unapproved_posts_from_non_staff(self):
+        staff = self.client.get(f'/api/community/categories/{self.leaf.pk}/').data
+        self.assertEqual((staff['count'], staff['subtree_count']), (2, 2))
+        # 审核组成员不是 is_staff，只能看到公开帖子数
+        auditor = User.objects.create_user(username='auditor', password='pwd')
+        auditor.groups.add(Group.objects.create(name='auditors'))
+        client = APIClient()
+        client.force_authenticate(auditor)
+        data = client.get(f'/api/community/categories/{self.leaf.pk}/').data
+        self.assertEqual((data['count'], data['subtree_count']), (1, 1))
+        self.assertFalse({'public_count', 'total_count'} & set(data))
+
+    def test_reject_cycle(self):
+        response = self.client.patch(f'/api/community/categories/{self.root.pk}/', {'parent_id': self.leaf.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            self.root.parent_id = self.root
+            self.root.save()
+
+
+@override_settings(VIEW_COUNT_FLUSH_INTERVAL=3600)
+class BufferedViewCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.posts = [
+            Post.objects.create(title=f'帖子{i}', author=cls.author, is_create_approved=True, visibility='public')
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        # 丢弃其他用例留下的增量
+        discard_pending_views()
+        self.addCleanup(discard_pending_views)
+
+    def test_retrieve_buffers_and_reports_pending_views(self):
+        # 匿名响应会被缓存，这里用登录用户读取实时浏览量
+        client = APIClient()
+        client.force_authenticate(self.author)
+        post = self.posts[0]
+        client.get(f'/api/community/posts/{post.pk}/')
+        response = client.get(f'/api/community/posts/{post.pk}/')
+        self.assertEqual(response.data['view_count'], 2)
+        post.refresh_from_db()
+        self.assertEqual(post.view_count, 0)
+
+    def test_flush_writes_all_pending_in_one_update(self):
+        post_view_counter.incr(self.posts[0].pk)
+        post_view_counter.incr(self.posts[0].pk)
+        post_view_counter.incr(self.posts[1].pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(post_view_counter.flush(), 2)
+        self.assertEqual(
+            list(Post.objects.order_by('pk').values_list('view_count', flat=True)), [2, 1]
+        )
+        self.assertEqual(post_view_counter.pending(self.posts[0].pk), 0)
+
+    def test_flush_splits_large_batches(self):
+        post_view_counter.incr(self.posts[0].pk)
+        for pk in range(10000, 10500):
+            post_view_counter.incr(pk)
+        with self.assertNumQueries(2):
+            self.assertEqual(post_view_counter.flush(), 1)
+        self.assertEqual(Post.objects.get(pk=self.posts[0].pk).view_count, 1)
+
+    @override_settings(VIEW_COUNT_FLUSH_INTERVAL=0.05)
+    def test_timer_flushes_without_further_views(self):
+        flushed = threading.Event()
+        with mock.patch.object(post_view_counter, 'flush', side_effect=lambda: flushed.set()), \
+                mock.patch('community.view_counter.connections'):
+            discard_pending_views()
+            post_view_counter.incr(self.posts[0].pk)
+            self.assertTrue(flushed.wait(5))
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        for i in range(7):
+            Post.objects.create(
+                title=f'帖子{i}', author=cls.author, is_pinned=i in (2, 5),
+                is_create_approved=True, visibility='public',
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cursor_walks_posts_in_list_order(self):
+        client = APIClient()
+        expected = [item['id'] for item in client.get('/api/community/posts/', {'page_size': 100}).data['results']]
+        seen, params = [], {'cursor': '', 'page_size': 3}
+        with self.assertNumQueries(3):
+            # 游标分页不执行 COUNT：当前页的条件请求校验值 + 帖子 + 标签
+            response = client.get('/api/community/posts/', params)
+        while True:
+            self.assertNotIn('count', response.data)
+            seen += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                break
+            response = client.get(response.data['next'])
+        self.assertEqual(seen, expected)
+        self.assertEqual(seen[:2], sorted(Post.objects.filter(is_pinned=True).values_list('pk', flat=True), reverse=True))
+
+    def test_count_is_optional_and_cached(self):
+        client = APIClient()
+        params = {'cursor': '', 'with_count': 'true'}
+        self.assertEqual(client.get('/api/community/posts/', params).data['count'], 7)
+        Post.objects.create(title='新帖', author=self.author, is_create_approved=True, visibility='public')
+        self.assertEqual(client.get('/api/community/posts/', params).data['count'], 7)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(APIClient().get('/api/community/posts/', {'cursor': 'bad'}).status_code, 404)
+
+    def test_comments_are_paginated_only_on_request(self):
+        post = Post.objects.first()
+        for i in range(3):
+            Comment.objects.create(post=post, author=self.author, content=f'回复{i}', is_create_approved=True, visibility='public')
+        client = APIClient()
+        self.assertEqual(len(client.get('/api/community/comments/').data), 3)
+        response = client.get('/api/community/comments/', {'cursor': '', 'page_size': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(len(client.get(response.data['next']).data['results']), 1)
+
+
+class BranchedVisibilityTests(TestCase):
+    """认证的非管理员用户按公开与自己的内容两个分支分页，结果与 OR 查询一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.other = User.objects.create_user(username='other', password='pwd')
+        now = timezone.now()
+        for i in range(12):
+            public = i % 3 != 0
+            post = Post.objects.create(
+                title=f'帖子{i}', author=cls.author if i % 2 else cls.other, is_pinned=i == 4,
+                is_create_approved=public, visibility='public' if public else 'private', view_count=i % 4,
+            )
+            Post.objects.filter(pk=post.pk).update(
+                created_at=now - timedelta(hours=i), last_comment_at=now - timedelta(minutes=i) if i % 5 else None,
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def test_slices_match_or_query(self):
+        queryset = Post.objects.filter(is_able=True).visible_to(self.author)
+        for ordering in (['-is_pinned', '-created_at'], ['view_count'], ['-last_comment_at'], ['last_comment_at', '-created_at']):
+            # 不切片时按 OR 条件查询
+            expected = list(queryset.order_by(*ordering, 'pk').values_list('pk', flat=True))
+            for start, stop in ((0, 3), (2, 7), (6, 20)):
+                with self.subTest(ordering=ordering, start=start):
+                    with self.assertNumQueries(3):
+                        # 两个分支的排序键 + 当前页
+                        page = [post.pk for post in slice_queryset(queryset.order_by(*ordering), start, stop)]
+                    self.assertEqual(page, expected[start:stop])
+
+    def test_api_pages_match_or_query(self):
+        expected = list(
+            Post.objects.filter(Q(is_create_approved=True, visibility='public') | Q(author=self.author))
+            .order_by('-is_pinned', '-created_at').values_list('pk', flat=True)
+        )
+        pages = [self.client.get('/api/community/posts/', {'page_size': 5, 'page': page}).data for page in (1, 2)]
+        self.assertEqual(pages[0]['count'], len(expected))
+        self.assertEqual([item['id'] for page in pages for item in page['results']], expected)
+
+        seen, response = [], self.client.get('/api/community/posts/', {'cursor': '', 'page_size': 4})
+        while True:
+            seen += [item['id'] for item in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(seen, expected)
+
+
+class FullTextSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        public = {'author': cls.author, 'is_create_approved': True, 'visibility': 'public'}
+        cls.title_hit = Post.objects.create(title='数据库性能优化', content='正文', **public)
+        cls.body_hit = Post.objects.create(title='杂谈', content='聊聊数据库索引', **public)
+        cls.comment_hit = Post.objects.create(title='提问', content='求助', **public)
+        Comment.objects.create(post=cls.comment_hit, author=cls.author, content='可以看看数据库文档', **{
+            'is_create_approved': True, 'visibility': 'public'})
+        cls.pending = Post.objects.create(title='数据库草稿', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def _search(self, query):
+        return APIClient().get('/api/community/posts/', {'search': query}).data['results']
+
+    def test_search_ranks_title_matches_first(self):
+        results = self._search('数据库')
+        self.assertEqual(results[0]['id'], self.title_hit.pk)
+        self.assertEqual({item['id'] for item in results}, {self.title_hit.pk, self.body_hit.pk, self.comment_hit.pk})
+        self.assertIn('<mark>数据库</mark>', results[1]['snippet'])
+
+    def test_bigrams_must_be_adjacent(self):
+        self.assertEqual([item['id'] for item in self._search('数据索引')], [])
+        self.assertEqual([item['id'] for item in self._search('索引')], [self.body_hit.pk])
+
+    def test_single_character_query(self):
+        # 双字组的开头与每段文字的最后一个字都能按单字命中
+        self.assertIn(self.title_hit.pk, [item['id'] for item in self._search('数')])
+        self.assertEqual([item['id'] for item in self._search('性')], [self.title_hit.pk])
+        self.assertEqual([item['id'] for item in self._search('化')], [self.title_hit.pk])
+        self.assertEqual([item['id'] for item in self._search('引')], [self.body_hit.pk])
+
+    def test_index_follows_approval(self):
+        self.pending.is_create_approved, self.pending.visibility = True, 'public'
+        self.pending.save()
+        self.assertIn(self.pending.pk, [item['id'] for item in self._search('草稿')])
+        self.pending.is_able = False
+        self.pending.save()
+        self.assertEqual(self._search('草稿'), [])
+
+
+class RelatedPostTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.tags = [Tag.objects.create(name=f'标签{i}') for i in range(3)]
+        public = {'author': cls.author, 'is_create_approved': True, 'visibility': 'public'}
+        cls.post = Post.objects.create(title='A', **public)
+        cls.post.tags.set(cls.tags)
+        cls.two = Post.objects.create(title='B', **public)
+        cls.two.tags.set(cls.tags[:2])
+        cls.one = Post.objects.create(title='C', **public)
+        cls.one.tags.add(cls.tags[0])
+        cls.pending = Post.objects.create(title='D', author=cls.author)
+        cls.pending.tags.set(cls.tags)
+
+    def _related_ids(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = APIClient().get(f'/api/community/posts/{self.post.pk}/related/')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in ctx.captured_queries))
+        return [item['id'] for item in response.data]
+
+    def test_related_posts_ordered_by_common_tags(self):
+        self.assertEqual(self._related_ids(), [self.two.pk, self.one.pk])
+
+    def test_related_posts_follow_tag_and_visibility_changes(self):
+        self.pending.is_create_approved, self.pending.visibility = True, 'public'
+        self.pending.save()
+        self.assertEqual(self._related_ids(), [self.pending.pk, self.two.pk, self.one.pk])
+
+        self.two.tags.remove(self.tags[0], self.tags[1])
+        self.assertEqual(self._related_ids(), [self.pending.pk, self.one.pk])
+
+        self.tags[2].posts.add(self.one)
+        self.assertEqual(self._related_ids(), [self.pending.pk, self.one.pk])
+        self.assertEqual(self.post.related_posts.get(related=self.one).common_tags, 2)
+
+        self.one.is_able = False
+        self.one.save()
+        self.assertEqual(self._related_ids(), [self.pending.pk])
+
+    @override_settings(RELATED_POSTS_STORED=2)
+    def test_list_refills_after_neighbor_turns_private(self):
+        rebuild_related_posts()
+        self.assertEqual(self._related_ids(), [self.two.pk, self.one.pk])
+        newer = Post.objects.create(title='E', author=self.author, is_create_approved=True, visibility='public')
+        newer.tags.add(self.tags[2])
+        # 共享标签数相同时较新的帖子排在前面，超出保存数量的关系不保存
+        self.assertEqual(self._related_ids(), [self.two.pk, newer.pk])
+        self.assertEqual(self.post.related_posts.count(), 2)
+
+        self.two.visibility = 'private'
+        self.two.save()
+        self.assertEqual(self._related_ids(), [newer.pk, self.one.pk])
+
+
+class AwaitingReplyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        public = {'author': cls.author, 'is_create_approved': True, 'visibility': 'public'}
+        cls.waiting = Post.objects.create(title='等待', **public)
+        cls.replied = Post.objects.create(title='已回复', **public)
+        cls.reply = Comment.objects.create(post=cls.replied, author=cls.staff, content='管理员回复')
+        Comment.objects.create(post=cls.waiting, author=cls.author, content='顶')
+
+    def _unreplied_ids(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        return [item['id'] for item in client.get('/api/community/posts/unreplied/').data['results']]
+
+    def test_staff_reply_state_is_maintained(self):
+        self.replied.refresh_from_db()
+        self.assertFalse(self.replied.awaiting_reply)
+        self.assertEqual(self.replied.last_staff_reply_at, self.reply.created_at)
+        self.assertEqual(self._unreplied_ids(), [self.waiting.pk])
+
+    def test_disabling_staff_reply_requeues_post(self):
+        self.reply.is_able = False
+        self.reply.save()
+        self.assertEqual(self._unreplied_ids(), [self.replied.pk, self.waiting.pk])
+
+    def test_staff_change_refreshes_reply_state(self):
+        self.author.is_staff = True
+        self.author.save()
+        self.assertEqual(self._unreplied_ids(), [])
+        self.author.is_staff = False
+        self.author.save()
+        self.assertEqual(self._unreplied_ids(), [self.waiting.pk])
+        self.staff.is_staff = False
+        self.staff.save()
+        self.replied.refresh_from_db()
+        self.assertTrue(self.replied.awaiting_reply)
+        self.assertIsNone(self.replied.last_staff_reply_at)
+
+
+class BulkModerationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.category = Category.objects.create(name='分类')
+        cls.pending = [Post.objects.create(title=f'待审{i}', content='内容', author=cls.author) for i in range(3)]
+        cls.category.posts.add(*cls.pending)
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        cls.comments = [Comment.objects.create(post=cls.post, author=cls.author, content=f'回复{i}') for i in range(2)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_bulk_approve_posts_by_ids(self):
+        ids = [post.pk for post in self.pending[:2]] + [0]
+        response = self.client.post('/api/community/posts/bulk_moderate/', {
+            'operation': 'create_approve', 'ids': ids}, format='json')
+        self.assertEqual((response.data['succeeded'], response.data['failed']), (2, 1))
+        self.assertEqual([item['success'] for item in response.data['results']], [True, True, False])
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.public_post_count, 2)
+        public_ids = Post.objects.filter(is_create_approved=True, visibility='public').values_list('pk', flat=True)
+        self.assertEqual(set(public_ids), {self.post.pk, *ids[:2]})
+
+    def test_bulk_approve_comments_by_filter(self):
+        response = self.client.post('/api/community/comments/bulk_moderate/', {
+            'operation': 'create_approve', 'filter': {'post': self.post.pk, 'is_create_approved': False}}, format='json')
+        self.assertEqual(response.data['succeeded'], 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.public_comment_count, 2)
+
+    def test_edit_approve_reports_items_without_pending_edit(self):
+        revision = revisions.submit(self.post, self.author, title='新标题')
+        response = self.client.post('/api/community/posts/bulk_moderate/', {
+            'operation': 'edit_approve', 'ids': [self.post.pk, self.pending[0].pk]}, format='json')
+        self.assertEqual([item['success'] for item in response.data['results']], [True, False])
+        self.post.refresh_from_db()
+        revision.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.pending_revision, self.post.approved_revision), ('新标题', None, revision))
+        self.assertEqual((revision.status, revision.reviewer), ('approved', self.staff))
+
+    def test_rejects_unknown_filters_and_non_auditors(self):
+        response = self.client.post('/api/community/posts/bulk_moderate/', {
+            'operation': 'create_approve', 'filter': {'title__contains': 'x'}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(self.author)
+        response = self.client.post('/api/community/posts/bulk_moderate/', {
+            'operation': 'create_approve', 'ids': [self.pending[0].pk]}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True)
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        cls.comment = Comment.objects.create(post=cls.post, author=cls.author, content='回复')
+
+    def setUp(self):
+        cache.clear()
+        self.url = f'/api/community/posts/{self.post.pk}/'
+
+    def test_detail_not_modified_skips_serialization(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        etag = client.get(self.url)['ETag']
+        with self.assertNumQueries(1):
+            response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_view_count_does_not_change_validators(self):
+        client = APIClient()
+        etag = client.get(self.url)['ETag']
+        Post.objects.filter(pk=self.post.pk).update(view_count=100)
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_comment_approval_changes_validators(self):
+        client = APIClient()
+        etag = client.get(self.url)['ETag']
+        list_etag = client.get('/api/community/posts/')['ETag']
+        self.comment.is_create_approved, self.comment.visibility = True, 'public'
+        self.comment.save()
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(client.get('/api/community/posts/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_tag_changes_and_visibility_class(self):
+        client = APIClient()
+        etag = client.get(self.url)['ETag']
+        self.post.tags.add(Tag.objects.create(name='标签'))
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        client.force_authenticate(self.staff)
+        self.assertEqual(client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class AnonymousResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        cls.pending = Post.objects.create(title='待审', author=cls.author)
+
+    def setUp(self):
+        use_shared_cache(self)
+        cache.clear()
+        discard_pending_views()
+        self.addCleanup(discard_pending_views)
+
+    def _list_ids(self, **params):
+        return [item['id'] for item in APIClient().get('/api/community/posts/', params).data['results']]
+
+    def test_local_memory_cache_disables_response_cache(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self._list_ids()
+            with CaptureQueriesContext(connection) as context:
+                self.assertEqual(self._list_ids(), [self.post.pk])
+            self.assertTrue(context.captured_queries)
+
+    def test_repeated_anonymous_requests_hit_cache(self):
+        self._list_ids(page_size=5, ordering='created_at')
+        with self.assertNumQueries(0):
+            self.assertEqual(self._list_ids(ordering='created_at', page_size=5), [self.post.pk])
+        APIClient().get(f'/api/community/posts/{self.post.pk}/')
+        with self.assertNumQueries(0):
+            APIClient().get(f'/api/community/posts/{self.post.pk}/')
+        # 命中缓存的详情请求仍计入浏览量
+        self.assertEqual(post_view_counter.pending(self.post.pk), 2)
+
+    def test_approval_bumps_version(self):
+        self.assertEqual(self._list_ids(), [self.post.pk])
+        self.pending.is_create_approved, self.pending.visibility = True, 'public'
+        self.pending.save()
+        self.assertEqual(self._list_ids(), [self.pending.pk, self.post.pk])
+
+    def test_stale_response_served_while_rebuilding(self):
+        self.assertEqual(self._list_ids(), [self.post.pk])
+        self.pending.is_create_approved, self.pending.visibility = True, 'public'
+        self.pending.save()
+        # 另一个请求正在重建缓存，拿不到锁时返回上一个版本
+        with mock.patch.object(cache, 'add', return_value=False), self.assertNumQueries(0):
+            self.assertEqual(self._list_ids(), [self.post.pk])
+        # 重建时数据库出错也返回上一个版本
+        with mock.patch.object(PostViewSet, 'filter_queryset', side_effect=OperationalError):
+            self.assertEqual(self._list_ids(), [self.post.pk])
+        self.assertEqual(self._list_ids(), [self.pending.pk, self.post.pk])
+
+
+class CommentThreadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        public = {'post': cls.post, 'author': cls.author, 'is_create_approved': True, 'visibility': 'public'}
+        cls.root = Comment.objects.create(content='根', **public)
+        cls.child = Comment.objects.create(content='子', parent_comment=cls.root, **public)
+        cls.grandchild = Comment.objects.create(content='孙', parent_comment=cls.child, **public)
+        cls.sibling = Comment.objects.create(content='兄弟', parent_comment=cls.root, **public)
+        cls.other = Comment.objects.create(content='另一个', **public)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_paths_are_assigned_on_insert(self):
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.depth, 2)
+        self.assertEqual(self.grandchild.path, self.root.path + self.child.path[-10:] + f'{self.grandchild.pk:010d}')
+
+    def test_reply_to_disabled_parent_keeps_its_place(self):
+        Comment.objects.filter(pk=self.child.pk).update(is_able=False)
+        reply = Comment.objects.create(post=self.post, author=self.author, content='回复已删除的', parent_comment=self.child)
+        reply.refresh_from_db()
+        self.assertEqual((reply.depth, reply.path[:-10]), (2, self.child.path))
+
+    def test_thread_loads_nested_subtree(self):
+        with self.assertNumQueries(2):
+            response = APIClient().get(f'/api/community/comments/{self.root.pk}/thread/')
+        [root] = response.data
+        self.assertEqual([reply['id'] for reply in root['replies']], [self.child.pk, self.sibling.pk])
+        self.assertEqual(root['replies'][0]['replies'][0]['id'], self.grandchild.pk)
+
+    def test_thread_depth_limit(self):
+        response = APIClient().get(f'/api/community/comments/{self.root.pk}/thread/', {'max_depth': 1})
+        self.assertEqual(response.data[0]['replies'][0]['replies'], [])
+        response = APIClient().get(f'/api/community/comments/{self.root.pk}/thread/', {'max_depth': -1})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(POST_EMBEDDED_COMMENTS=2)
+class PostCommentsEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        public = {'post': cls.post, 'author': cls.author, 'is_create_approved': True, 'visibility': 'public'}
+        cls.roots = [Comment.objects.create(content=f'回复{i}', **public) for i in range(3)]
+        cls.reply = Comment.objects.create(content='楼中楼', parent_comment=cls.roots[0], **public)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_detail_embeds_first_comments_and_cursor(self):
+        client = APIClient()
+        detail = client.get(f'/api/community/posts/{self.post.pk}/').data
+        embedded = [item['id'] for item in detail['comments']]
+        self.assertEqual(embedded, [self.reply.pk, self.roots[2].pk])
+        rest = client.get(detail['comments_next']).data
+        self.assertEqual([item['id'] for item in rest['results']], [self.roots[1].pk, self.roots[0].pk])
+        self.assertIsNone(rest['next'])
+
+    def test_thread_mode_paginates_top_level_comments(self):
+        response = APIClient().get(f'/api/community/posts/{self.post.pk}/comments/', {'thread': 'true', 'page_size': 2})
+        self.assertEqual([item['id'] for item in response.data['results']], [self.roots[2].pk, self.roots[1].pk])
+        response = APIClient().get(response.data['next'])
+        [root] = response.data['results']
+        self.assertEqual(root['id'], self.roots[0].pk)
+        self.assertEqual([item['id'] for item in root['replies']], [self.reply.pk])
+
+
+class FastListSerializationTests(TestCase):
+    """快速序列化与序列化器的输出一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True)
+        tags = [Tag.objects.create(name=f'标签{i}') for i in range(2)]
+        for i in range(3):
+            post = Post.objects.create(
+                title=f'帖子{i}', content='内容' * 80, author=cls.author, is_create_approved=True, visibility='public',
+                is_pinned=i == 1,
+            )
+            revisions.submit(post, cls.author, title=f'新标题{i}', content='新内容')
+            if i == 0:
+                revisions.review(post, True, cls.staff)
+            post.tags.set(tags[:i])
+            Comment.objects.create(post=post, author=cls.author, content='回复', is_create_approved=True, visibility='public')
+            Comment.objects.create(post=post, author=cls.author, content='待审核')
+
+    def setUp(self):
+        cache.clear()
+
+    def _compare(self, url, user=None, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        fast = client.get(url, params)
+        cache.clear()
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            slow = client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_post_list_matches_serializer(self):
+        for user in (None, self.author, self.staff):
+            self._compare('/api/community/posts/', user)
+            self._compare('/api/community/posts/', user, page_size=2, cursor='')
+
+    def test_comment_list_matches_serializer(self):
+        for user in (None, self.author, self.staff):
+            self._compare('/api/community/comments/', user)
+
+    def test_cursor_from_fast_list(self):
+        first = self._compare('/api/community/posts/', page_size=2, cursor='')
+        rest = self._compare(first.data['next'])
+        self.assertEqual(len(first.data['results']) + len(rest.data['results']), 3)
+
+    def test_orjson_renderer_matches_json_renderer(self):
+        data = {'时间': timezone.now(), 'amount': Decimal('1.50'), 'text': '换行 ', 'items': [1, None, True]}
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class BlobStorageTests(TestCase):
+    """附件按内容去重保存"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/community/posts/{self.post.pk}/upload_attachment/'
+
+    def _upload(self, name, content=b'same content'):
+        return self.client.post(self.url, {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def test_same_content_is_stored_once(self):
+        first, second = self._upload('a.pdf'), self._upload('b.pdf')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual([first.data['name'], second.data['name']], ['a.pdf', 'b.pdf'])
+        blob = Blob.objects.get()
+        self.assertEqual((blob.sha256, blob.ref_count), (hashlib.sha256(b'same content').hexdigest(), 2))
+        self.assertEqual(set(PostAttachment.objects.values_list('file', flat=True)), {blob.file.name})
+        self.assertTrue(default_storage.exists(blob.file.name))
+
+    def test_blob_path_keeps_extension(self):
+        self._upload('a.PDF')
+        self.assertTrue(Blob.objects.get().file.name.endswith('.pdf'))
+
+    def test_lost_create_race_removes_written_file(self):
+        digest = hashlib.sha256(b'same content').hexdigest()
+        # 另一个请求先创建了记录，这里写入的文件不再需要
+        winner = Blob.objects.create(sha256=digest, size=12, file='blobs/winner.pdf', ref_count=1)
+        with mock.patch.object(blobs, 'acquire', side_effect=[None, winner]):
+            blob = blobs.store(SimpleUploadedFile('a.pdf', b'same content'))
+        self.assertEqual(blob, winner)
+        self.assertFalse(default_storage.exists(blobs.blob_path(digest, 'a.pdf')))
+
+    def test_known_hash_skips_upload(self):
+        digest = hashlib.sha256(b'same content').hexdigest()
+        self.assertEqual(self.client.post(self.url, {'sha256': digest}).status_code, 404)
+        self._upload('a.pdf')
+        response = self.client.post(self.url, {'sha256': digest, 'name': 'c.pdf'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        self.assertEqual(self.client.post(self.url, {'sha256': 'x'}).status_code, 400)
+
+    def test_hash_reuse_requires_visible_attachment(self):
+        private = Post.objects.create(title='私有', author=self.author, is_create_approved=True, visibility='private')
+        self.client.post(
+            f'/api/community/posts/{private.pk}/upload_attachment/',
+            {'file': SimpleUploadedFile('a.pdf', b'same content')}, format='multipart',
+        )
+        digest = hashlib.sha256(b'same content').hexdigest()
+        other = User.objects.create_user(username='other', password='pwd')
+        other_post = Post.objects.create(title='其他', author=other, is_create_approved=True, visibility='public')
+        client = APIClient()
+        client.force_authenticate(other)
+        # 只知道私有附件的哈希不能引用其内容
+        response = client.post(f'/api/community/posts/{other_post.pk}/upload_attachment/', {'sha256': digest, 'name': 'a.pdf'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        # 只提供sha256时文件名同样按类型校验
+        self.assertEqual(self.client.post(self.url, {'sha256': digest, 'name': 'a.exe'}).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'sha256': digest, 'name': 'b.pdf'}).status_code, 201)
+
+    def test_file_removed_with_last_reference(self):
+        self._upload('a.pdf')
+        self._upload('b.pdf')
+        blob = Blob.objects.get()
+        first, second = PostAttachment.objects.all()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(blob.file.name))
+
+    def test_dedupe_command_migrates_legacy_files(self):
+        names = [default_storage.save(f'post_attachments/{name}', ContentFile(b'legacy')) for name in ('a.txt', 'a.txt')]
+        for name in names:
+            PostAttachment.objects.create(post=self.post, file=name)
+        call_command('dedupe_attachments', stdout=StringIO())
+        blob = Blob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(sorted(PostAttachment.objects.values_list('name', flat=True)), sorted(n.split('/')[-1] for n in names))
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+    def test_dedupe_command_keeps_files_of_disabled_attachments(self):
+        name = default_storage.save('post_attachments/a.txt', ContentFile(b'legacy'))
+        PostAttachment.objects.create(post=self.post, file=name)
+        disabled = PostAttachment.objects.create(post=self.post, file=name, is_able=False)
+        call_command('dedupe_attachments', stdout=StringIO())
+        disabled = PostAttachment.all_objects.get(pk=disabled.pk)
+        self.assertIsNotNone(disabled.blob)
+        self.assertTrue(default_storage.exists(disabled.file.name))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+
+class ChunkedUploadTests(TestCase):
+    """可续传的分片上传"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.other = User.objects.create_user(username='other', password='pwd')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, UPLOAD_CHUNK_SIZE=4))
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def _init(self, name='a.pdf', size=10, **extra):
+        return self.client.post('/api/community/uploads/', {'post': self.post.pk, 'name': name, 'size': size, **extra})
+
+    def _put(self, session_id, offset, data):
+        return self.client.put(
+            f'/api/community/uploads/{session_id}/chunk/?offset={offset}', data, content_type='application/octet-stream',
+        )
+
+    def test_resume_and_finalize(self):
+        content = b'0123456789'
+        session = self._init(sha256=hashlib.sha256(content).hexdigest()).data
+        self.assertEqual((session['offset'], session['chunk_size']), (0, 4))
+        self.assertEqual(self._put(session['id'], 0, content[:4]).data['offset'], 4)
+        # 断线重试时偏移量不一致，返回当前的偏移量
+        conflict = self._put(session['id'], 0, content[:4])
+        self.assertEqual((conflict.status_code, conflict.data['offset']), (409, 4))
+        self.assertEqual(self.client.get(f'/api/community/uploads/{session["id"]}/').data['offset'], 4)
+        self._put(session['id'], 4, content[4:8])
+        self.assertEqual(self.client.post(f'/api/community/uploads/{session["id"]}/finalize/').status_code, 400)
+        self._put(session['id'], 8, content[8:])
+
+        response = self.client.post(f'/api/community/uploads/{session["id"]}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        attachment = PostAttachment.objects.get()
+        self.assertEqual((attachment.name, attachment.blob.sha256), ('a.pdf', hashlib.sha256(content).hexdigest()))
+        with default_storage.open(attachment.file.name) as file:
+            self.assertEqual(file.read(), content)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_limits_checked_before_writing(self):
+        self.assertEqual(self._init(name='a.exe').status_code, 400)
+        with override_settings(MAX_UPLOAD_SIZE=5):
+            self.assertEqual(self._init().status_code, 400)
+        session = self._init(size=6).data
+        self.assertEqual(self._put(session['id'], 0, b'12345').status_code, 413)
+        self._put(session['id'], 0, b'1234')
+        self.assertEqual(self._put(session['id'], 4, b'567').status_code, 413)
+        self.assertEqual(UploadSession.objects.get().offset, 4)
+
+    def test_chunk_body_read_is_capped(self):
+        # 分块传输编码的请求没有 Content-Length，读取请求体时也不能超过分片大小
+        data = ChunkParser().parse(BytesIO(b'0123456789'))
+        self.assertEqual(data, b'01234')
+        session = UploadSession.objects.get(pk=self._init().data['id'])
+        with self.assertRaises(ValueError):
+            uploads.write_chunk(session, 0, data)
+        self.assertFalse(default_storage.exists('uploads'))
+
+    def test_sessions_are_private(self):
+        session = self._init().data
+        other = APIClient()
+        other.force_authenticate(self.other)
+        self.assertEqual(other.get(f'/api/community/uploads/{session["id"]}/').status_code, 404)
+        response = other.post('/api/community/uploads/', {'post': self.post.pk, 'name': 'a.pdf', 'size': 10})
+        self.assertEqual(response.status_code, 403)
+
+    def test_stale_sessions_are_cleared(self):
+        session = self._init().data
+        self._put(session['id'], 0, b'1234')
+        UploadSession.objects.update(updated_at=timezone.now() - timedelta(days=2))
+        call_command('clear_upload_sessions', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(default_storage.listdir('uploads'), ([], []))
+
+
+class DerivativeTests(TestCase):
+    """附件缩略图与预览的后台生成"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def _upload(self, name, content=b'content'):
+        url = f'/api/community/posts/{self.post.pk}/upload_attachment/'
+        return self.client.post(url, {'file': SimpleUploadedFile(name, content)}, format='multipart')
+
+    def test_jobs_registered_by_file_type(self):
+        self._upload('a.png')
+        self._upload('b.png')
+        self._upload('c.pdf', b'pdf')
+        self._upload('d.docx', b'docx')
+        self.assertEqual(sorted(Derivative.objects.values_list('kind', 'status')), [('preview', 'pending'), ('thumbnail', 'pending')])
+
+    def test_ready_derivative_exposed_by_serializer(self):
+        self._upload('a.png')
+        self.assertIsNone(self.client.get(f'/api/community/posts/{self.post.pk}/').data['attachments'][0]['thumbnail'])
+        Derivative.objects.update(status='done', file='derivatives/a.webp')
+        attachment = self.client.get(f'/api/community/posts/{self.post.pk}/').data['attachments'][0]
+        self.assertTrue(attachment['thumbnail'].endswith('/media/derivatives/a.webp'))
+        self.assertIsNone(attachment['preview'])
+
+    def test_failed_jobs_retry_then_fail(self):
+        self._upload('a.png')
+        with mock.patch.dict(derivatives.GENERATORS, thumbnail=mock.Mock(side_effect=OSError('损坏的图片'))), \
+                self.assertLogs('community.derivatives', 'ERROR'):
+            self.assertEqual(derivatives.run_pending(workers=1), 3)
+        job = Derivative.objects.get()
+        self.assertEqual((job.status, job.attempts, job.error), ('failed', 3, '损坏的图片'))
+
+    def test_stale_running_job_is_reclaimed(self):
+        self._upload('a.png')
+        Derivative.objects.update(status='running', locked_at=timezone.now())
+        self.assertEqual(derivatives.claim(10), [])
+        Derivative.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(len(derivatives.claim(10)), 1)
+
+    @skipIf(derivatives.Image is not None, '已安装Pillow')
+    def test_skipped_without_pillow(self):
+        self._upload('a.png')
+        derivatives.run_pending(workers=1)
+        self.assertEqual(Derivative.objects.get().status, 'skipped')
+
+    @skipIf(derivatives.Image is None, '未安装Pillow')
+    def test_thumbnail_generated(self):
+        buffer = BytesIO()
+        derivatives.Image.new('RGB', (1000, 500)).save(buffer, 'PNG')
+        self._upload('a.png', buffer.getvalue())
+        derivatives.run_pending(workers=1)
+        job = Derivative.objects.get()
+        self.assertEqual(job.status, 'done')
+        with default_storage.open(job.file.name) as file, derivatives.Image.open(file) as image:
+            self.assertEqual(image.size, (320, 160))
+
+
+class AttachmentDownloadTests(TestCase):
+    """附件下载的 Range、缓存头与权限"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        cls.private = Post.objects.create(title='私有', author=cls.author, is_create_approved=True, visibility='private')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def _upload(self, post, content=b'0123456789'):
+        url = f'/api/community/posts/{post.pk}/upload_attachment/'
+        return self.client.post(url, {'file': SimpleUploadedFile('报告.pdf', content)}, format='multipart').data
+
+    def test_download_with_validators_and_range(self):
+        url = self._upload(self.post)['download_url']
+        response = APIClient().get(url, HTTP_ACCEPT='application/pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(b"0123456789").hexdigest()}"')
+        # 帖子下的地址要检查权限，只短时间缓存
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60, must-revalidate')
+        self.assertIn("filename*=utf-8''%E6%8A%A5%E5%91%8A.pdf", response['Content-Disposition'])
+
+        self.assertEqual(APIClient().get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        partial = APIClient().get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual((partial.status_code, partial['Content-Range']), (206, 'bytes 2-5/10'))
+        self.assertEqual(b''.join(partial.streaming_content), b'2345')
+        suffix = APIClient().get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(suffix.streaming_content), b'789')
+        self.assertEqual(APIClient().get(url, HTTP_RANGE='bytes=20-').status_code, 416)
+        # If-Range 不匹配时返回整个文件
+        self.assertEqual(APIClient().get(url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"old"').status_code, 200)
+
+    def test_private_post_attachment_requires_permission(self):
+        url = self._upload(self.private)['download_url']
+        self.assertEqual(APIClient().get(url).status_code, 404)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+        self.assertIn('Authorization, Cookie', response['Vary'])
+
+    def test_content_url_is_immutable_while_post_is_public(self):
+        data = self._upload(self.post)
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        self.assertIn(f'/api/community/blobs/{digest}/?name=', data['content_url'])
+        response = APIClient().get(data['content_url'], HTTP_ACCEPT='application/pdf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertIn("filename*=utf-8''%E6%8A%A5%E5%91%8A.pdf", response['Content-Disposition'])
+
+        # 帖子改为私有后不再提供按内容寻址的地址
+        Post.objects.filter(pk=self.post.pk).update(visibility='private')
+        self.assertEqual(APIClient().get(data['content_url']).status_code, 404)
+        self.assertIsNone(self._upload(self.private)['content_url'])
+
+    @override_settings(ATTACHMENT_SENDFILE='nginx')
+    def test_sendfile_offload(self):
+        url = self._upload(self.post)['download_url']
+        response = APIClient().get(url)
+        blob = Blob.objects.get()
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{blob.file.name}')
+        self.assertEqual(response.content, b'')
+
+
+@skipUnless(query_plans.is_supported(), '只检查 SQLite 的查询计划')
+class QueryPlanTests(TestCase):
+    """常用列表与详情的查询不能退化为全表扫描"""
+    tables = {'community_post', 'community_comment', 'community_revision'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.category = Category.objects.create(name='分类')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        cls.post.categories.add(cls.category)
+        Comment.objects.create(post=cls.post, author=cls.author, content='回复', is_create_approved=True, visibility='public')
+
+    def _assert_no_full_scans(self, user, urls):
+        client = APIClient()
+        if user:
+            client.force_authenticate(user)
+        for url in urls:
+            cache.clear()
+            with self.subTest(user=user and user.username, url=url), CaptureQueriesContext(connection) as context:
+                self.assertEqual(client.get(url).status_code, 200)
+                self.assertEqual(query_plans.full_table_scans(context.captured_queries, self.tables), [])
+
+    def test_reader_queries_use_indexes(self):
+        urls = [
+            '/api/community/posts/', f'/api/community/posts/?category_tree={self.category.pk}',
+            f'/api/community/posts/{self.post.pk}/', f'/api/community/posts/{self.post.pk}/comments/',
+            f'/api/community/posts/{self.post.pk}/related/', '/api/community/comments/',
+        ]
+        self._assert_no_full_scans(None, urls)
+        self._assert_no_full_scans(self.author, urls)
+
+    def test_staff_queries_use_indexes(self):
+        self._assert_no_full_scans(self.staff, [
+            '/api/community/posts/', '/api/community/posts/unapproved/', '/api/community/posts/unreplied/',
+            '/api/community/comments/', '/api/community/revisions/',
+        ])
+
+
+class RevisionTests(TestCase):
+    """编辑记录与待审核编辑队列"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.other = User.objects.create_user(username='other', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.post = Post.objects.create(
+            title='标题', content='第一行\n第二行\n第三行\n', author=cls.author, is_create_approved=True, visibility='public',
+        )
+        cls.comment = Comment.objects.create(post=cls.post, author=cls.author, content='回复')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_diff_round_trip(self):
+        base = '第一行\n第二行\n第三行\n'
+        for text in ('', base, '第一行\n第2行\n第三行\n新增\n', '开头\n' + base, '没有换行'):
+            ops = revisions.encode_diff(base, text)
+            self.assertEqual(revisions.apply_diff(base, ops), text)
+        # 只保存变化的行
+        self.assertEqual(revisions.encode_diff(base, '第一行\n第2行\n第三行\n'), [4, -4, '第2行\n', 4])
+        with self.assertRaises(ValueError):
+            revisions.apply_diff('短', [4])
+
+    def test_edit_waits_for_review(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(f'/api/community/posts/{self.post.pk}/', {'content': '第一行\n改过'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        # 标题与内容仍为通过的版本，作者在 pending_edit 中看到待审核的编辑
+        data = self.client.get(f'/api/community/posts/{self.post.pk}/').data
+        self.assertEqual((data['title'], data['content']), ('标题', '第一行\n第二行\n第三行\n'))
+        self.assertEqual(data['pending_edit'], {'title': '标题', 'content': '第一行\n改过'})
+        self.client.force_authenticate(self.other)
+        self.assertIsNone(self.client.get(f'/api/community/posts/{self.post.pk}/').data['pending_edit'])
+
+    def test_new_edit_supersedes_pending_edit(self):
+        first = revisions.submit(self.post, self.author, title='第一次')
+        second = revisions.submit(self.post, self.author, title='第二次')
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'superseded')
+        self.assertEqual(self.post.pending_revision, second)
+        # 第一次编辑时保存原内容的快照
+        snapshot = self.post.approved_revision
+        self.assertEqual((snapshot.status, snapshot.base), ('approved', None))
+        self.assertEqual(revisions.apply_diff('', snapshot.title_diff), '标题')
+        revisions.review(self.post, True, self.staff)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.is_edit_approved, self.post.approved_revision), ('第二次', True, second))
+
+    def test_reject_keeps_approved_text(self):
+        revision = revisions.submit(self.comment, self.author, content='新回复')
+        self.client.force_authenticate(self.staff)
+        response = self.client.post(f'/api/community/comments/{self.comment.pk}/edit_reject/')
+        self.assertEqual(response.status_code, 200)
+        self.comment.refresh_from_db()
+        revision.refresh_from_db()
+        self.assertEqual((self.comment.content, self.comment.pending_revision), ('回复', None))
+        self.assertEqual((revision.status, revision.reviewer), ('rejected', self.staff))
+        response = self.client.post(f'/api/community/comments/{self.comment.pk}/edit_reject/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_pending_queue(self):
+        post_revision = revisions.submit(self.post, self.author, title='新标题')
+        comment_revision = revisions.submit(self.comment, self.author, content='新回复')
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.get('/api/community/revisions/').status_code, 403)
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/community/revisions/', {'page_size': 1})
+        [item] = response.data['results']
+        self.assertEqual(item['id'], post_revision.pk)
+        self.assertEqual((item['current']['title'], item['proposed']['title']), ('标题', '新标题'))
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], [comment_revision.pk])
+        response = self.client.post(f'/api/community/revisions/{comment_revision.pk}/approve/')
+        self.assertEqual(response.status_code, 200)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.content, '新回复')
+        response = self.client.get('/api/community/revisions/')
+        self.assertEqual([item['id'] for item in response.data['results']], [post_revision.pk])
+        self.assertEqual(Revision.objects.filter(status='pending').count(), 1)
+
+
+class SoftDeleteTests(TestCase):
+    """删除帖子只禁用，回复与附件一并禁用"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.category = Category.objects.create(name='分类')
+        cls.post = Post.objects.create(title='帖子', author=cls.author, is_create_approved=True, visibility='public')
+        cls.post.categories.add(cls.category)
+        cls.comments = [
+            Comment.objects.create(post=cls.post, author=cls.author, content=f'回复{i}', is_create_approved=True, visibility='public')
+            for i in range(2)
+        ]
+        cls.attachment = PostAttachment.objects.create(post=cls.post, file='post_attachments/a.txt', name='a.txt')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_destroy_cascades_to_comments_and_attachments(self):
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.delete(f'/api/community/posts/{self.post.pk}/').status_code, 204)
+        self.assertFalse(Post.objects.filter(pk=self.post.pk).exists())
+        post = Post.all_objects.get(pk=self.post.pk)
+        self.assertEqual((post.is_able, post.total_comment_count), (False, 0))
+        self.assertFalse(Comment.objects.filter(post=post).exists())
+        self.assertEqual(Comment.all_objects.filter(post=post, is_able=False).count(), 2)
+        self.assertFalse(PostAttachment.all_objects.get(pk=self.attachment.pk).is_able)
+        self.category.refresh_from_db()
+        self.assertEqual((self.category.post_count, self.category.public_post_count), (0, 0))
+
+    def test_disabled_rows_hidden_from_staff(self):
+        self.client.force_authenticate(self.staff)
+        self.assertEqual(self.client.delete(f'/api/community/posts/{self.post.pk}/').status_code, 204)
+        self.assertEqual(self.client.get(f'/api/community/posts/{self.post.pk}/').status_code, 404)
+        self.assertEqual(self.client.get('/api/community/comments/').data, [])
+        # 外键访问不经过默认管理器
+        comment = Comment.all_objects.get(pk=self.comments[0].pk)
+        self.assertEqual(comment.post.pk, self.post.pk)
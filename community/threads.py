@@ -0,0 +1,107 @@
+"""
+回复线程的物化路径
+
+每条回复的 path 为祖先与自身id的定长拼接，depth 为层级（顶层为0）。
+按 path 排序即为线程的深度优先顺序，某条回复的子树是 path 以它的 path 开头的回复，
+读取整个线程或子树只需一次有序查询。
+
+三个应用的 Comment 模型共用这里的函数，路径在新建回复后由各自的信号写入
+"""
+from django.conf import settings
+from django.db.models import Q
+
+PATH_WIDTH = 10
+PATH_MAX_LENGTH = 255
+# 超过该层级的回复挂在最深一层，路径长度不超过字段长度
+MAX_DEPTH = PATH_MAX_LENGTH // PATH_WIDTH - 1
+
+
+def path_segment(pk):
+    return f'{pk:0{PATH_WIDTH}d}'
+
+
+def assign_path(comment):
+    """
+    新建回复后写入路径与层级
+    """
+    # 基础管理器不排除已删除的行，上级回复已删除时仍挂在它下面，不会变成顶层回复
+    manager = type(comment)._base_manager
+    parent = None
+    if comment.parent_comment_id:
+        parent = manager.filter(pk=comment.parent_comment_id).values('path', 'depth').first()
+    if not parent or not parent['path']:
+        path, depth = path_segment(comment.pk), 0
+    elif parent['depth'] >= MAX_DEPTH:
+        # 与上级回复同层
+        path, depth = parent['path'][:-PATH_WIDTH] + path_segment(comment.pk), parent['depth']
+    else:
+        path, depth = parent['path'] + path_segment(comment.pk), parent['depth'] + 1
+    comment.path, comment.depth = path, depth
+    manager.filter(pk=comment.pk).update(path=path, depth=depth)
+
+
+def max_depth_param(value):
+    """
+    解析 ?max_depth= 参数，不超过 COMMENT_THREAD_MAX_DEPTH
+    :raises ValueError: 参数不是非负整数
+    """
+    limit = getattr(settings, 'COMMENT_THREAD_MAX_DEPTH', 10)
+    if value in (None, ''):
+        return limit
+    depth = int(value)
+    if depth < 0:
+        raise ValueError(value)
+    return min(depth, limit)
+
+
+def subtree(queryset, root=None, max_depth=None):
+    """
+    返回按路径排序的线程查询集
+    :param queryset: 已按帖子与可见性过滤的回复
+    :param root: 子树的根回复，为 None 时返回整个线程
+    :param max_depth: 相对根的最大层级，根为0
+    """
+    base = 0
+    if root is not None:
+        queryset = queryset.filter(path__startswith=root.path)
+        base = root.depth
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=base + max_depth)
+    return queryset.order_by('path')
+
+
+def descendants_of(comments):
+    """
+    comments 的全部下级回复的查询条件，每条回复的子树是一段连续的路径范围，可以使用 (post, path) 索引
+    """
+    condition = Q(pk__in=[])
+    for comment in comments:
+        if comment.path:
+            # 路径只包含数字，':' 排在 '9' 之后
+            condition |= Q(post_id=comment.post_id, path__gt=comment.path, path__lt=comment.path + ':')
+    return condition
+
+
+def build_tree(comments, roots=()):
+    """
+    把按路径排序的回复组装成嵌套结构，每个节点的 children 为直接下级
+    上级回复不在结果中（如未审核）时，该回复作为最上层节点返回
+    :param roots: 已加载的上级回复，comments 中的下级挂到它们下面
+    :return: 最上层节点列表
+    """
+    nodes = {}
+    top = []
+    for node in roots:
+        node.children = []
+        nodes[node.path] = node
+    for comment in comments:
+        if comment.path in nodes:
+            continue
+        comment.children = []
+        nodes[comment.path] = comment
+        parent = nodes.get(comment.path[:-PATH_WIDTH])
+        if parent is not None:
+            parent.children.append(comment)
+        else:
+            top.append(comment)
+    return list(roots) or top
@@ -0,0 +1,157 @@
+"""
+可续传的分片上传
+
+1. 创建会话：声明文件名、大小（可选 sha256），文件类型和大小在这里校验
+2. 按偏移量上传分片：偏移量必须等于已接收字节数，断线后查询会话取得偏移量继续上传；
+   超出声明大小的分片在读取请求体之前拒绝
+3. 完成：服务端按顺序合并分片并计算 SHA-256，保存为 Blob（见 community.blobs）
+
+每个分片单独保存为 uploads/<会话id>/<偏移量>，合并前不需要在存储上追加写入。
+超过 UPLOAD_SESSION_TIMEOUT 未更新的会话由 clear_upload_sessions 命令清理
+"""
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from . import blobs
+from .models import UploadSession
+
+UPLOAD_DIR = 'uploads'
+
+
+class OffsetMismatch(ValueError):
+    """分片偏移量与已接收字节数不一致"""
+
+    def __init__(self, offset):
+        super().__init__('偏移量与已接收字节数不一致')
+        self.offset = offset
+
+
+def chunk_size():
+    return getattr(settings, 'UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+
+def check_file(name, size):
+    """
+    校验文件类型和大小
+    :raises ValueError: 不允许的文件类型或文件过大
+    """
+    extension = os.path.splitext(name)[1][1:].lower()
+    if extension not in settings.ALLOWED_FILE_EXTENSIONS:
+        raise ValueError(f'不支持的文件类型。允许的类型: {", ".join(settings.ALLOWED_FILE_EXTENSIONS)}')
+    if size > settings.MAX_UPLOAD_SIZE:
+        raise ValueError(f'文件太大。最大允许大小: {settings.MAX_UPLOAD_SIZE / 1024 / 1024}MB')
+
+
+def session_dir(session_id):
+    return f'{UPLOAD_DIR}/{session_id}'
+
+
+def check_chunk(session, offset, length):
+    """
+    在读取分片数据之前校验偏移量和长度
+    :raises OffsetMismatch: 偏移量不等于已接收字节数
+    :raises ValueError: 分片过大或超出声明的文件大小
+    """
+    if offset != session.offset:
+        raise OffsetMismatch(session.offset)
+    if length > chunk_size():
+        raise ValueError(f'分片太大。最大允许大小: {chunk_size()}字节')
+    if offset + length > session.size:
+        raise ValueError('分片超出声明的文件大小')
+
+
+def write_chunk(session, offset, data):
+    """
+    保存分片并更新已接收字节数
+    :return: 新的偏移量
+    """
+    with transaction.atomic():
+        # 同一会话的分片依次写入
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        check_chunk(session, offset, len(data))
+        name = f'{session_dir(session.pk)}/{offset:012d}'
+        # 之前失败的请求可能留下了同一偏移量的分片
+        default_storage.delete(name)
+        default_storage.save(name, ContentFile(data))
+        session.offset = offset + len(data)
+        session.save(update_fields=['offset', 'updated_at'])
+    return session.offset
+
+
+def _chunk_names(session_id):
+    try:
+        names = default_storage.listdir(session_dir(session_id))[1]
+    except FileNotFoundError:
+        return []
+    return [f'{session_dir(session_id)}/{name}' for name in sorted(names)]
+
+
+@transaction.atomic
+def finalize(session):
+    """
+    合并分片保存为 Blob 并删除会话
+    :raises ValueError: 文件未上传完整或与声明的 sha256 不一致
+    :return: Blob
+    """
+    session = UploadSession.objects.select_for_update().get(pk=session.pk)
+    if session.offset != session.size:
+        raise ValueError('文件未上传完整')
+    sha256 = hashlib.sha256()
+    with tempfile.TemporaryFile() as assembled:
+        for name in _chunk_names(session.pk):
+            with default_storage.open(name) as chunk:
+                for data in chunk.chunks():
+                    sha256.update(data)
+                    assembled.write(data)
+        file = File(assembled, name=session.name)
+        file.size = session.size
+        file.sha256 = sha256.hexdigest()
+        if session.sha256 and session.sha256 != file.sha256:
+            raise ValueError('文件内容与sha256不一致')
+        blob = blobs.store(file)
+    discard(session)
+    return blob
+
+
+def discard(session):
+    """删除会话及其分片"""
+    _delete_chunks(session.pk)
+    session.delete()
+
+
+def _delete_chunks(session_id):
+    for name in _chunk_names(session_id):
+        default_storage.delete(name)
+    try:
+        os.rmdir(default_storage.path(session_dir(session_id)))
+    except (NotImplementedError, OSError):
+        # 不支持本地路径的存储没有目录
+        pass
+
+
+def clear_stale_sessions():
+    """
+    删除超过 UPLOAD_SESSION_TIMEOUT 秒未更新的会话，以及没有会话的分片目录
+    :return: 删除的会话数
+    """
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'UPLOAD_SESSION_TIMEOUT', 24 * 3600))
+    stale = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in stale:
+        discard(session)
+    try:
+        directories = default_storage.listdir(UPLOAD_DIR)[0]
+    except FileNotFoundError:
+        directories = []
+    live = {str(pk) for pk in UploadSession.objects.values_list('pk', flat=True)}
+    for directory in set(directories) - live:
+        _delete_chunks(directory)
+    return len(stale)
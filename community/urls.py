@@ -1,13 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from account.views import UserViewSet, UserRegisterView
-from community.views import PostViewSet, CategoryViewSet, CommentViewSet, TagViewSet
+from community.views import BlobViewSet, PostViewSet, CategoryViewSet, CommentViewSet, RevisionViewSet, TagViewSet, UploadSessionViewSet
 
 router = DefaultRouter()
 router.register('posts', PostViewSet)
 router.register('categories', CategoryViewSet)
 router.register('comments', CommentViewSet)
+router.register('revisions', RevisionViewSet, basename='revision')
 router.register('tags', TagViewSet)
+router.register('uploads', UploadSessionViewSet, basename='upload')
+router.register('blobs', BlobViewSet, basename='blob')
 urlpatterns = [
     path('', include(router.urls)),
 
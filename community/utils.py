@@ -1,6 +1,14 @@
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
 from django.utils import timezone
 from datetime import timedelta
 
+
+def cache_is_shared():
+    """默认缓存是否由各进程共享，进程内缓存中的失效操作不会传到其他进程"""
+    return not isinstance(caches['default'], LocMemCache)
+
+
 def format_created_at(created_at):
     now = timezone.now().replace(microsecond=0)
     created_at = created_at.replace(microsecond=0)
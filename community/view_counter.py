@@ -0,0 +1,105 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.models import Case, F, IntegerField, Value, When
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedViewCounter:
+    """
+    浏览量写缓冲
+    在进程内累加浏览量增量，刷新周期到期时由后台定时线程写回数据库，没有新的访问也会按时写回；
+    进程正常退出时写回剩余增量，异常退出最多丢失一个刷新周期的数据
+    """
+
+    def __init__(self, model_label, field, using=DEFAULT_DB_ALIAS):
+        """
+        :param model_label: 模型标签，如 'community.Post'
+        :param field: 浏览量字段名
+        :param using: 数据库别名
+        """
+        self.model_label = model_label
+        self.field = field
+        self.using = using
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._timer = None
+        atexit.register(self.flush)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+
+    def incr(self, pk, amount=1):
+        """累加浏览量，到达刷新周期时写回"""
+        with self._lock:
+            self._pending[pk] = self._pending.get(pk, 0) + amount
+            due = time.monotonic() - self._last_flush >= self.interval
+            if not due:
+                self._schedule()
+        if due:
+            self.flush()
+
+    def pending(self, pk):
+        """尚未写回的浏览量增量"""
+        return self._pending.get(pk, 0)
+
+    def _schedule(self):
+        """在当前刷新周期结束时写回，调用方需持有锁"""
+        if self._timer is not None:
+            return
+        delay = max(0, self.interval - (time.monotonic() - self._last_flush))
+        self._timer = threading.Timer(delay, self._flush_on_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_on_timer(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        finally:
+            # 定时线程的数据库连接不会被请求周期关闭
+            connections[self.using].close()
+
+    def flush(self):
+        """分批写回所有待写增量，每批一条 UPDATE，返回写回的记录数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        model = apps.get_model(self.model_label)
+        items = list(pending.items())
+        # 每个记录占用 id、CASE 条件与增量三个参数，按数据库的参数上限分批
+        batch_size = connections[self.using].ops.bulk_batch_size(['pk', 'pk', self.field], items) or len(items)
+        updated = 0
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            delta = Case(
+                *[When(pk=pk, then=Value(amount)) for pk, amount in batch],
+                output_field=IntegerField(),
+            )
+            try:
+                updated += model._base_manager.using(self.using).filter(pk__in=[pk for pk, amount in batch]).update(
+                    **{self.field: F(self.field) + delta}
+                )
+            except DatabaseError:
+                # 写回失败时把未写回的增量放回缓冲，下个周期重试
+                logger.exception('%s 浏览量写回失败', self.model_label)
+                with self._lock:
+                    for pk, amount in items[start:]:
+                        self._pending[pk] = self._pending.get(pk, 0) + amount
+                    self._schedule()
+                break
+        return updated
+
+
+post_view_counter = BufferedViewCounter('community.Post', 'view_count')
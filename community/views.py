@@ -1,57 +1,230 @@
-from django.utils import timezone
-from django.db.models import F, Q, Count
+import os
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.db.models import Count, Max, Prefetch, Q, Sum
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import filters
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import BaseParser
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from .models import Category, Post, PostAttachment, Comment, Tag
+from account.roles import is_auditor, is_owner
+from . import blobs, downloads, moderation, revisions, threads, uploads
+from .conditional import ConditionalGetMixin
+from .counters import category_cache
+from .filters import FullTextSearchFilter, PostFilter
+from .models import Blob, Category, Post, PostAttachment, Comment, Revision, Tag, UploadSession
 from .serializers import (
-    CategorySerializer, PostDetailSerializer,
-    CommentSerializer, PostAttachmentSerializer, TagSerializer, PostCreateOrEditSerializer
+    COMMENT_KEYSET_ORDERING, embedded_comment_limit,
+    CategorySerializer, PostDetailSerializer, PostListSerializer,
+    CommentSerializer, CommentTreeSerializer, PostAttachmentSerializer, TagSerializer, PostCreateOrEditSerializer,
+    RevisionSerializer, UploadSessionSerializer,
 )
+from .readers import CommentListReader, FastListMixin, PostListReader
+from .pagination import CustomPageNumberPagination, KeysetPagination, OptionalPagination
 from .permissions import IsOwnerAuditorOrApproved, IsOwnerOrAuditor, IsAuditor
+from .related import related_posts_for
+from .response_cache import AnonymousResponseCacheMixin
+from .view_counter import post_view_counter
+
+class SparseFieldsetMixin:
+    """
+    读取请求中的 ?fields= 与 ?expand= 参数传给序列化器
+    """
+    @staticmethod
+    def _split_param(value):
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    @property
+    def requested_fields(self):
+        return self._split_param(self.request.query_params.get('fields', '')) if self.request else []
+
+    @property
+    def requested_expand(self):
+        return self._split_param(self.request.query_params.get('expand', '')) if self.request else []
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request and self.request.method == 'GET':
+            kwargs.setdefault('fields', self.requested_fields)
+            kwargs.setdefault('expand', self.requested_expand)
+        return super().get_serializer(*args, **kwargs)
+
+class BulkModerationMixin:
+    """
+    批量审核，按 ids 或 filter 选出对象后在一个事务内批量更新
+    bulk_filter_fields 为 filter 中允许使用的查询条件
+    """
+    bulk_filter_fields = ()
+
+    def get_bulk_ids(self, request):
+        ids = request.data.getlist('ids') if hasattr(request.data, 'getlist') else request.data.get('ids')
+        conditions = request.data.get('filter')
+        if ids:
+            try:
+                ids = list(dict.fromkeys(int(pk) for pk in ids))
+            except (TypeError, ValueError):
+                raise ValidationError('ids 必须是整数列表')
+        elif isinstance(conditions, dict) and conditions:
+            invalid = set(conditions) - set(self.bulk_filter_fields)
+            if invalid:
+                raise ValidationError(f'不支持的筛选条件: {sorted(invalid)}')
+            queryset = self.queryset.model.objects.filter(**conditions).order_by('pk')
+            try:
+                ids = list(queryset.values_list('pk', flat=True).distinct()[:moderation.max_items() + 1])
+            except (ValueError, DjangoValidationError):
+                raise ValidationError('筛选条件的值无效')
+        else:
+            raise ValidationError('必须提供 ids 或 filter')
+        if len(ids) > moderation.max_items():
+            raise ValidationError(f'单次最多审核 {moderation.max_items()} 条')
+        return ids
 
-class CustomPageNumberPagination(PageNumberPagination):
-    page_size = 10  # 每页显示的记录数
-    page_size_query_param = 'page_size'  # 允许客户端通过该参数指定每页显示的记录数
-    max_page_size = 100  # 每页最大显示的记录数
-
-class CategoryViewSet(viewsets.ModelViewSet):
+    @swagger_auto_schema(
+        method='post',
+        operation_summary='批量审核',
+        operation_description='''
+                                批量执行审核操作，在一个事务内完成并返回每一项的结果
+                                参数：
+                                - operation: 字符串类型，必需参数。create_approve, create_reject, edit_approve, edit_reject 之一
+                                - ids: 数组类型，可选参数。要审核的对象id列表
+                                - filter: 对象类型，可选参数。未提供 ids 时按筛选条件选择对象
+                                权限：管理员
+                            '''
+    )
+    @action(detail=False, methods=['post'], permission_classes=[IsAuditor])
+    def bulk_moderate(self, request):
+        """
+        批量审核，管理员权限
+        """
+        operation = request.data.get('operation')
+        if operation not in moderation.TRANSITIONS:
+            raise ValidationError(f'operation 必须是 {list(moderation.TRANSITIONS)} 之一')
+        ids = self.get_bulk_ids(request)
+        queryset = self.queryset.model.objects.all()
+        results = moderation.bulk_moderate(queryset, ids, operation, reviewer=request.user)
+        succeeded = sum(result['success'] for result in results)
+        return Response({
+            'status': '批量审核完成',
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results,
+        })
+
+class CategoryViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuditor]
 
-class PostViewSet(viewsets.ModelViewSet):
+    def get_version_aggregates(self):
+        # 帖子数由信号用 update 维护，不更新 updated_at
+        return {
+            'posts': Sum('post_count'), 'public_posts': Sum('public_post_count'),
+            'subtree_posts': Sum('subtree_post_count'), 'subtree_public_posts': Sum('subtree_public_post_count'),
+        }
+
+    @swagger_auto_schema(
+        method='get',
+        operation_summary='获取分类树',
+        operation_description='''
+                返回嵌套的分类树，每个分类的 children 为其下级分类
+                参数：无
+                权限：审核员；管理员看到全部帖子数，其他用户看到公开帖子数
+            '''
+    )
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        staff = request.user.is_staff
+
+        def render(node):
+            return {
+                'id': node['id'],
+                'name': node['name'],
+                'description': node['description'],
+                'count': node['post_count'] if staff else node['public_post_count'],
+                'subtree_count': node['subtree_post_count'] if staff else node['subtree_public_post_count'],
+                'parent_id': node['parent_id'],
+            }
+        return Response(category_cache.nested(render=render))
+
+class PostViewSet(AnonymousResponseCacheMixin, ConditionalGetMixin, FastListMixin, BulkModerationMixin, SparseFieldsetMixin,
+                  viewsets.ModelViewSet):
     queryset = Post.objects.all()
-    filter_backends = (filters.SearchFilter, DjangoFilterBackend)
+    filter_backends = (FullTextSearchFilter, DjangoFilterBackend, filters.OrderingFilter)
     search_fields = ['title', 'content', 'author__username']
-    filterset_fields  = ['categories']
-    # filterset_class = PostFilter
+    ordering_fields = ['created_at', 'view_count', 'public_comment_count', 'last_comment_at']
+    filterset_class = PostFilter
     permission_classes = [IsOwnerAuditorOrApproved, IsOwnerOrAuditor]
     pagination_class = CustomPageNumberPagination
+    # 游标分页的排序键，需与默认排序一致并以唯一字段结尾
+    keyset_ordering = ('-is_pinned', '-created_at', 'id')
+    # 浏览量不参与条件请求的校验
+    version_fields = ('updated_at', 'last_comment_at')
+    bulk_filter_fields = ('author', 'categories', 'is_create_approved', 'is_edit_approved', 'created_at__gte', 'created_at__lte')
+    list_reader_class = PostListReader
+    # 搜索结果需要命中片段，使用序列化器
+    fast_list_blocking_params = ('fields', 'expand', 'search')
+
+    @property
+    def requested_expand(self):
+        expand = super().requested_expand
+        # 搜索时列表额外返回命中片段
+        if self.action == 'list' and self.request.query_params.get('search'):
+            expand.append('snippet')
+        return expand
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return PostCreateOrEditSerializer
+        if self.action == 'list':
+            return PostListSerializer
         return PostDetailSerializer
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(is_able=True)
-        # 未认证用户只能看到已审核的公开内容
-        if not self.request.user.is_authenticated:
-            return queryset.filter(is_create_approved=True, visibility='public')
-        # 普通认证用户可以看到自己的内容和已审核的公开内容
-        if not self.request.user.is_staff:
-            return queryset.filter(
-                Q(is_create_approved=True, visibility='public') |
-                Q(author=self.request.user)
-            )
-        return queryset
+        queryset = super().get_queryset().visible_to(self.request.user)
+        if self.action == 'list':
+            return self.prepare_list_queryset(queryset)
+        if self.action in ('comments', 'download_attachment'):
+            # 只需确认帖子可见，回复与附件另行查询
+            return queryset
+        return self.prefetch_related_objects(queryset)
+
+    def prefetch_related_objects(self, queryset, relations=None):
+        """
+        预取序列化所需的关联数据，列表查询数与分页大小无关
+        relations 为 None 时预取详情所需的全部关联
+        """
+        prefetches = {
+            'tags': 'tags',
+            'attachments': Prefetch(
+                'attachments', queryset=PostAttachment.objects.select_related('blob').prefetch_related('blob__derivatives'),
+            ),
+            'categories': 'categories',
+            # 回复按当前用户的可见性级别过滤，每个帖子只预取内嵌的最新几条
+            'comments': Prefetch(
+                'comments',
+                queryset=Comment.objects.visible_to(self.request.user).select_related('author').order_by(
+                    *COMMENT_KEYSET_ORDERING
+                )[:embedded_comment_limit() + 1],
+                to_attr='visible_comments',
+            ),
+        }
+        if relations is not None:
+            prefetches = {name: prefetches[name] for name in prefetches if name in relations}
+        return queryset.select_related('author').prefetch_related(*prefetches.values())
+
+    def prepare_list_queryset(self, queryset):
+        """
+        列表只预取标签和被 ?expand= 请求的关联
+        """
+        return self.prefetch_related_objects(queryset, ['tags', *self.requested_expand])
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
@@ -60,11 +233,9 @@ class PostViewSet(viewsets.ModelViewSet):
             return Response({'error': '没有权限编辑此对象'}, status=status.HTTP_403_FORBIDDEN)
         serializer = self.get_serializer(post, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        post.edited_title = serializer.validated_data.get('title')
-        post.edited_content = serializer.validated_data.get('content')
-        post.last_edited_at = timezone.now()
-        post.is_edit_approved = False
-        post.save()
+        revisions.submit(
+            post, request.user, title=serializer.validated_data.get('title'), content=serializer.validated_data.get('content'),
+        )
         return Response(
             {'status': '编辑请求已提交，等待审核'},
             status=status.HTTP_202_ACCEPTED
@@ -76,9 +247,9 @@ class PostViewSet(viewsets.ModelViewSet):
         """
         instance = self.get_object()
         # 检查是否有特定的权限
-        if request.user.is_staff or request.user == instance.author:
-            # 执行删除操作
-            instance.save(is_able=False)
+        if request.user.is_staff or is_owner(request.user, instance):
+            # 软删除，回复与附件一并删除
+            moderation.disable_post(instance)
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
             return Response({"detail": "You do not have permission to delete this book."},
@@ -87,12 +258,31 @@ class PostViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user, created_by=self.request.user)
 
-    def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        # 使用F()表达式避免竞争条件
-        Post.objects.filter(pk=instance.pk).update(view_count=F('view_count') + 1)
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+    def get_object(self):
+        instance = super().get_object()
+        if self.action == 'retrieve':
+            # 浏览量写入缓冲，按周期批量写回，返回值包含未写回的增量
+            post_view_counter.incr(instance.pk)
+            instance.view_count += post_view_counter.pending(instance.pk)
+        return instance
+
+    def get_version_aggregates(self):
+        aggregates = {
+            'public_comments': Sum('public_comment_count'),
+            'total_comments': Sum('total_comment_count'),
+        }
+        if self.action == 'retrieve' or 'comments' in self.requested_expand:
+            # 详情与 ?expand=comments 的列表包含回复
+            aggregates.update(comments=Count('comments', distinct=True), comments_updated=Max('comments__updated_at'))
+        return aggregates
+
+    def on_not_modified(self):
+        # 客户端缓存或响应缓存命中的详情请求同样计入浏览量
+        if self.action == 'retrieve':
+            post_view_counter.incr(int(self.kwargs['pk']))
+
+    def on_cached_response(self, entry):
+        self.on_not_modified()
 
     @swagger_auto_schema(
         method='get',
@@ -108,19 +298,11 @@ class PostViewSet(viewsets.ModelViewSet):
         """
         获取未回复的数据列表，管理员权限
         """
-        queryset = super().get_queryset()
-        # 获取所有有管理员回复的帖子ID
-        replied_post_ids = Comment.objects.filter(
-            author__is_staff=True, is_able=True
-        ).values_list('post_id', flat=True).distinct()
-        # 过滤出未被管理员回复的帖子（排除管理员自己发的帖子）
-        unreplied_queryset = queryset.exclude(
-            Q(id__in=replied_post_ids)  |
-            Q(is_able=False)            |
-            Q(is_create_approved=False) |
-            Q(author_id=None)
+        # 管理员回复状态由回复信号维护，按索引直接读取等待回复的帖子
+        queryset = self.prefetch_related_objects(super().get_queryset()).filter(
+            awaiting_reply=True, is_create_approved=True, author__isnull=False
         )
-        page = self.paginate_queryset(unreplied_queryset)
+        page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
@@ -141,7 +323,7 @@ class PostViewSet(viewsets.ModelViewSet):
         """
         获取未审批且可用的对象列表，管理员权限
         """
-        queryset = self.filter_queryset(self.get_queryset()).filter(is_create_approved=False, is_able=True)
+        queryset = self.filter_queryset(self.get_queryset()).filter(is_create_approved=False)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -168,12 +350,49 @@ class PostViewSet(viewsets.ModelViewSet):
         post.save()
         return Response({'status' : '置顶成功' if post.is_pinned else '取消置顶成功'}, status=status.HTTP_200_OK)
 
+    def perform_content_negotiation(self, request, force=False):
+        # 下载附件不按 Accept 协商，出错时返回 JSON
+        return super().perform_content_negotiation(request, force=force or self.action == 'download_attachment')
+
+    @swagger_auto_schema(
+        method='get',
+        operation_summary='下载附件',
+        operation_description='''
+                            下载帖子的附件，权限与查看帖子相同
+                            支持 Range 断点续传与 If-None-Match / If-Modified-Since 条件请求，
+                            只短时间缓存并要求重新验证；公开帖子的附件可以改用 content_url 长期缓存
+                        '''
+    )
+    @action(detail=True, methods=['get'], url_path=r'attachments/(?P<attachment_id>[0-9]+)')
+    def download_attachment(self, request, pk=None, attachment_id=None):
+        post = self.get_object()
+        attachment = get_object_or_404(post.attachments.select_related('blob'), pk=attachment_id)
+        name = attachment.file.name
+        if attachment.blob_id:
+            blob = attachment.blob
+            size, etag, last_modified = blob.size, f'"{blob.sha256}"', blob.created_at
+        else:
+            try:
+                size = attachment.file.storage.size(name)
+            except FileNotFoundError:
+                raise Http404('文件不存在')
+            etag, last_modified = f'"{attachment.pk}-{size}"', attachment.upload_at
+        return downloads.file_response(
+            request, name, filename=attachment.name or os.path.basename(name), size=size, etag=etag,
+            last_modified=last_modified, max_age=getattr(settings, 'ATTACHMENT_CACHE_MAX_AGE', 60),
+            # 匿名用户也能看到的帖子允许共享缓存
+            public=post.is_able and post.is_create_approved and post.visibility == 'public',
+        )
+
     @swagger_auto_schema(
         method='post',
         operation_summary='上传附件',
         operation_description='''
-                            上传附件
-                            参数：file: 文件类型，必需参数。要上传的附件文件。
+                            上传附件，相同内容的文件只保存一份
+                            参数：file: 文件类型。要上传的附件文件。
+                                 sha256: 可选，文件内容的SHA-256。不提供file时，当前用户能看到的附件中已有该内容则直接引用，
+                                         否则返回404，客户端再上传文件
+                                 name: 只提供sha256时必需，文件名，按文件类型校验
                             权限：管理员和作者
                         '''
     )
@@ -183,12 +402,29 @@ class PostViewSet(viewsets.ModelViewSet):
         上传附件，管理员和作者权限
         """
         post = self.get_object()
-        if post.author != request.user and not request.user.is_admin():
+        if not is_owner(request.user, post) and not is_auditor(request.user):
             return Response({'error': '没有上传权限'}, status=status.HTTP_403_FORBIDDEN)
         file = request.FILES.get('file')
-        if not file:
+        digest = request.data.get('sha256')
+        if not file and not digest:
             return Response({'error':'没有提供文件'}, status=status.HTTP_400_BAD_REQUEST)
-        attachment = PostAttachment.objects.create(post=post, file=file)
+        if not file and not blobs.is_digest(digest):
+            return Response({'error': '无效的sha256'}, status=status.HTTP_400_BAD_REQUEST)
+        name = file.name if file else request.data.get('name', '')
+        if not file:
+            # 只能引用自己已经看得到的内容，看不到与不存在同样返回404
+            blob = blobs.visible_blob(digest, request.user)
+            if blob is None:
+                return Response({'error': '文件不存在，请上传文件'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            uploads.check_file(name, file.size if file else blob.size)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            blob = blobs.store(file) if file else blobs.acquire(digest)
+            if blob is None:
+                return Response({'error': '文件不存在，请上传文件'}, status=status.HTTP_404_NOT_FOUND)
+            attachment = PostAttachment.objects.create(post=post, blob=blob, file=blob.file.name, name=name)
         serializer = PostAttachmentSerializer(attachment)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -244,15 +480,12 @@ class PostViewSet(viewsets.ModelViewSet):
         编辑帖子审核通过，管理员权限
         """
         post = self.get_object()
-        if not post.edited_content and not post.edited_title:
+        if not post.pending_revision_id:
             return Response({'error': '该帖子没有待审核的编辑'}, status=400)
-        # 批准编辑
-        post.title = post.edited_title if post.edited_title else post.title
-        post.content = post.edited_content if post.edited_content else post.content
-        post.edited_title = None
-        post.edited_content = None
-        post.is_edit_approved = True
-        post.save()
+        try:
+            revisions.review(post, True, request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
         return Response({'status': '编辑已批准'})
 
     @swagger_auto_schema(
@@ -269,11 +502,9 @@ class PostViewSet(viewsets.ModelViewSet):
         编辑帖子审核驳回，管理员权限
         """
         post = self.get_object()
-        if not post.edited_content and not post.edited_title:
+        if not post.pending_revision_id:
             return Response({'error': '该帖子没有待审核的编辑'}, status=400)
-        # 批准编辑
-        post.is_edit_approved = False
-        post.save()
+        revisions.review(post, False, request.user)
         return Response({'status': '编辑已拒绝'})
 
     @swagger_auto_schema(
@@ -343,7 +574,7 @@ class PostViewSet(viewsets.ModelViewSet):
         elif request.method == 'DELETE':
             post.categories.remove(*categories)
             action = "移除"
-        serializer = CategorySerializer(post.categories.all(), many=True)
+        serializer = CategorySerializer(post.categories.all(), many=True, context=self.get_serializer_context())
         return Response({'status': f'分类{action}成功', 'categories': serializer.data},
                         status=status.HTTP_200_OK)
     @swagger_auto_schema(
@@ -360,21 +591,55 @@ class PostViewSet(viewsets.ModelViewSet):
         获取帖子的相关推荐帖子
         """
         post = self.get_object()
-        # 获取共享至少一个标签的帖子，按共享标签数排序
-        related_posts = Post.objects.filter(
-            Q(is_create_approved=True, visibility='public') &
-            Q(tags__in=post.tags.all())
-        ).exclude(
-            id=post.id, is_able=False
-        ).annotate(
-            common_tags=Count('tags')
-        ).order_by(
-            '-common_tags',
-            '-created_at'
-        )[:5]  # 限制返回数量
+        # 相关帖子按共享标签数预先计算，读取时不做聚合
+        related_posts = related_posts_for(post, self.prefetch_related_objects(Post.objects.all()))
         serializer = self.get_serializer(related_posts, many=True)
         return Response(serializer.data)
 
+    @swagger_auto_schema(
+        method='get',
+        operation_summary='分页获取帖子回复',
+        operation_description='''
+                                按游标分页获取帖子的回复，id为帖子id
+                                参数：
+                                - cursor: 字符串类型，可选参数。上一页返回的游标，帖子详情的 comments_next 可直接使用
+                                - page_size: 整数类型，可选参数。每页条数
+                                - thread: 布尔类型，可选参数。为真时按顶层回复分页，每条顶层回复带嵌套的下级回复，游标与平铺模式不通用
+                                - max_depth: 整数类型，可选参数。线程模式下的最大层级
+                                权限：无
+                            '''
+    )
+    @action(detail=True, methods=['get'])
+    def comments(self, request, pk=None):
+        """
+        分页获取帖子回复
+        """
+        post = self.get_object()
+        queryset = Comment.objects.visible_to(request.user).filter(post=post).select_related('author')
+        paginator = KeysetPagination()
+        if request.query_params.get('thread', '').lower() not in ('1', 'true'):
+            paginator.ordering = COMMENT_KEYSET_ORDERING
+            page = paginator.paginate_queryset(queryset, request)
+            serializer = CommentSerializer(page, many=True, context=self.get_serializer_context())
+            return paginator.get_paginated_response(serializer.data)
+
+        try:
+            max_depth = threads.max_depth_param(request.query_params.get('max_depth'))
+        except ValueError:
+            raise ValidationError('max_depth 必须是非负整数')
+        # 顶层回复的路径即自身id，按路径倒序为最新在前
+        paginator.ordering = ('-path',)
+        roots = paginator.paginate_queryset(queryset.filter(depth=0), request)
+        if roots:
+            # 本页顶层回复的子树在路径上连续，一次范围查询读取
+            paths = [root.path for root in roots]
+            descendants = threads.subtree(
+                queryset.filter(depth__gt=0, path__gte=min(paths), path__lt=max(paths) + '~'), max_depth=max_depth,
+            )
+            threads.build_tree(descendants, roots=roots)
+        serializer = CommentTreeSerializer(roots, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
     @swagger_auto_schema(
         method='post',
         operation_summary='创建伪帖子',
@@ -397,27 +662,20 @@ class PostViewSet(viewsets.ModelViewSet):
         serializer.save(created_by=request.user)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(ConditionalGetMixin, FastListMixin, BulkModerationMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsOwnerAuditorOrApproved, IsOwnerOrAuditor]
+    pagination_class = OptionalPagination
+    keyset_ordering = ('-created_at', 'id')
+    list_reader_class = CommentListReader
+    bulk_filter_fields = ('post', 'author', 'is_create_approved', 'is_edit_approved', 'created_at__gte', 'created_at__lte')
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        # 未认证用户只能看到已审核的公开内容
-        if not self.request.user.is_authenticated:
-            return queryset.filter(is_create_approved=True, visibility='public')
-        # 认证用户可以看到自己的内容和已审核的公开内容
-        if not self.request.user.is_staff:
-            return queryset.filter(
-                Q(is_create_approved=True, visibility='public') |
-                Q(author=self.request.user)
-            ).exclude(is_able=False)
-            # 管理员可以看到所有内容
-        return queryset
+        return super().get_queryset().visible_to(self.request.user).select_related('author')
 
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
@@ -426,10 +684,7 @@ class CommentViewSet(viewsets.ModelViewSet):
             return Response({'error': '没有权限编辑此对象'}, status=status.HTTP_403_FORBIDDEN)
         serializer = self.get_serializer(post, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
-        post.edited_content = serializer.validated_data.get('content')
-        post.last_edited_at = timezone.now()
-        post.is_edit_approved = False
-        post.save()
+        revisions.submit(post, request.user, content=serializer.validated_data.get('content'))
         return Response(
             {'status': '编辑请求已提交，等待审核'},
             status=status.HTTP_202_ACCEPTED
@@ -487,13 +742,12 @@ class CommentViewSet(viewsets.ModelViewSet):
         编辑回复审核通过，管理员权限
         """
         comment = self.get_object()
-        if not comment.edited_content:
+        if not comment.pending_revision_id:
             return Response({'error': '该回复没有待审核的编辑'}, status=400)
-        # 批准编辑
-        comment.content = comment.edited_content if comment.edited_content else comment.content
-        comment.edited_content = None
-        comment.is_edit_approved = True
-        comment.save()
+        try:
+            revisions.review(comment, True, request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
         return Response({'status': '编辑已批准'})
 
     @swagger_auto_schema(
@@ -510,14 +764,238 @@ class CommentViewSet(viewsets.ModelViewSet):
         编辑回复审核驳回，管理员权限
         """
         comment = self.get_object()
-        if not comment.edited_content:
+        if not comment.pending_revision_id:
             return Response({'error': '该回复没有待审核的编辑'}, status=400)
-        # 批准编辑
-        comment.is_edit_approved = False
-        comment.save()
+        revisions.review(comment, False, request.user)
         return Response({'status': '编辑已拒绝'})
 
-class TagViewSet(viewsets.ModelViewSet):
+    @swagger_auto_schema(
+        method='get',
+        operation_summary='获取回复线程',
+        operation_description='''
+                                获取以该回复为根的嵌套回复树，一次查询读取，id为回复id
+                                参数：
+                                - max_depth: 整数类型，可选参数。相对该回复的最大层级，默认且最大为 COMMENT_THREAD_MAX_DEPTH
+                                权限：无
+                            '''
+    )
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        """
+        获取回复线程
+        """
+        root = self.get_object()
+        try:
+            max_depth = threads.max_depth_param(request.query_params.get('max_depth'))
+        except ValueError:
+            raise ValidationError('max_depth 必须是非负整数')
+        comments = threads.subtree(self.get_queryset().filter(post_id=root.post_id), root, max_depth)
+        serializer = CommentTreeSerializer(threads.build_tree(comments), many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
+
+class RevisionViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    待审核编辑的队列，按提交时间先后排列，使用游标分页
+    """
+    serializer_class = RevisionSerializer
+    permission_classes = [IsAuditor]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('created_at', 'id')
+
+    def get_queryset(self):
+        return Revision.objects.filter(status='pending').select_related('author', 'post', 'comment')
+
+    @swagger_auto_schema(
+        operation_summary='获取待审核的编辑',
+        operation_description='''
+                            获取待审核的帖子与回复编辑，按提交时间先后排列
+                            参数：
+                            - cursor: 字符串类型，可选参数。上一页返回的游标
+                            - page_size: 整数类型，可选参数。每页数量
+                            - with_count: 布尔类型，可选参数。为真时返回总数
+                            权限：管理员
+                        '''
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        operation_summary='获取待审核的编辑详情',
+        operation_description='''
+                            获取一条待审核的编辑，包括当前版本与编辑后的版本，id为编辑记录id
+                            权限：管理员
+                        '''
+    )
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    def review(self, approved):
+        revision = self.get_object()
+        target = revision.target
+        target.pending_revision = revision
+        try:
+            revisions.review(target, approved, self.request.user)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        return Response({'status': '编辑已批准' if approved else '编辑已拒绝'})
+
+    @swagger_auto_schema(
+        method='post',
+        operation_summary='编辑审核通过',
+        operation_description='''
+                                编辑审核通过，id为编辑记录id
+                                权限：管理员
+                            '''
+    )
+    @action(detail=True, methods=['post'])
+    def approve(self, request, pk=None):
+        """
+        编辑审核通过，管理员权限
+        """
+        return self.review(True)
+
+    @swagger_auto_schema(
+        method='post',
+        operation_summary='编辑审核拒绝',
+        operation_description='''
+                                编辑审核拒绝，id为编辑记录id
+                                权限：管理员
+                            '''
+    )
+    @action(detail=True, methods=['post'])
+    def reject(self, request, pk=None):
+        """
+        编辑审核驳回，管理员权限
+        """
+        return self.review(False)
+
+class TagViewSet(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [IsAuditor]
+
+class BlobViewSet(viewsets.GenericViewSet):
+    """
+    按内容寻址的附件下载，地址中的 SHA-256 对应的内容不会变化，可以长期缓存
+    只提供公开帖子引用的内容
+    """
+    queryset = Blob.objects.filter(
+        post_attachments__is_able=True, post_attachments__post__is_able=True,
+        post_attachments__post__is_create_approved=True, post_attachments__post__visibility='public',
+    ).distinct()
+    permission_classes = [AllowAny]
+    lookup_field = 'sha256'
+    lookup_value_regex = '[0-9a-f]{64}'
+
+    def perform_content_negotiation(self, request, force=False):
+        # 下载不按 Accept 协商，出错时返回 JSON
+        return super().perform_content_negotiation(request, force=True)
+
+    @swagger_auto_schema(
+        operation_summary='按内容下载附件',
+        operation_description='''
+                            下载公开帖子中按内容保存的附件，返回一年的 immutable 缓存头
+                            参数：name: 可选，下载时的文件名
+                            支持 Range 断点续传与条件请求
+                        ''',
+        responses={200: '文件内容'},
+    )
+    def retrieve(self, request, sha256=None):
+        blob = self.get_object()
+        return downloads.file_response(
+            request, blob.file.name, filename=request.query_params.get('name') or os.path.basename(blob.file.name),
+            size=blob.size, etag=f'"{blob.sha256}"', last_modified=blob.created_at, public=True, immutable=True,
+        )
+
+class ChunkParser(BaseParser):
+    """
+    分片上传的请求体为原始字节
+    分块传输编码的请求没有 Content-Length，最多读取 chunk_size + 1 字节，超出的分片由 uploads.check_chunk 拒绝
+    """
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read(uploads.chunk_size() + 1) if stream is not None else b''
+
+class UploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin,
+                           viewsets.GenericViewSet):
+    """
+    可续传的分片上传，见 community.uploads
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(owner_id=self.request.user.pk)
+
+    @swagger_auto_schema(
+        operation_summary='创建分片上传会话',
+        operation_description='''
+                            声明要上传的附件，文件类型和大小在这里校验
+                            参数：post: 帖子id；name: 文件名；size: 文件字节数；sha256: 可选，完成时校验
+                            返回：会话id、已接收字节数offset和单个分片的最大字节数chunk_size
+                            权限：帖子作者和管理员
+                        '''
+    )
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        post = serializer.validated_data['post']
+        if not is_owner(self.request.user, post) and not is_auditor(self.request.user):
+            raise PermissionDenied('没有上传权限')
+        if self.get_queryset().count() >= getattr(settings, 'UPLOAD_MAX_SESSIONS', 10):
+            raise ValidationError('未完成的上传过多，请先完成或取消其他上传')
+        serializer.save(owner=self.request.user)
+
+    @swagger_auto_schema(
+        method='put',
+        operation_summary='上传分片',
+        operation_description='''
+                            请求体为分片的原始字节，Content-Type: application/octet-stream
+                            参数：offset: 分片在文件中的偏移量，必须等于会话的已接收字节数
+                            偏移量不一致时返回409和当前的offset，客户端从该位置继续上传
+                            权限：会话的创建者
+                        '''
+    )
+    @action(detail=True, methods=['put'], parser_classes=[ChunkParser])
+    def chunk(self, request, pk=None):
+        session = self.get_object()
+        try:
+            offset = int(request.query_params.get('offset', ''))
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            return Response({'error': '无效的偏移量'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # 读取请求体之前按 Content-Length 校验，超出限制的数据不会写入
+            uploads.check_chunk(session, offset, length)
+            offset = uploads.write_chunk(session, offset, request.data)
+        except uploads.OffsetMismatch as e:
+            return Response({'error': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        return Response({'offset': offset})
+
+    @swagger_auto_schema(
+        method='post',
+        operation_summary='完成分片上传',
+        operation_description='''
+                            合并已上传的分片并保存为帖子附件，会话随后删除
+                            权限：会话的创建者
+                        '''
+    )
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        try:
+            with transaction.atomic():
+                blob = uploads.finalize(session)
+                attachment = PostAttachment.objects.create(
+                    post_id=session.post_id, blob=blob, file=blob.file.name, name=session.name,
+                )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(PostAttachmentSerializer(attachment).data, status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
@@ -5,21 +5,43 @@ from django.db import models
 import os
 from django.db import models
 from django.conf import settings
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.db.models.signals import m2m_changed
 
+from community import blobs, derivatives
+from community.models import Blob
+from community.threads import assign_path
+from community.view_counter import BufferedViewCounter
+
 
 class Attachment(models.Model):
     file = models.FileField(upload_to='attachments/%Y/%m/%d/')
+    # 旧附件为 None，文件直接保存在 attachments 下
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='app_attachments')
+    name = models.CharField(max_length=255, blank=True, default='')
     uploader = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     description = models.CharField(max_length=200, blank=True)
 
+    @property
+    def filename(self):
+        """上传时的文件名，旧附件取保存的文件名"""
+        return self.name or os.path.basename(self.file.name)
+
     # 自动获取文件类型
     @property
     def filetype(self):
-        return self.file.name.split('.')[-1].lower()
+        # 较早按内容保存的文件名没有扩展名，取上传时的文件名
+        return (self.name or self.file.name).split('.')[-1].lower()
+
+    @property
+    def thumbnail_url(self):
+        """已生成的缩略图或首页预览地址"""
+        if self.blob_id is None:
+            return None
+        derivative = self.blob.derivatives.filter(status='done').first()
+        return derivative.file.url if derivative else None
 
 class Category(models.Model):
     name = models.CharField(max_length=100, verbose_name='分类名称')
@@ -51,8 +73,11 @@ class Post(models.Model):
         return self.title
 
     def increase_views(self):
-        self.views += 1
-        self.save(update_fields=['views'])
+        # 浏览量写入缓冲，按周期批量写回
+        view_counter.incr(self.pk)
+        self.views += view_counter.pending(self.pk)
+
+view_counter = BufferedViewCounter('community_app.Post', 'views')
 
 # models.py
 class Comment(models.Model):
@@ -61,8 +86,16 @@ class Comment(models.Model):
     content = models.TextField(verbose_name="")
     created_at = models.DateTimeField(auto_now_add=True)
     parent_comment = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # 物化路径与层级，新建后由 community.threads 写入
+    path = models.CharField(max_length=255, blank=True, default='', verbose_name='路径')
+    depth = models.PositiveSmallIntegerField(default=0, verbose_name='层级')
     attachments = models.ManyToManyField(Attachment, through='CommentAttachment')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='app_comment_thread_idx'),
+        ]
+
     def __str__(self):
         return f"{self.author}在'{self.post}'的评论"
 
@@ -78,11 +111,25 @@ class CommentAttachment(models.Model):
 
 @receiver(post_delete, sender=Attachment)
 def auto_delete_file(sender, instance, **kwargs):
-    """自动删除实际文件"""
-    if instance.file:
+    """自动删除实际文件，按内容保存的文件没有其他附件引用时才删除"""
+    if instance.blob_id:
+        blobs.release(instance.blob_id)
+    elif instance.file:
         if os.path.isfile(instance.file.path):
             os.remove(instance.file.path)
 
+@receiver(post_save, sender=Attachment)
+def enqueue_derivatives(sender, instance, created, **kwargs):
+    """新附件登记缩略图或预览的生成任务"""
+    if created and instance.blob_id:
+        derivatives.enqueue(instance.blob, instance.name)
+
+@receiver(post_save, sender=Comment)
+def assign_comment_path(sender, instance, created, **kwargs):
+    """新建回复后写入线程路径"""
+    if created:
+        assign_path(instance)
+
 @receiver(m2m_changed, sender=Post.attachments.through)
 def cleanup_orphan_attachments(sender, instance, action, **kwargs):
     """清理无关联的附件"""
@@ -1,3 +1,31 @@
 from django.test import TestCase
 
-# Create your tests here.
+from account.models import User
+from .models import Comment, Post
+from community.threads import descendants_of
+from .utils import date_handler
+
+
+class DateHandlerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.post = Post.objects.create(title='帖子', content='内容', author=cls.author)
+        for i in range(3):
+            comment = Comment.objects.create(post=cls.post, author=cls.author, content=f'回复{i}')
+            for j in range(2):
+                Comment.objects.create(post=cls.post, author=cls.author, content=f'回复{i}-{j}', parent_comment=comment)
+
+    def test_replies_load_in_one_query(self):
+        top_level_comments = Comment.objects.filter(post=self.post, parent_comment__isnull=True).order_by('pk')
+        with self.assertNumQueries(2):
+            comments = date_handler(top_level_comments)
+        self.assertEqual([len(comment.replies_) for comment in comments], [2, 2, 2])
+        self.assertEqual(comments[0].replies_[1].content, '回复0-1')
+        self.assertTrue(all(reply.display_time for reply in comments[0].replies_))
+
+    def test_only_page_subtrees_are_loaded(self):
+        first = Comment.objects.filter(post=self.post, parent_comment__isnull=True).order_by('pk').first()
+        Comment.objects.create(post=self.post, author=self.author, content='回复0-0-0', parent_comment=first.replies.first())
+        loaded = Comment.objects.filter(descendants_of([first]))
+        self.assertEqual(sorted(comment.content for comment in loaded), ['回复0-0', '回复0-0-0', '回复0-1'])
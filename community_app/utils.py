@@ -1,30 +1,33 @@
 from django.db.models import QuerySet
 from django.utils import timezone
 
+from community.threads import build_tree, descendants_of
+
+
+def _display_time(obj, now, long_format):
+    delta = now - obj.created_at
+    if delta.days < 7:
+        obj.display_time = f"{delta.days} 天前" if delta.days else f"24小时内"
+    else:
+        obj.display_time = obj.created_at.strftime(long_format)
+
 
 def date_handler(obj_data):
     now = timezone.now()
     if isinstance(obj_data, QuerySet) or isinstance(obj_data, list) or isinstance(obj_data, tuple):
-        for obj in obj_data:
-            delta = now - obj.created_at
-            if delta.days < 7:
-                obj.display_time = f"{delta.days} 天前" if delta.days else f"24小时内"
-            else:
-                obj.display_time = obj.created_at.strftime("%m-%d")
-            obj.replies_ = []
-            for reply in obj.replies.all():
+        objs = list(obj_data)
+        if objs and hasattr(objs[0], 'path'):
+            # 一次查询读取这些回复子树中的下级回复，按路径挂到各自的上级下
+            model = type(objs[0])
+            descendants = model.objects.filter(descendants_of(objs)).select_related('author').order_by('path')
+            build_tree(descendants, roots=objs)
+        for obj in objs:
+            _display_time(obj, now, "%m-%d")
+            obj.replies_ = getattr(obj, 'children', [])
+            for reply in obj.replies_:
                 # 处理一级回复的时间显示
-                delta = now - reply.created_at
-                if delta.days < 7:
-                    reply.display_time = f"{delta.days} 天前" if delta.days else f"24小时内"
-                else:
-                    reply.display_time = reply.created_at.strftime("%m-%d %H:%M")
-                obj.replies_.append(reply)
-        return obj_data
+                _display_time(reply, now, "%m-%d %H:%M")
+        return objs if isinstance(obj_data, QuerySet) else obj_data
     else:
-        delta = now - obj_data.created_at
-        if delta.days < 7:
-            obj_data.display_time = f"{delta.days} 天前" if delta.days else f"24小时内"
-        else:
-            obj_data.display_time = obj_data.created_at.strftime("%m-%d %H:%M")
+        _display_time(obj_data, now, "%m-%d %H:%M")
         return obj_data
@@ -9,6 +9,11 @@ from .utils import date_handler
 from django.db.models import Count
 from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
+
+from community import blobs, uploads
+
+
 def post_list(request):
     posts = Post.objects.all().order_by('-created_at')
     categories = Category.objects.annotate(num_posts=Count('post'))
@@ -133,18 +138,35 @@ def category_posts(request, slug):
 
 @csrf_exempt
 def upload_attachment(request):
-    if request.method == 'POST' and request.FILES:
+    if request.method == 'POST' and (request.FILES or request.POST.get('sha256')):
         attach_file = request.FILES.get('file')
         response_data = {}
-        if attach_file:
-            attachment = Attachment.objects.create(
-                file=attach_file,
-                uploader=request.user,
-                description=attach_file.name
-            )
+        # 只提供sha256时，当前用户能看到的附件中已有该内容则直接引用，不必重复上传
+        digest = request.POST.get('sha256')
+        if attach_file or blobs.is_digest(digest):
+            name = attach_file.name if attach_file else request.POST.get('name', '')
+            if not attach_file:
+                blob = blobs.visible_blob(digest, request.user)
+                if blob is None:
+                    return JsonResponse({'success': False, 'error': '文件不存在，请上传文件'}, status=404)
+            try:
+                uploads.check_file(name, attach_file.size if attach_file else blob.size)
+            except ValueError as e:
+                return JsonResponse({'success': False, 'error': str(e)}, status=400)
+            with transaction.atomic():
+                blob = blobs.store(attach_file) if attach_file else blobs.acquire(digest)
+                if blob is None:
+                    return JsonResponse({'success': False, 'error': '文件不存在，请上传文件'}, status=404)
+                attachment = Attachment.objects.create(
+                    file=blob.file.name,
+                    blob=blob,
+                    name=name,
+                    uploader=request.user,
+                    description=name
+                )
             response_data = {
                 'id': attachment.id,
-                'name': attachment.file.name,
+                'name': attachment.name,
                 'url': attachment.file.url,
                 'type': attachment.filetype,
                 'size': attachment.file.size
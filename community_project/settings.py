@@ -89,6 +89,15 @@ DATABASES = {
     }
 }
 
+# 角色缓存、匿名响应缓存与分类树版本号要在各进程间共享才能及时失效。
+# 多进程部署时设置 REDIS_URL 使用 Redis（需要安装 redis 包）；未设置时使用进程内缓存，
+# 这些缓存只在单个请求内有效或不启用，见 community.utils.cache_is_shared
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -135,6 +144,8 @@ LOGIN_REDIRECT_URL  = '/community/'
 
 # 自定义用户模型
 AUTH_USER_MODEL = 'account.User'
+# 用户所属组在共享缓存中的保存时间（秒）
+ROLE_CACHE_TIMEOUT = 300
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
@@ -142,6 +153,52 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # 允许上传的文件类型
 ALLOWED_FILE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'pdf', 'doc', 'docx', 'ppt', 'pptx', 'xls', 'xlsx']
 MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+# 分片上传：单个分片的最大字节数、会话过期时间（秒）与每个用户未完成的会话数
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_SESSION_TIMEOUT = 24 * 3600
+UPLOAD_MAX_SESSIONS = 10
+# 附件缩略图的最大尺寸、生成线程数、失败重试次数与任务超时（秒）
+THUMBNAIL_SIZE = (320, 320)
+DERIVATIVE_WORKERS = 2
+DERIVATIVE_MAX_ATTEMPTS = 3
+DERIVATIVE_LOCK_TIMEOUT = 300
+# 附件下载交给前端代理发送：None、'nginx'（X-Accel-Redirect）或 'xsendfile'（X-Sendfile）
+# nginx 需要把 ATTACHMENT_SENDFILE_PREFIX 配置为指向 MEDIA_ROOT 的 internal location
+ATTACHMENT_SENDFILE = None
+ATTACHMENT_SENDFILE_PREFIX = '/protected/'
+# 帖子附件地址的缓存秒数，帖子改为私有或被删除后缓存最多保留这么久
+ATTACHMENT_CACHE_MAX_AGE = 60
+# 接收上传时计算文件的SHA-256，用于按内容去重
+FILE_UPLOAD_HANDLERS = [
+    'community.blobs.HashingMemoryFileUploadHandler',
+    'community.blobs.HashingTemporaryFileUploadHandler',
+]
+
+# 浏览量缓冲写回周期（秒）
+VIEW_COUNT_FLUSH_INTERVAL = 10
+
+# 分页总数缓存时间（秒）
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+
+# 全文检索最多返回的帖子数
+SEARCH_MAX_RESULTS = 1000
+
+# 每个帖子保存与返回的相关推荐数
+RELATED_POSTS_STORED = 20
+RELATED_POSTS_RETURNED = 5
+# 单次批量审核的最大条数
+BULK_MODERATION_MAX_ITEMS = 5000
+# 匿名帖子响应缓存的有效时间，过期或失效后旧响应在重建期间可继续使用的时间，以及重建锁的超时时间；
+# 只在配置了共享缓存（REDIS_URL）时启用
+RESPONSE_CACHE_TIMEOUT = 60
+RESPONSE_CACHE_STALE_TIMEOUT = 600
+RESPONSE_CACHE_LOCK_TIMEOUT = 10
+# 回复线程接口返回的最大层级
+COMMENT_THREAD_MAX_DEPTH = 10
+# 帖子详情内嵌的最新回复数
+POST_EMBEDDED_COMMENTS = 20
+# 帖子、回复、需求列表使用 .values() 快速序列化
+FAST_LIST_SERIALIZATION = True
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),  # 访问 Token 的过期时间
@@ -150,6 +207,10 @@ SIMPLE_JWT = {
 
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_RENDERER_CLASSES': [
+        'community.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ]
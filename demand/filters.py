@@ -0,0 +1,15 @@
+from django_filters import rest_framework as django_filters
+
+from .models import CategoryClosure, Demand
+
+
+class DemandFilter(django_filters.FilterSet):
+    category_tree = django_filters.NumberFilter(method='filter_category_tree', help_text='分类id，包括其全部下级分类')
+
+    class Meta:
+        model = Demand
+        fields = ['category']
+
+    def filter_category_tree(self, queryset, name, value):
+        subtree = CategoryClosure.objects.filter(ancestor_id=value).values('descendant_id')
+        return queryset.filter(category_id__in=subtree)
@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-19 04:07
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_category_counters(apps, schema_editor):
+    Category = apps.get_model('demand', 'Category')
+    Demand = apps.get_model('demand', 'Demand')
+    stats = Demand.objects.filter(is_able=True, category__isnull=False).order_by().values('category_id').annotate(
+        total=Count('id'),
+    )
+    for row in stats:
+        Category.objects.filter(pk=row['category_id']).update(post_count=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demand', '0004_demand_completed_at_demand_handler_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='需求数'),
+        ),
+        migrations.RunPython(backfill_category_counters, migrations.RunPython.noop),
+    ]
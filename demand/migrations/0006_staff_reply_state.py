@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-19 04:14
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_staff_reply_state(apps, schema_editor):
+    Demand = apps.get_model('demand', 'Demand')
+    Comment = apps.get_model('demand', 'Comment')
+    stats = Comment.objects.filter(is_able=True, author__is_staff=True).order_by().values('demand_id').annotate(
+        last=Max('created_at'),
+    )
+    for row in stats:
+        Demand.objects.filter(pk=row['demand_id']).update(last_staff_reply_at=row['last'], awaiting_reply=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demand', '0005_category_post_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='demand',
+            name='awaiting_reply',
+            field=models.BooleanField(default=True, verbose_name='是否等待管理员回复'),
+        ),
+        migrations.AddField(
+            model_name='demand',
+            name='last_staff_reply_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='管理员最后回复时间'),
+        ),
+        migrations.AddIndex(
+            model_name='demand',
+            index=models.Index(fields=['awaiting_reply', '-created_at'], name='demand_awaiting_reply_idx'),
+        ),
+        migrations.RunPython(backfill_staff_reply_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-19 04:26
+
+from django.db import migrations, models
+
+
+def backfill_thread_paths(apps, schema_editor):
+    Comment = apps.get_model('demand', 'Comment')
+    parents = dict(Comment.objects.values_list('pk', 'parent_comment_id'))
+    paths = {}
+    for pk in parents:
+        chain = []
+        while pk is not None and pk not in paths:
+            chain.append(pk)
+            pk = parents.get(pk)
+        path, depth = paths.get(pk, ('', -1))
+        for node in reversed(chain):
+            segment = f'{node:010d}'
+            if depth >= 24:
+                path = path[:-10] + segment
+            else:
+                path, depth = path + segment, depth + 1
+            paths[node] = (path, depth)
+    Comment.objects.bulk_update(
+        [Comment(pk=pk, path=path, depth=depth) for pk, (path, depth) in paths.items()],
+        ['path', 'depth'], batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demand', '0007_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='层级'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='路径'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['demand', 'path'], name='demand_comment_thread_idx'),
+        ),
+        migrations.RunPython(backfill_thread_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-19 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demand', '0009_category_closure'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='demand',
+            name='demand_awaiting_reply_idx',
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['-created_at'], name='demand_comment_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='demand',
+            index=models.Index(condition=models.Q(('is_able', True)), fields=['-created_at'], name='demand_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='demand',
+            index=models.Index(condition=models.Q(('is_able', True)), fields=['author', '-created_at'], name='demand_author_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='demand',
+            index=models.Index(condition=models.Q(('awaiting_reply', True), ('is_able', True)), fields=['-created_at'], name='demand_awaiting_reply_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2 on 2026-10-19 05:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('demand', '0010_visibility_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('is_able', True)), fields=['demand', '-created_at'], name='demand_comment_live_idx'),
+        ),
+    ]
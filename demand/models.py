@@ -1,15 +1,22 @@
 from rest_framework.exceptions import ValidationError
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
 from account.models import User
+from community.soft_delete import SoftDeleteManager
 
 
 class  Category(models.Model):
     name = models.CharField(max_length=20, unique=True, verbose_name='类名')
     description = models.TextField(blank=True, verbose_name='描述')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     parent_id = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, related_name='children', verbose_name='父类别id')
+    # 需求计数由 demand.signals 维护
+    post_count = models.PositiveIntegerField(default=0, verbose_name='需求数')
+    # 包括全部下级分类的需求数
+    subtree_post_count = models.PositiveIntegerField(default=0, verbose_name='子树需求数')
 
     class Meta:
         verbose_name = "分类"
@@ -18,6 +25,22 @@ class  Category(models.Model):
     def __str__(self):
         return self.name
 
+class CategoryClosure(models.Model):
+    """
+    分类树的闭包表，由 demand.signals 维护，见 community.category_tree
+    """
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendant_links', verbose_name='祖先')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestor_links', verbose_name='后代')
+    depth = models.PositiveSmallIntegerField(verbose_name='层级差')
+
+    class Meta:
+        verbose_name = '分类闭包'
+        verbose_name_plural = '分类闭包'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='demand_category_closure_unique'),
+        ]
+        indexes = [models.Index(fields=['descendant', 'ancestor'], name='demand_closure_desc_idx')]
+
 class Demand(models.Model):
     STATUS_CHOICES = (
         ('draft', '草稿'),  # 用户创建但未正式提交的需求，可自由编辑和删除
@@ -51,15 +74,28 @@ class Demand(models.Model):
     updated_at = models.DateTimeField('更新时间', auto_now=True)
     completed_at = models.DateTimeField('完成时间', null=True, blank=True)
     is_able = models.BooleanField(default=True, verbose_name='是否禁用')
+    # 管理员回复状态由 demand.signals 维护
+    last_staff_reply_at = models.DateTimeField(null=True, blank=True, verbose_name='管理员最后回复时间')
+    awaiting_reply = models.BooleanField(default=True, verbose_name='是否等待管理员回复')
+
+    # 默认管理器不返回已删除的需求，见 community.soft_delete
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
 
     class Meta:
         verbose_name = '需求'
         verbose_name_plural = '需求'
         ordering = ['-created_at']
+        # 布尔条件在 SQLite 上无法使用普通索引，按列表的过滤条件建立部分索引
+        indexes = [
+            models.Index(fields=['-created_at'], condition=Q(is_able=True), name='demand_feed_idx'),
+            models.Index(fields=['author', '-created_at'], condition=Q(is_able=True), name='demand_author_feed_idx'),
+            models.Index(fields=['-created_at'], condition=Q(awaiting_reply=True, is_able=True), name='demand_awaiting_reply_idx'),
+        ]
 
     def clean(self):
         # 这里实现状态转换的验证逻辑
-        old_status = self.__class__.objects.get(pk=self.pk).status if self.pk else None
+        old_status = self.__class__.all_objects.get(pk=self.pk).status if self.pk else None
         if old_status and not self._is_valid_transition(old_status, self.status):
             raise ValidationError(f'不允许从 {old_status} 状态转换到 {self.status} 状态')
 
@@ -91,17 +127,11 @@ class Demand(models.Model):
         if new_status == 'completed':
             self.completed_at = timezone.now()
 
+        # 状态变更历史由 demand.signals.record_status_change 记录
+        self._status_change_user = user
+        self._status_change_reason = reason
         self.save()
 
-        # 记录状态变更历史
-        DemandStatusChange.objects.create(
-            demand=self,
-            from_status=from_status,
-            to_status=new_status,
-            changed_by=user,
-            change_reason=reason
-        )
-
         # 执行状态变更后的额外操作
         self.after_status_change(from_status, new_status, user)
 
@@ -134,11 +164,24 @@ class Comment(models.Model):
     author = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='demand_comments', verbose_name='作者')
     content = models.TextField(verbose_name='内容')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
     parent_comment = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies', verbose_name='父回复')
+    # 物化路径与层级，新建后由 community.threads 写入
+    path = models.CharField(max_length=255, blank=True, default='', verbose_name='路径')
+    depth = models.PositiveSmallIntegerField(default=0, verbose_name='层级')
     last_edited_at = models.DateTimeField(null=True, blank=True, verbose_name='最后编辑时间')
     is_able = models.BooleanField(default=True, verbose_name='是否禁用')
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['demand', 'path'], name='demand_comment_thread_idx'),
+            models.Index(fields=['-created_at'], name='demand_comment_created_idx'),
+            models.Index(fields=['demand', '-created_at'], condition=Q(is_able=True), name='demand_comment_live_idx'),
+        ]
 
 
 class DemandStatusChange(models.Model):
@@ -1,14 +1,14 @@
 from rest_framework import permissions
 
+from account.roles import is_auditor, is_owner
+
 class IsOwnerAuditorOrApproved(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if request.user.is_superuser:
-            return True
         # 允许管理员查看所有内容
-        if request.user.groups.filter(name='auditors').exists():
+        if is_auditor(request.user):
             return True
         # 允许作者查看自己的内容
-        if hasattr(obj, 'author') and obj.author == request.user:
+        if is_owner(request.user, obj):
             return True
         # 允许查看已审核通过的内容
         return obj.is_create_approved
@@ -17,12 +17,10 @@ class IsOwnerOrAuditor(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        if request.user.is_superuser:
-            return True
         if request.user.is_authenticated:
-            if request.user.groups.filter(name='auditors').exists():
+            if is_auditor(request.user):
                 return True
-            return obj.author == request.user
+            return is_owner(request.user, obj)
         return False
     def has_permission(self, request, view):
         if request.user.is_superuser:
@@ -33,10 +31,6 @@ class IsOwnerOrAuditor(permissions.BasePermission):
 
 class IsAuditor(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if request.user.is_superuser:
-            return True
-        return request.user.groups.filter(name='auditors').exists()
+        return is_auditor(request.user)
     def has_permission(self, request, view):
-        if request.user.is_superuser:
-            return True
-        return request.user.groups.filter(name='auditors').exists()
\ No newline at end of file
+        return is_auditor(request.user)
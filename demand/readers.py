@@ -0,0 +1,74 @@
+"""
+需求列表的快速序列化，见 community.readers
+"""
+from collections import defaultdict
+
+from community.readers import ValuesReader, column, datetime_column, datetime_value, formatted_created_at
+from community.utils import format_created_at
+from .models import Comment, Demand
+
+STATUS_DISPLAY = dict(Demand.STATUS_CHOICES)
+
+
+class DemandListReader(ValuesReader):
+    """与 DemandSerializer 一致"""
+    columns = (
+        'id', 'title', 'description', 'author_id', 'author__username', 'author__email', 'author__role',
+        'category_id', 'category__name', 'category__description', 'category__post_count',
+        'category__subtree_post_count', 'category__parent_id', 'created_at', 'updated_at', 'is_able', 'status',
+    )
+
+    def get_mappers(self):
+        return {
+            'id': column('id'),
+            'title': column('title'),
+            'description': column('description'),
+            'author': self.author,
+            'category': self.category,
+            'comments': lambda row: self.comments.get(row['id'], []),
+            'created_at': datetime_column('created_at'),
+            'updated_at': datetime_column('updated_at'),
+            'formatted_created_at': formatted_created_at,
+            'is_able': column('is_able'),
+            'status': column('status'),
+            'status_display': lambda row: STATUS_DISPLAY.get(row['status'], row['status']),
+        }
+
+    @staticmethod
+    def author(row):
+        return {
+            'id': row['author_id'],
+            'username': row['author__username'],
+            'email': row['author__email'],
+            'role': row['author__role'],
+        }
+
+    @staticmethod
+    def category(row):
+        if row['category_id'] is None:
+            return None
+        return {
+            'id': row['category_id'],
+            'name': row['category__name'],
+            'description': row['category__description'],
+            'count': row['category__post_count'],
+            'subtree_count': row['category__subtree_post_count'],
+            'parent_id': row['category__parent_id'],
+        }
+
+    def prepare(self, rows):
+        # 一次查询读取当前页全部需求的回复
+        self.comments = defaultdict(list)
+        comments = Comment.objects.filter(demand_id__in=[row['id'] for row in rows]).values(
+            'id', 'author_id', 'demand_id', 'content', 'created_at', 'parent_comment_id',
+        )
+        for comment in comments:
+            self.comments[comment['demand_id']].append({
+                'id': comment['id'],
+                'author': comment['author_id'],
+                'demand': comment['demand_id'],
+                'content': comment['content'],
+                'created_at': datetime_value(comment['created_at']),
+                'formatted_created_at': format_created_at(comment['created_at']),
+                'parent_comment': comment['parent_comment_id'],
+            })
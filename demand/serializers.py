@@ -1,18 +1,28 @@
 from rest_framework import serializers
-from .models import Category, Demand, Comment, DemandStatusChange
+from .models import Category, CategoryClosure, Demand, Comment, DemandStatusChange
+from community import category_tree
 from community.utils import format_created_at
 from account.serializers import UserSerializer
 
 class CategorySerializer(serializers.ModelSerializer):
     count = serializers.SerializerMethodField(help_text='分类下帖子数')
+    subtree_count = serializers.IntegerField(source='subtree_post_count', read_only=True, help_text='分类及其全部下级分类下的需求数')
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'count', 'parent_id']
+        fields = ['id', 'name', 'description', 'count', 'subtree_count', 'parent_id']
         ref_name = 'DemandCategorySerializer'
 
     @staticmethod
     def get_count(obj):
-        return len(obj.posts.all())
+        return obj.post_count
+
+    def validate_parent_id(self, value):
+        if self.instance is not None and value is not None:
+            try:
+                category_tree.check_move(CategoryClosure, self.instance.pk, value.pk)
+            except ValueError as e:
+                raise serializers.ValidationError(str(e))
+        return value
 
 class CommentSerializer(serializers.ModelSerializer):
     formatted_created_at = serializers.SerializerMethodField(help_text='格式化创建时间')
@@ -26,6 +36,18 @@ class CommentSerializer(serializers.ModelSerializer):
     def get_formatted_created_at(obj) -> str:
         return format_created_at(obj.created_at)
 
+class CommentTreeSerializer(CommentSerializer):
+    """
+    嵌套的回复线程，replies 为直接下级回复（由 community.threads.build_tree 设置）
+    """
+    replies = serializers.SerializerMethodField()
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['depth', 'replies']
+        ref_name = 'DemandCommentTreeSerializer'
+
+    def get_replies(self, obj):
+        return CommentTreeSerializer(getattr(obj, 'children', []), many=True, context=self.context).data
+
 class DemandSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
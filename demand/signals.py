@@ -1,20 +1,170 @@
 # signals.py
-from django.db.models.signals import pre_save
+from django.db.models import Count, Max
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, post_init
 from django.dispatch import receiver
-from .models import Demand, DemandStatusChange
+from community import category_tree
+from account.models import User
+from community.threads import assign_path
+from .models import Category, CategoryClosure, Comment, Demand, DemandStatusChange
+
+# 进程内缓存的分类树，分类或需求数变化后失效
+category_cache = category_tree.CachedTree('demand.Category', ('name', 'description', 'post_count', 'subtree_post_count'))
 
 @receiver(pre_save, sender=Demand)
 def record_status_change(sender, instance, **kwargs):
     if instance.pk:  # 确保不是新创建的对象
         try:
-            old = Demand.objects.get(pk=instance.pk)
+            old = Demand.all_objects.get(pk=instance.pk)
             if old.status != instance.status:  # 状态发生变化
                 DemandStatusChange.objects.create(
                     demand=instance,
                     from_status=old.status,
                     to_status=instance.status,
-                    changed_by=instance._status_change_user,  # 需要设置
+                    changed_by=getattr(instance, '_status_change_user', None),  # 需要设置
                     change_reason=getattr(instance, '_status_change_reason', None)
                 )
         except Demand.DoesNotExist:
-            pass
\ No newline at end of file
+            pass
+
+
+def refresh_category_counters(category_ids):
+    """
+    重新统计分类下未禁用的需求数与分类及其全部祖先的子树需求数
+    :param category_ids: 需要刷新的分类id
+    """
+    category_ids = {pk for pk in category_ids if pk is not None}
+    if not category_ids:
+        return
+    stats = dict(
+        Demand.objects.filter(category_id__in=category_ids).order_by()
+        .values('category_id').annotate(total=Count('id')).values_list('category_id', 'total')
+    )
+    for category_id in category_ids:
+        Category.objects.filter(pk=category_id).update(post_count=stats.get(category_id, 0))
+    refresh_subtree_counters(category_tree.ancestor_ids(CategoryClosure, category_ids))
+
+
+def refresh_subtree_counters(category_ids):
+    """
+    重新统计分类子树（自身及全部下级分类）的需求数，需求只属于一个分类，不需要去重
+    :param category_ids: 需要刷新的分类id，调用方负责包含受影响分类的全部祖先
+    """
+    category_ids = set(category_ids)
+    if category_ids:
+        stats = dict(
+            CategoryClosure.objects.filter(ancestor_id__in=category_ids, descendant__posts__is_able=True).order_by()
+            .values('ancestor_id').annotate(total=Count('descendant__posts')).values_list('ancestor_id', 'total')
+        )
+        for category_id in category_ids:
+            Category.objects.filter(pk=category_id).update(subtree_post_count=stats.get(category_id, 0))
+    category_cache.invalidate()
+
+
+@receiver(post_init, sender=Demand)
+def remember_category_state(sender, instance, **kwargs):
+    # 延迟加载的字段不读取，避免额外查询
+    instance._counted_category_state = (instance.__dict__.get('category_id'), instance.__dict__.get('is_able'))
+
+
+@receiver(post_save, sender=Demand)
+def update_category_counters(sender, instance, created, **kwargs):
+    """需求创建、分类或禁用状态变化后刷新分类的需求数"""
+    old_category_id, old_is_able = instance._counted_category_state
+    if created or (old_category_id, old_is_able) != (instance.category_id, instance.is_able):
+        refresh_category_counters([old_category_id, instance.category_id])
+    instance._counted_category_state = (instance.category_id, instance.is_able)
+
+
+@receiver(post_delete, sender=Demand)
+def update_category_counters_on_delete(sender, instance, **kwargs):
+    refresh_category_counters([instance.category_id])
+
+
+@receiver(post_init, sender=Category)
+def remember_category_parent(sender, instance, **kwargs):
+    instance._tree_parent_id = instance.__dict__.get('parent_id_id')
+
+
+@receiver(pre_save, sender=Category)
+def check_category_parent(sender, instance, **kwargs):
+    """不允许形成环"""
+    if instance.pk and instance.parent_id_id != instance._tree_parent_id:
+        category_tree.check_move(CategoryClosure, instance.pk, instance.parent_id_id)
+
+
+@receiver(post_save, sender=Category)
+def update_category_closure(sender, instance, created, **kwargs):
+    """分类新建或上级变化后维护闭包表，并刷新新旧祖先的子树需求数"""
+    old_parent_id = instance._tree_parent_id
+    if created:
+        category_tree.insert_node(CategoryClosure, instance.pk, instance.parent_id_id)
+    elif instance.parent_id_id != old_parent_id:
+        old_ancestors = category_tree.ancestor_ids(CategoryClosure, [old_parent_id])
+        category_tree.move_node(CategoryClosure, instance.pk, instance.parent_id_id)
+        refresh_subtree_counters(old_ancestors | category_tree.ancestor_ids(CategoryClosure, [instance.pk]))
+    instance._tree_parent_id = instance.parent_id_id
+    category_cache.invalidate()
+
+
+@receiver(pre_delete, sender=Category)
+def detach_category_children(sender, instance, **kwargs):
+    """下级分类成为顶级分类，记录祖先以便删除后刷新子树需求数"""
+    instance._tree_ancestor_ids = category_tree.ancestor_ids(CategoryClosure, [instance.pk]) - {instance.pk}
+    category_tree.detach_children(CategoryClosure, Category, instance.pk)
+
+
+@receiver(post_delete, sender=Category)
+def update_subtree_counters_on_category_delete(sender, instance, **kwargs):
+    refresh_subtree_counters(getattr(instance, '_tree_ancestor_ids', set()))
+
+
+def refresh_staff_reply_state(demand_ids):
+    """
+    重新计算需求的管理员最后回复时间与等待回复状态
+    :param demand_ids: 需要刷新的需求id
+    """
+    demand_ids = set(demand_ids)
+    if not demand_ids:
+        return
+    stats = dict(
+        Comment.objects.filter(demand_id__in=demand_ids, author__is_staff=True).order_by()
+        .values('demand_id').annotate(last=Max('created_at')).values_list('demand_id', 'last')
+    )
+    for demand_id in demand_ids:
+        Demand.all_objects.filter(pk=demand_id).update(
+            last_staff_reply_at=stats.get(demand_id),
+            awaiting_reply=demand_id not in stats,
+        )
+
+
+@receiver(post_save, sender=Comment)
+def update_staff_reply_state(sender, instance, **kwargs):
+    """回复创建、禁用后刷新需求的管理员回复状态"""
+    refresh_staff_reply_state([instance.demand_id])
+
+
+@receiver(post_delete, sender=Comment)
+def update_staff_reply_state_on_delete(sender, instance, **kwargs):
+    refresh_staff_reply_state([instance.demand_id])
+
+
+@receiver(post_init, sender=User)
+def remember_staff_state(sender, instance, **kwargs):
+    # 延迟加载的字段不读取，避免额外查询
+    instance._demand_reply_is_staff = instance.__dict__.get('is_staff')
+
+
+@receiver(post_save, sender=User)
+def update_staff_reply_state_on_staff_change(sender, instance, created, **kwargs):
+    """用户成为或不再是管理员后，刷新其回复过的需求的管理员回复状态；queryset.update() 修改时不会触发"""
+    if not created and instance._demand_reply_is_staff is not None \
+            and instance.is_staff != instance._demand_reply_is_staff:
+        refresh_staff_reply_state(Comment.objects.filter(author=instance).values_list('demand_id', flat=True))
+    instance._demand_reply_is_staff = instance.is_staff
+
+
+@receiver(post_save, sender=Comment)
+def assign_comment_path(sender, instance, created, **kwargs):
+    """新建回复后写入线程路径"""
+    if created:
+        assign_path(instance)
@@ -1,3 +1,181 @@
-from django.test import TestCase
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from account.models import User
+from community import query_plans
+from .models import Category, CategoryClosure, Comment, Demand
+
+
+class CategoryCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.first = Category.objects.create(name='分类一')
+        cls.second = Category.objects.create(name='分类二')
+
+    def _counts(self):
+        return [Category.objects.get(pk=c.pk).post_count for c in (self.first, self.second)]
+
+    def test_counters_follow_demand_changes(self):
+        demand = Demand.objects.create(title='需求', description='描述', author=self.author, category=self.first)
+        self.assertEqual(self._counts(), [1, 0])
+
+        demand.category = self.second
+        demand.save()
+        self.assertEqual(self._counts(), [0, 1])
+
+        demand.is_able = False
+        demand.save()
+        self.assertEqual(self._counts(), [0, 0])
+
+        demand.delete()
+        self.assertEqual(self._counts(), [0, 0])
+
+
+class CategoryTreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.root = Category.objects.create(name='根')
+        cls.child = Category.objects.create(name='子', parent_id=cls.root)
+        cls.other = Category.objects.create(name='其他')
+        for category in (cls.root, cls.child, cls.child, cls.other):
+            Demand.objects.create(title='需求', description='描述', author=cls.author, category=category)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_subtree_counts_and_filter(self):
+        self.assertEqual(Category.objects.get(pk=self.root.pk).subtree_post_count, 3)
+        response = self.client.get('/api/demand/demands/', {'category_tree': self.root.pk})
+        self.assertEqual(response.data['count'], 3)
+
+        self.child.parent_id = self.other
+        self.child.save()
+        self.assertEqual(set(CategoryClosure.objects.filter(descendant=self.child).values_list('ancestor_id', flat=True)),
+                         {self.child.pk, self.other.pk})
+        self.assertEqual(Category.objects.get(pk=self.root.pk).subtree_post_count, 1)
+        self.assertEqual(Category.objects.get(pk=self.other.pk).subtree_post_count, 3)
+
+    def test_tree_endpoint(self):
+        response = self.client.get('/api/demand/categories/tree/')
+        self.assertEqual([node['name'] for node in response.data], ['根', '其他'])
+        self.assertEqual(response.data[0]['subtree_count'], 3)
+        self.assertEqual(response.data[0]['children'][0]['name'], '子')
+
+
+class AwaitingReplyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.waiting = Demand.objects.create(title='等待', description='描述', author=cls.author)
+        cls.replied = Demand.objects.create(title='已回复', description='描述', author=cls.author)
+        Comment.objects.create(demand=cls.replied, author=cls.staff, content='管理员回复')
+
+    def test_unreplied_lists_demands_without_staff_reply(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        response = client.get('/api/demand/demands/unreplied/')
+        self.assertEqual([item['id'] for item in response.data['results']], [self.waiting.pk])
+
+    def test_staff_change_refreshes_reply_state(self):
+        self.staff.is_staff = False
+        self.staff.save()
+        self.replied.refresh_from_db()
+        self.assertTrue(self.replied.awaiting_reply)
+        self.assertIsNone(self.replied.last_staff_reply_at)
+        self.staff.is_staff = True
+        self.staff.save()
+        self.replied.refresh_from_db()
+        self.assertFalse(self.replied.awaiting_reply)
+
+
+class SoftDeleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        cls.category = Category.objects.create(name='分类')
+        cls.demand = Demand.objects.create(title='需求', description='描述', author=cls.author, category=cls.category)
+        cls.comment = Comment.objects.create(demand=cls.demand, author=cls.staff, content='管理员回复')
+
+    def test_destroy_disables_demand_and_comments(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        self.assertEqual(client.delete(f'/api/demand/demands/{self.demand.pk}/').status_code, 204)
+        self.assertFalse(Demand.objects.filter(pk=self.demand.pk).exists())
+        self.assertFalse(Demand.all_objects.get(pk=self.demand.pk).is_able)
+        self.assertFalse(Comment.all_objects.get(pk=self.comment.pk).is_able)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.post_count, 0)
+        client.force_authenticate(self.staff)
+        self.assertEqual(client.get(f'/api/demand/demands/{self.demand.pk}/').status_code, 404)
+        self.assertEqual(client.get('/api/demand/comments/').data, [])
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.demand = Demand.objects.create(title='需求', description='描述', author=cls.author)
+
+    def test_list_answers_not_modified_until_comment_added(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        etag = client.get('/api/demand/demands/')['ETag']
+        self.assertEqual(client.get('/api/demand/demands/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Comment.objects.create(demand=self.demand, author=self.author, content='补充')
+        self.assertEqual(client.get('/api/demand/demands/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class FastListSerializationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        category = Category.objects.create(name='分类')
+        demand = Demand.objects.create(title='需求', description='描述', author=cls.author, category=category)
+        Demand.objects.create(title='无分类', description='描述', author=cls.author)
+        for i in range(2):
+            Comment.objects.create(demand=demand, author=cls.author, content=f'补充{i}')
+
+    def test_demand_list_matches_serializer(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        fast = client.get('/api/demand/demands/')
+        with override_settings(FAST_LIST_SERIALIZATION=False):
+            slow = client.get('/api/demand/demands/')
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+
+@skipUnless(query_plans.is_supported(), '只检查 SQLite 的查询计划')
+class QueryPlanTests(TestCase):
+    """常用列表查询不能退化为全表扫描"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='author', password='pwd')
+        cls.staff = User.objects.create_user(username='staff', password='pwd', is_staff=True, is_superuser=True)
+        demand = Demand.objects.create(title='需求', description='描述', author=cls.author)
+        Comment.objects.create(demand=demand, author=cls.author, content='回复')
+
+    def test_list_queries_use_indexes(self):
+        cases = [
+            (self.author, ['/api/demand/demands/', '/api/demand/comments/']),
+            (self.staff, ['/api/demand/demands/', '/api/demand/demands/unreplied/', '/api/demand/comments/']),
+        ]
+        for user, urls in cases:
+            client = APIClient()
+            client.force_authenticate(user)
+            for url in urls:
+                with self.subTest(user=user.username, url=url), CaptureQueriesContext(connection) as context:
+                    self.assertEqual(client.get(url).status_code, 200)
+                    scans = query_plans.full_table_scans(context.captured_queries, {'demand_demand', 'demand_comment'})
+                    self.assertEqual(scans, [])
@@ -1,38 +1,70 @@
-from django.db.models import F, Q, Count
+from django.db.models import Count, Max, Sum
+from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import filters
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from account.roles import is_owner
+from .filters import DemandFilter
 from .models import Category, Demand, Comment
+from .readers import DemandListReader
+from .signals import category_cache, refresh_staff_reply_state
 from .serializers import (
     CategorySerializer, DemandSerializer,
-    CommentSerializer, StatusChangeSerializer,
+    CommentSerializer, CommentTreeSerializer, StatusChangeSerializer,
 )
+from community import soft_delete, threads
+from community.conditional import ConditionalGetMixin
+from community.readers import FastListMixin
+from community.pagination import CustomPageNumberPagination, OptionalPagination
 from .permissions import IsOwnerAuditorOrApproved, IsOwnerOrAuditor, IsAuditor
 
-class CustomPageNumberPagination(PageNumberPagination):
-    page_size = 10  # 每页显示的记录数
-    page_size_query_param = 'page_size'  # 允许客户端通过该参数指定每页显示的记录数
-    max_page_size = 100  # 每页最大显示的记录数
-
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuditor]
 
-class DemandViewSet(viewsets.ModelViewSet):
+    def get_version_aggregates(self):
+        # 需求数由信号用 update 维护，不更新 updated_at
+        return {'posts': Sum('post_count'), 'subtree_posts': Sum('subtree_post_count')}
+
+    @swagger_auto_schema(
+        method='get',
+        operation_summary='获取分类树',
+        operation_description='''
+                返回嵌套的分类树，每个分类的 children 为其下级分类
+                参数：无
+                权限：审核员
+            '''
+    )
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        def render(node):
+            return {
+                'id': node['id'],
+                'name': node['name'],
+                'description': node['description'],
+                'count': node['post_count'],
+                'subtree_count': node['subtree_post_count'],
+                'parent_id': node['parent_id'],
+            }
+        return Response(category_cache.nested(render=render))
+
+class DemandViewSet(ConditionalGetMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Demand.objects.all()
-    filter_backends = (filters.SearchFilter, )
+    filter_backends = (filters.SearchFilter, DjangoFilterBackend)
     search_fields = ['title', 'content', 'author__username']
+    filterset_class = DemandFilter
     permission_classes = [IsOwnerAuditorOrApproved, IsOwnerOrAuditor]
     pagination_class = CustomPageNumberPagination
     serializer_class = DemandSerializer
+    list_reader_class = DemandListReader
+    keyset_ordering = ('-created_at', 'id')
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(is_able=True)
+        queryset = super().get_queryset()
         if not self.request.user.is_authenticated:
             return queryset.none()
         # 普通认证用户可以看到自己的内容和已审核的公开内容
@@ -40,15 +72,20 @@ class DemandViewSet(viewsets.ModelViewSet):
             return queryset.filter(author=self.request.user)
         return queryset
 
+    def get_version_aggregates(self):
+        # 列表与详情都包含回复
+        return {'comments': Count('comments', distinct=True), 'comments_updated': Max('comments__updated_at')}
+
     def destroy(self, request, *args, **kwargs):
         """
         删除帖子，管理员或作者权限
         """
         instance = self.get_object()
         # 检查是否有特定的权限
-        if request.user.is_staff or request.user == instance.author:
-            # 执行删除操作
-            instance.save(is_able=False)
+        if request.user.is_staff or is_owner(request.user, instance):
+            # 软删除，回复一并删除
+            soft_delete.disable(instance, instance.comments.all())
+            refresh_staff_reply_state([instance.pk])
             return Response(status=status.HTTP_204_NO_CONTENT)
         else:
             return Response({"detail": "You do not have permission to delete this book."},
@@ -71,19 +108,9 @@ class DemandViewSet(viewsets.ModelViewSet):
         """
         获取未回复的数据列表，管理员权限
         """
-        queryset = super().get_queryset()
-        # 获取所有有管理员回复的帖子ID
-        replied_post_ids = Comment.objects.filter(
-            author__is_staff=True, is_able=True
-        ).values_list('post_id', flat=True).distinct()
-        # 过滤出未被管理员回复的帖子（排除管理员自己发的帖子）
-        unreplied_queryset = queryset.exclude(
-            Q(id__in=replied_post_ids) |
-            Q(is_able=False) |
-            Q(is_create_approved=False) |
-            Q(author_id=None)
-        )
-        queryset = self.filter_queryset(unreplied_queryset)
+        # 管理员回复状态由回复信号维护，按索引直接读取等待回复的需求
+        queryset = super().get_queryset().filter(awaiting_reply=True)
+        queryset = self.filter_queryset(queryset)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -119,10 +146,12 @@ class DemandViewSet(viewsets.ModelViewSet):
         serializer = StatusChangeSerializer(changes, many=True)
         return Response(serializer.data)
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsOwnerAuditorOrApproved, IsOwnerOrAuditor]
+    pagination_class = OptionalPagination
+    keyset_ordering = ('-created_at', 'id')
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -133,5 +162,29 @@ class CommentViewSet(viewsets.ModelViewSet):
             return queryset.none()
         # 认证用户可以看到自己的内容和已审核的公开内容
         if not self.request.user.is_staff:
-            return queryset.filter(author=self.request.user, is_able=True)
+            return queryset.filter(author=self.request.user)
         return queryset
+
+    @swagger_auto_schema(
+        method='get',
+        operation_summary='获取回复线程',
+        operation_description='''
+                                获取以该回复为根的嵌套回复树，一次查询读取，id为回复id
+                                参数：
+                                - max_depth: 整数类型，可选参数。相对该回复的最大层级，默认且最大为 COMMENT_THREAD_MAX_DEPTH
+                                权限：无
+                            '''
+    )
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        """
+        获取回复线程
+        """
+        root = self.get_object()
+        try:
+            max_depth = threads.max_depth_param(request.query_params.get('max_depth'))
+        except ValueError:
+            raise ValidationError('max_depth 必须是非负整数')
+        comments = threads.subtree(self.get_queryset().filter(demand_id=root.demand_id), root, max_depth)
+        serializer = CommentTreeSerializer(threads.build_tree(comments), many=True, context=self.get_serializer_context())
+        return Response(serializer.data)